@@ -0,0 +1,116 @@
+# Known answer tests for zigbee_ota_crypto, run with: python -m unittest discover -s tests
+#
+# The AES, AES-MMO and CCM* vectors are published ones. The signed image was made with a throwaway CA, its
+# signature also verifies with OpenSSL's sect163k1 ECDSA against the public key reconstructed from the certificate.
+
+# Imports
+import os, sys, struct, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from zigbee_ota import parse_image
+from zigbee_ota_crypto import SECT163K1_G, SECT163K1_N, AesMmoHash, aes_block_cipher, aes_encrypt_words, aes_expand_key, ccm_star_decrypt
+from zigbee_ota_crypto import point_decode, point_mul
+
+# Useful Defines
+FIPS197_VECTORS = (("000102030405060708090a0b0c0d0e0f", "00112233445566778899aabbccddeeff", "69c4e0d86a7b0430d8cdb78070b4c55a"), # Appendix C.1
+                   ("2b7e151628aed2a6abf7158809cf4f3c", "3243f6a8885a308d313198a2e0370734", "3925841d02dc09fbdc118597196a0b32")) # Appendix B
+ZIGBEE_MMO_VECTORS = (("c0", "ae3a102a28d43ee0d4a09e22788b206c"), # ZigBee specification annex C.5, test vector sets 1 and 2
+                      ("c0c1c2c3c4c5c6c7c8c9cacbcccdcecf", "a7977e88bc0b61e8210827109a228f2d"))
+LONG_MMO_VECTORS = ((8191, "24ec2fe75bbffcb34789bc0610e7f165"), # Bytes 0x00, 0x01, ... (mod 0x100), checked against OpenSSL AES.
+                    (8192, "dc6b0687f09f8607131c170b3bd31591"), # From 8192 bytes (2^16 bits) the 32-bit length padding is used
+                    (8200, "c90000e196b834edb32e6e441e16b464"))
+RFC3610_VECTOR = ("c0c1c2c3c4c5c6c7c8c9cacbcccdcecf", "00000003020100a0a1a2a3a4a5", "0001020304050607", # Packet vector 1, CCM* with M = 8
+                  "588c979a61c663d2f066d0c2c0f989806d5f6b61dac38417e8d12cfdf926e0", "08090a0b0c0d0e0f101112131415161718191a1b1c1d1e")
+SECT163K1_G_COMPRESSED = "0302fe13c0537bbc11acaa07d793de4e6d5e5c94eee8" # SEC 2
+SIGNED_IMAGE_CA = "020611e1a8583183e04fe4031898722fc9eaad765fd1"
+SIGNED_IMAGE = (
+    "1ef1ee0b000139000100021001000200000002007369676e6564207465737420696d6167650000000000000000000000"
+    "00000000ed0000000100004000000000070e151c232a31383f464d545b626970777e858c939aa1a8afb6bdc4cbd2d9e0"
+    "e7eef5fc030a11181f262d343b424950575e656c737a81888f969da4abb2b90200300000000202962ebf20dfe42103bf"
+    "40bf278229db51edaf6aa70022a3000000b00f5445535453454341000000000000000000000100320000000fb0000000"
+    "a3220002fc01af678c02de80b0cf3a0118d3deb70184666c02cb2e85aee75dfd56b3b587869a583dfb3ca01512")
+SIGNED_IMAGE_PAYLOAD_OFFSET = 63 # Header with a security credential version, then the Upgrade Image sub-element header
+
+class AesTest(unittest.TestCase):
+
+    def test_fips197(self):
+        for (key, plaintext, ciphertext) in FIPS197_VECTORS:
+            (key, plaintext) = (key.decode("hex"), plaintext.decode("hex"))
+            self.assertEqual(aes_block_cipher(key)(plaintext).encode("hex"), ciphertext)
+            # The plain Python rounds, whether or not PyCrypto is there to take over
+            words = aes_encrypt_words(aes_expand_key(*struct.unpack(">4I", key)), *struct.unpack(">4I", plaintext))
+            self.assertEqual(struct.pack(">4I", *words).encode("hex"), ciphertext)
+
+    def test_ccm_star(self):
+        (key, nonce, auth_data, data, plaintext) = [value.decode("hex") for value in RFC3610_VECTOR]
+        self.assertEqual(ccm_star_decrypt(key, nonce, auth_data, data, 8), plaintext)
+        self.assertEqual(ccm_star_decrypt(key, nonce, auth_data, data[:-1] + chr(ord(data[-1]) ^ 1), 8), None)
+        self.assertEqual(ccm_star_decrypt(key, nonce, auth_data[1:], data, 8), None)
+
+class AesMmoTest(unittest.TestCase):
+
+    def test_zigbee_vectors(self):
+        for (message, digest) in ZIGBEE_MMO_VECTORS:
+            self.assertEqual(AesMmoHash(message.decode("hex")).hexdigest(), digest)
+
+    def test_long_messages(self):
+        for (length, digest) in LONG_MMO_VECTORS:
+            message = "".join([chr(i & 0xff) for i in xrange(length)])
+            self.assertEqual(AesMmoHash(message).hexdigest(), digest)
+            # Fed in uneven pieces, and a copy taken part way through
+            hashed = AesMmoHash()
+            for offset in xrange(0, length, 1000):
+                hashed.update(message[offset:offset + 7])
+                hashed.update(buffer(message, offset + 7, 993))
+            self.assertEqual(hashed.copy().hexdigest(), digest)
+            self.assertEqual(hashed.hexdigest(), digest)
+
+class Sect163k1Test(unittest.TestCase):
+
+    def test_generator(self):
+        self.assertEqual(point_decode(SECT163K1_G_COMPRESSED.decode("hex")), SECT163K1_G)
+        self.assertEqual(point_mul(SECT163K1_N, SECT163K1_G), None)
+        self.assertRaises(ValueError, point_decode, ("04" + SECT163K1_G_COMPRESSED[2:]).decode("hex"))
+
+class SignatureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ca_public_key = point_decode(SIGNED_IMAGE_CA.decode("hex"))
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.unlink(path)
+
+    def parse(self, data, ca_public_key=None):
+        (fd, path) = tempfile.mkstemp(".zigbee")
+        self.paths.append(path)
+        with os.fdopen(fd, "wb") as imgf:
+            imgf.write(data)
+        return parse_image(path, ca_public_key=ca_public_key or self.ca_public_key)
+
+    def test_signed(self):
+        img = self.parse(SIGNED_IMAGE.decode("hex"))
+        self.assertEqual(img.errors, [])
+        self.assertEqual(img.sig_valid, True)
+        self.assertEqual(img.sig_signer, 0x0022a3000000b00f)
+
+    def test_tampered_payload(self):
+        data = bytearray(SIGNED_IMAGE.decode("hex"))
+        data[SIGNED_IMAGE_PAYLOAD_OFFSET + 7] ^= 0x01
+        img = self.parse(str(data))
+        self.assertEqual(img.sig_valid, False)
+        self.assertEqual(img.errors, ["ECDSA signature doesn't verify"])
+
+    def test_tampered_signature(self):
+        data = bytearray(SIGNED_IMAGE.decode("hex"))
+        data[-1] ^= 0x01
+        img = self.parse(str(data))
+        self.assertEqual(img.sig_valid, False)
+        self.assertEqual(img.errors, ["ECDSA signature doesn't verify"])
+
+    def test_other_ca(self):
+        img = self.parse(SIGNED_IMAGE.decode("hex"), SECT163K1_G)
+        self.assertEqual(img.sig_valid, False)
+
+if __name__ == "__main__":
+    unittest.main()
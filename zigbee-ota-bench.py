@@ -0,0 +1,420 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, random, time, resource, multiprocessing, tempfile, shutil, json, platform, csv, imp
+from zigbee_ota import OTA_UPG_TAG_ID_UPG_IMG, OtaImageBuilder, OtaWrapCache, parse_image, mfg_code_str, mfg_codes
+
+# The wrap tool is a script rather than a module, it's loaded as one so the wrap benchmarks time the tool's own code
+wrap_tool = imp.load_source("zigbee_ota_wrap", os.path.join(os.path.dirname(os.path.abspath(__file__)), "zigbee-ota-wrap.py"))
+
+# Useful Defines
+BENCH_SIZES = "1K,64K,1M,16M"
+BENCH_IMAGES = 64
+BENCH_MAX_SET_BYTES = 256 * 1024 * 1024 # Caps the number of images generated for the bigger payload sizes
+BENCH_REPEAT = 3
+BENCH_SEED = 0x0beef11e
+BENCH_MFG_LOOKUPS = 100000
+BENCH_BLOCK_SIZE = 64 * 1024
+BENCH_EXTRA_SUB_ELEM_LEN = 64
+BENCH_EXTRA_SUB_ELEM_MAX = 3
+BENCH_UNKNOWN_MFG_CODES = (0x0000, 0x0fff, 0x7fff, 0xffff)
+BENCH_NAMES = ("header", "validate", "digest", "mfg_code_str", "wrap", "wrap_cache")
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nBenchmarks the ZigBee OTA tools against a deterministic set of synthetic images."
+    print "\nUsage:"
+    print "\t$ %s [-w <workdir>] [-s <sizes>] [-n <images>] [-r <repeat>] [--seed <seed>] [-b <benchmarks>] [-o <report>] [-c <baseline>]" % (sys.argv[0])
+    print "\t$ %s -g -w <workdir> [-s <sizes>] [-n <images>] [--seed <seed>]" % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-w, --workdir"
+    print "\t\tWhere the synthetic images are generated, they're reused by later runs (default: a temporary directory)"
+    print "\t-s, --sizes"
+    print "\t\tComma separated Upgrade Image payload sizes, with an optional K, M or G suffix (default: %s)" % (BENCH_SIZES)
+    print "\t-n, --images"
+    print "\t\tThe number of images per payload size, capped at %u MiB worth (default: %u)" % (BENCH_MAX_SET_BYTES / (1024 * 1024), BENCH_IMAGES)
+    print "\t-r, --repeat"
+    print "\t\tThe number of times each benchmark is run, the best run is reported (default: %u)" % (BENCH_REPEAT)
+    print "\t--seed"
+    print "\t\tThe seed for the image generator (default: 0x%08x)" % (BENCH_SEED)
+    print "\t-b, --benchmarks"
+    print "\t\tComma separated benchmarks to run (default: %s)" % (",".join(BENCH_NAMES))
+    print "\t-o, --output"
+    print "\t\tAlso writes the report as JSON to this file"
+    print "\t-c, --compare"
+    print "\t\tA JSON report from an earlier run to compare against"
+    print "\t-g, --generate-only"
+    print "\t\tOnly generates the synthetic images"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nThe wrap benchmarks run a manifest through zigbee-ota-wrap.py's batch code, one row at a time, wrap_cache through"
+    print "a wrap cache with the outputs removed before each run (so images are copied from the cache). Peak KiB is how far"
+    print "each benchmark's resident set grew above what its worker started with."
+
+def parse_size(size_str):
+    """Converts a size such as 64K or 1G to bytes."""
+    size_str = size_str.strip().upper()
+    if size_str[-1:] in SIZE_SUFFIXES:
+        return int(size_str[:-1]) * SIZE_SUFFIXES[size_str[-1]]
+    return int(size_str)
+
+def size_str(size):
+    """Converts a number of bytes to the shortest size string that parse_size() takes."""
+    for suffix in ("G", "M", "K"):
+        if size and (size % SIZE_SUFFIXES[suffix] == 0):
+            return "%u%s" % (size / SIZE_SUFFIXES[suffix], suffix)
+    return "%u" % (size)
+
+def bench_mfg_codes():
+    """Returns the manufacturer codes the generator picks from, a mix of known and unknown ones."""
+    return sorted(set(mfg_codes.values())) + list(BENCH_UNKNOWN_MFG_CODES)
+
+def generate_payload(path, size, seed):
+    """Writes a deterministic payload file, made up of a pseudo-random block repeated, unless it's already there."""
+    if os.path.isfile(path) and (os.path.getsize(path) == size):
+        return
+    rng = random.Random(seed)
+    block = "".join([chr(rng.getrandbits(8)) for i in xrange(min(size, BENCH_BLOCK_SIZE))])
+    with open(path, "wb") as payload:
+        remaining = size
+        while remaining > 0:
+            payload.write(buffer(block, 0, min(remaining, len(block))))
+            remaining = remaining - len(block)
+
+def generate_builder(rng, payload_path, index, codes):
+    """Returns an OtaImageBuilder with pseudo-random header fields and sub-elements around a payload file."""
+    field_ctrl = index % 8 # Every combination of the optional header fields in turn
+    builder = OtaImageBuilder(codes[rng.randrange(len(codes))], rng.getrandbits(16), rng.getrandbits(32),
+                              hdr_str="Synthetic image %u" % (index))
+    if field_ctrl & 1:
+        builder.sec_cred_ver = rng.randrange(3)
+    if field_ctrl & 2:
+        builder.dev_spec = rng.getrandbits(64)
+    if field_ctrl & 4:
+        builder.min_hw = rng.getrandbits(8)
+        builder.max_hw = builder.min_hw + rng.getrandbits(8)
+    builder.add_sub_element_file(OTA_UPG_TAG_ID_UPG_IMG, payload_path)
+    for n in xrange((index / 8) % (BENCH_EXTRA_SUB_ELEM_MAX + 1)):
+        data = "".join([chr(rng.getrandbits(8)) for i in xrange(BENCH_EXTRA_SUB_ELEM_LEN)])
+        builder.add_sub_element(0xf000 + n, data)
+    return builder
+
+def generate_images(workdir, sizes, n_images, seed):
+    """Generates (or reuses) the synthetic image set, returns {payload size: ([image paths], payload path)}."""
+    codes = bench_mfg_codes()
+    images = {}
+    for size in sizes:
+        setdir = os.path.join(workdir, "%s-%u-%08x" % (size_str(size), n_images, seed))
+        if not os.path.isdir(setdir):
+            os.makedirs(setdir)
+        payload_path = os.path.join(setdir, "payload.bin")
+        generate_payload(payload_path, size, seed ^ size)
+        rng = random.Random(seed ^ size)
+        paths = []
+        for index in xrange(max(1, min(n_images, BENCH_MAX_SET_BYTES / size))):
+            builder = generate_builder(rng, payload_path, index, codes)
+            path = os.path.join(setdir, "%04u.zigbee" % (index))
+            if not (os.path.isfile(path) and (os.path.getsize(path) == builder.total_img_sz)):
+                with open(path, "wb") as outf:
+                    builder.write_to(outf)
+            paths.append(path)
+        images[size] = (paths, payload_path)
+    return images
+
+def bench_header(paths):
+    """Header-only parse of every image."""
+    for path in paths:
+        parse_image(path, header_only=True)
+
+def bench_validate(paths):
+    """Full validation of every image, sub-elements are seeked over rather than read."""
+    for path in paths:
+        parse_image(path)
+
+def bench_digest(paths):
+    """Full validation of every image, with digests, so every byte is read."""
+    for path in paths:
+        parse_image(path, digest=True)
+
+def write_manifest(manifestpath, payload_path, n_images):
+    """Writes a wrap manifest of n_images rows around a payload file, each with its own output next to the manifest."""
+    with open(manifestpath, "wb") as manifest:
+        writer = csv.writer(manifest)
+        writer.writerow(wrap_tool.MANIFEST_FIELDS)
+        for index in xrange(n_images):
+            writer.writerow([os.path.abspath(payload_path), "1002", "%04x" % (index & 0xffff), "%08x" % (index), "Wrapped", "%04u.zigbee" % (index)])
+
+def bench_wrap(manifestpath, cachedir=None):
+    """Wraps every row of a manifest with zigbee-ota-wrap.py's batch code, through the wrap cache if there is one."""
+    (rows, errors) = wrap_tool.load_manifest(manifestpath)
+    if errors:
+        raise ValueError(errors[0])
+    cache = None
+    if cachedir is not None:
+        cache = OtaWrapCache(cachedir)
+    try:
+        for (builder, outfile) in rows:
+            (digests, stats) = (None, None)
+            if cache is not None:
+                digests = cache.input_digests(builder)
+                stats = cache.file_stats(builder, outfile, digests)
+            (outfile, result, error) = wrap_tool.batch_wrap((builder, outfile, digests, stats), cachedir)
+            if error is not None:
+                raise IOError(error)
+            if cache is not None:
+                (size, status, key, hashed, files) = result
+                cache.store(key, size, hashed, files)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def remove_outputs(manifestpath):
+    """Removes the images a manifest's rows were wrapped to, so a cached wrap has to copy them again."""
+    (rows, errors) = wrap_tool.load_manifest(manifestpath)
+    for (builder, outfile) in rows:
+        if os.path.isfile(outfile):
+            os.unlink(outfile)
+
+def current_rss():
+    """Returns the resident set size of this process in KiB, or its peak so far where /proc/self/statm isn't there."""
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Resets the peak resident set size of this process to its current one, where the kernel allows it (Linux 4.0+)."""
+    try:
+        with open("/proc/self/clear_refs", "wb") as clear_refs:
+            clear_refs.write("5")
+    except (IOError, OSError):
+        pass
+
+def peak_rss():
+    """Returns the peak resident set size of this process in KiB."""
+    try:
+        with open("/proc/self/status", "rb") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def bench_mfg_code_str(lookups):
+    """Looks up the name of every manufacturer code."""
+    for mfg in lookups:
+        mfg_code_str(mfg)
+
+def run_bench(args):
+    """Runs one benchmark in a fresh worker, returns (best seconds, items, bytes moved or None, peak RSS in KiB).
+
+    Bytes are only counted for the benchmarks that read or write the whole image. The peak RSS is measured from what
+    the worker has resident before the benchmark is set up, so the pool's fork of the parent doesn't count."""
+    (name, paths, payload_path, workdir, repeat, seed) = args
+    reset_peak_rss()
+    baseline = current_rss()
+    n_bytes = None
+    wrapdir = None
+    setup = None
+    if name == "mfg_code_str":
+        rng = random.Random(seed)
+        codes = bench_mfg_codes()
+        items = [codes[rng.randrange(len(codes))] for i in xrange(BENCH_MFG_LOOKUPS)]
+        bench_args = (items, )
+    elif name in ("wrap", "wrap_cache"):
+        wrapdir = os.path.join(workdir, "wrap-%u" % (os.getpid()))
+        os.makedirs(wrapdir)
+        manifestpath = os.path.join(wrapdir, "manifest.csv")
+        write_manifest(manifestpath, payload_path, len(paths))
+        items = paths
+        n_bytes = sum([builder.total_img_sz for (builder, outfile) in wrap_tool.load_manifest(manifestpath)[0]])
+        bench_args = (manifestpath, )
+        if name == "wrap_cache":
+            bench_args = (manifestpath, os.path.join(wrapdir, "cache"))
+            bench_wrap(*bench_args) # Fills the cache
+            setup = remove_outputs
+    else:
+        items = paths
+        if name == "digest":
+            n_bytes = sum([os.path.getsize(path) for path in paths])
+        bench_args = (items, )
+    bench = {"header": bench_header, "validate": bench_validate, "digest": bench_digest, "wrap": bench_wrap,
+             "wrap_cache": bench_wrap, "mfg_code_str": bench_mfg_code_str}[name]
+    best = None
+    for i in xrange(repeat):
+        if setup is not None:
+            setup(bench_args[0])
+        start = time.time()
+        bench(*bench_args)
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    if wrapdir is not None:
+        shutil.rmtree(wrapdir, True)
+    return (best, len(items), n_bytes, max(0, peak_rss() - baseline))
+
+def run_benchmarks(images, names, workdir, repeat, seed):
+    """Runs the benchmarks over each image set, each in its own process so peak memory is per benchmark."""
+    results = []
+    jobs = []
+    for size in sorted(images):
+        (paths, payload_path) = images[size]
+        for name in names:
+            if name != "mfg_code_str":
+                jobs.append((name, size, (name, paths, payload_path, workdir, repeat, seed)))
+    if "mfg_code_str" in names:
+        jobs.append(("mfg_code_str", None, ("mfg_code_str", [], None, workdir, repeat, seed)))
+    for (name, size, args) in jobs:
+        pool = multiprocessing.Pool(1)
+        try:
+            (seconds, n_items, n_bytes, peak_rss) = pool.apply(run_bench, (args, ))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        result = {"name": name, "size": size, "items": n_items, "bytes": n_bytes, "seconds": seconds, "peak_rss_kb": peak_rss}
+        result["items_per_s"] = n_items / seconds if seconds else None
+        result["mb_per_s"] = n_bytes / seconds / (1024 * 1024) if (seconds and n_bytes is not None) else None
+        results.append(result)
+        print_result(result)
+        sys.stdout.flush()
+    return results
+
+def result_key(result):
+    """Returns what identifies a result across reports."""
+    return (result["name"], result["size"])
+
+def print_result(result, baseline=None):
+    """Prints one line of the report, with the change in throughput if there's a matching baseline result."""
+    if result["size"] is None:
+        label = result["name"]
+    else:
+        label = "%s/%s" % (result["name"], size_str(result["size"]))
+    if result["mb_per_s"] is None:
+        mb_per_s = "-"
+    else:
+        mb_per_s = "%.1f" % (result["mb_per_s"])
+    line = "%-20s %10u %12.1f %10s %10u" % (label, result["items"], result["items_per_s"] or 0, mb_per_s, result["peak_rss_kb"])
+    if (baseline is not None) and baseline.get("items_per_s") and result["items_per_s"]:
+        line = line + " %+9.1f%%" % ((result["items_per_s"] / baseline["items_per_s"] - 1) * 100)
+    print line
+
+def print_report(results, baseline_results=None):
+    """Prints the report header and results, compared against a baseline report if there is one."""
+    baselines = {}
+    if baseline_results is not None:
+        baselines = dict([(result_key(result), result) for result in baseline_results])
+    header = "%-20s %10s %12s %10s %10s" % ("Benchmark", "Items", "Items/s", "MB/s", "Peak KiB")
+    if baseline_results is not None:
+        header = header + " %10s" % ("vs. base")
+    print header
+    for result in results:
+        print_result(result, baselines.get(result_key(result)))
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hw:s:n:r:b:o:c:g", ["help","workdir=","sizes=","images=","repeat=","seed=","benchmarks=","output=","compare=","generate-only"])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    workdir = None
+    sizes = BENCH_SIZES
+    n_images = BENCH_IMAGES
+    repeat = BENCH_REPEAT
+    seed = BENCH_SEED
+    names = ",".join(BENCH_NAMES)
+    reportpath = None
+    baselinepath = None
+    generate_only = False
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-w", "--workdir"):
+            workdir = a
+        elif o in ("-s", "--sizes"):
+            sizes = a
+        elif o in ("-n", "--images"):
+            n_images = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o == "--seed":
+            seed = int(a, 0)
+        elif o in ("-b", "--benchmarks"):
+            names = a
+        elif o in ("-o", "--output"):
+            reportpath = a
+        elif o in ("-c", "--compare"):
+            baselinepath = a
+        elif o in ("-g", "--generate-only"):
+            generate_only = True
+        else:
+            usage()
+            sys.exit(1)
+
+    try:
+        sizes = [parse_size(size) for size in sizes.split(",")]
+    except ValueError:
+        print "Sizes must be numbers with an optional K, M or G suffix"
+        sys.exit(1)
+    if [size for size in sizes if size < 1]:
+        print "Sizes must be at least 1 byte"
+        sys.exit(1)
+    names = [name.strip() for name in names.split(",")]
+    if [name for name in names if name not in BENCH_NAMES]:
+        print "Benchmarks must be some of: %s" % (", ".join(BENCH_NAMES))
+        sys.exit(1)
+    if (n_images < 1) or (repeat < 1):
+        print "Number of images and repeats must be at least 1"
+        sys.exit(1)
+    if generate_only and (workdir is None):
+        print "Generating only needs a work directory to keep the images in"
+        sys.exit(1)
+    baseline_results = None
+    if baselinepath is not None:
+        try:
+            with open(baselinepath, "rb") as baseline:
+                baseline_results = json.load(baseline)["results"]
+        except (IOError, OSError, ValueError, KeyError), e:
+            print "Unable to read baseline report '%s': %s" % (baselinepath, e)
+            sys.exit(1)
+
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix="zigbee-ota-bench-")
+    try:
+        start = time.time()
+        images = generate_images(workdir, sizes, n_images, seed)
+        print "Generated %u images in %.1fs (%s)" % (sum([len(paths) for (paths, payload_path) in images.values()]), time.time() - start, workdir)
+        if generate_only:
+            return
+        print "%-20s %10s %12s %10s %10s" % ("Benchmark", "Items", "Items/s", "MB/s", "Peak KiB")
+        results = run_benchmarks(images, names, workdir, repeat, seed)
+    finally:
+        if temporary:
+            shutil.rmtree(workdir, True)
+
+    if baseline_results is not None:
+        print "\nCompared with '%s'" % (baselinepath)
+        print_report(results, baseline_results)
+    if reportpath is not None:
+        report = {"python": platform.python_version(), "platform": platform.platform(), "time": time.time(),
+                  "seed": seed, "repeat": repeat, "results": results}
+        with open(reportpath, "wb") as reportf:
+            json.dump(report, reportf, indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
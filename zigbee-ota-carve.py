@@ -0,0 +1,173 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, mmap, json
+from zigbee_ota import carve_images, copy_file_data, expand_paths, load_mfg_codes, mfg_code_str
+from zigbee_ota_crypto import point_decode
+
+# Useful Defines
+OUTPUT_FORMATS = ("text", "jsonl")
+JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nFinds ZigBee OTA Upgrade images embedded in larger files (flash dumps, vendor bundles), and extracts them."
+    print "\nUsage:"
+    print "\t$ %s [-v] [-o <format>] [-H|-D] [-S <ca-public-key>] [-d <output-dir>] <file|directory|glob> ..." % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-d, --output-dir"
+    print "\t\tExtracts each valid image found here, as <file name>-<offset in hex>.zigbee"
+    print "\t-v, --verbose"
+    print "\t\tAlso reports the candidates (spots where the OTA upgrade file identifier turns up) that weren't valid images"
+    print "\t-H, --header-only"
+    print "\t\tOnly checks the header of each candidate, the sub-elements aren't looked at"
+    print "\t-D, --digest"
+    print "\t\tComputes SHA-256 digests of each image and of its Upgrade Image sub-element"
+    print "\t-S, --verify-sig"
+    print "\t\tVerifies ECDSA signatures against the signing certificate, issued by the CA with this public key"
+    print "\t\t(22 bytes of hex, compressed sect163k1 point)"
+    print "\t-o, --format"
+    print "\t\tOutput format, \"text\" (default) or \"jsonl\" for one compact JSON object per image"
+    print "\t-M, --mfg-codes"
+    print "\t\tLoads the manufacturer names from a data file or a copy of Wireshark's packet-zbee.h"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nFiles are mapped and searched in place, whatever their size. A valid image is skipped over as a whole, so"
+    print "images nested inside another image's sub-elements aren't reported separately."
+
+def extract_image(srcf, offset, size, outfile):
+    """Copies an embedded image out to its own file (kernel side where possible), swapping it in once it's complete."""
+    tmp = "%s.%u.tmp" % (outfile, os.getpid())
+    try:
+        with open(tmp, "wb") as outf:
+            srcf.seek(offset)
+            if copy_file_data(srcf, outf, size) != size:
+                raise IOError("%s: ran out of data at 0x%08x" % (srcf.name, offset + size))
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.rename(tmp, outfile)
+
+def format_candidate(offset, img, output_format, extracted=None):
+    """Formats a candidate for output, either as a report line (plus any errors) or as a compact JSON object."""
+    if output_format == "jsonl":
+        record = img.as_dict()
+        record["offset"] = offset
+        if extracted is not None:
+            record["extracted"] = extracted
+        return JSON_ENCODER.encode(record)
+    if not img.valid:
+        return "\n".join(["%s: FAIL" % (img.path)] + ["\terror: %s" % (error) for error in img.errors])
+    line = "%s: OK, 0x%04x (%s) image type 0x%04x version 0x%08x, %u bytes" % (img.path, img.mfg_code, mfg_code_str(img.mfg_code), img.img_type, img.file_ver, img.total_img_sz)
+    if extracted is not None:
+        line = line + " -> %s" % (extracted)
+    return line
+
+def carve_file(filepath, outdir, verbose, header_only, digest, ca_public_key, output_format):
+    """Carves the images out of a file, reporting (and extracting) them as it goes. Returns (candidates, images)."""
+    n_candidates = 0
+    n_images = 0
+    with open(filepath, "rb") as srcf:
+        if os.fstat(srcf.fileno()).st_size == 0:
+            return (0, 0)
+        mapped = mmap.mmap(srcf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for (offset, img) in carve_images(mapped, filepath, header_only, digest, ca_public_key):
+                n_candidates = n_candidates + 1
+                extracted = None
+                if img.valid:
+                    n_images = n_images + 1
+                    if outdir is not None:
+                        extracted = os.path.join(outdir, "%s-%08x.zigbee" % (os.path.basename(filepath), offset))
+                        extract_image(srcf, offset, img.total_img_sz, extracted)
+                elif not verbose:
+                    continue
+                print format_candidate(offset, img, output_format, extracted)
+        finally:
+            mapped.close()
+    return (n_candidates, n_images)
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hd:vHDS:o:M:", ["help","output-dir=","verbose","header-only","digest","verify-sig=","format=","mfg-codes="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    outdir = None
+    verbose = False
+    header_only = False
+    digest = False
+    ca_public_key = None
+    output_format = "text"
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-d", "--output-dir"):
+            outdir = a
+        elif o in ("-v", "--verbose"):
+            verbose = True
+        elif o in ("-H", "--header-only"):
+            header_only = True
+        elif o in ("-D", "--digest"):
+            digest = True
+        elif o in ("-S", "--verify-sig"):
+            try:
+                ca_public_key = point_decode(a.decode("hex"))
+            except (TypeError, ValueError):
+                print "CA public key must be a 22 byte hex compressed sect163k1 point"
+                sys.exit(1)
+        elif o in ("-o", "--format"):
+            output_format = a
+        elif o in ("-M", "--mfg-codes"):
+            load_mfg_codes(a)
+        else:
+            usage()
+            sys.exit(1)
+
+    if output_format not in OUTPUT_FORMATS:
+        print "Output format must be one of: %s" % (", ".join(OUTPUT_FORMATS))
+        sys.exit(1)
+    if header_only and (digest or (ca_public_key is not None)):
+        print "Digests and signatures need the whole image, they can't be combined with a header-only scan"
+        sys.exit(1)
+    if not args:
+        usage()
+        sys.exit(1)
+    if (outdir is not None) and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    n_files = 0
+    n_failed = 0
+    n_candidates = 0
+    n_images = 0
+    for filepath in expand_paths(args):
+        try:
+            (candidates, images) = carve_file(filepath, outdir, verbose, header_only, digest, ca_public_key, output_format)
+        except (IOError, OSError, mmap.error, ValueError), e:
+            sys.stderr.write("Unable to carve '%s': %s\n" % (filepath, e))
+            n_failed = n_failed + 1
+            continue
+        n_files = n_files + 1
+        n_candidates = n_candidates + candidates
+        n_images = n_images + images
+
+    # Keep stdout to just the records when it's being consumed by a machine
+    summary = sys.stdout
+    if output_format == "jsonl":
+        summary = sys.stderr
+    summary.write("Summary: %u files searched, %u candidates, %u images, %u rejected\n" % (n_files, n_candidates, n_images, n_candidates - n_images))
+    if n_failed or not n_images:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, mmap
+from zigbee_ota import OTA_UPG_TAG_ID_UPG_IMG, OTA_UPG_TAG_ID_ECDSA_SIG, OTA_UPG_TAG_ID_ECDSA_SIGN_CERT, OTA_DELTA_TAG_ID, OTA_DELTA_IMG_TYPE_FLAG, OTA_DELTA_IMG_TYPE_MAX
+from zigbee_ota import OtaImageBuilder, expand_paths, parse_image, delta_encode, delta_decode, delta_info
+
+# Useful Defines
+SIGNATURE_TAG_IDS = (OTA_UPG_TAG_ID_ECDSA_SIG, OTA_UPG_TAG_ID_ECDSA_SIGN_CERT)
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nMakes ZigBee OTA Upgrade images that carry a binary delta between successive versions of an image."
+    print "NB: The delta replaces the upgrade image sub-element, signatures are dropped as they'd no longer match"
+    print "\nA delta image keeps the new image's file version, its image type is the new image's with bit 0x%04x set so OTA" % (OTA_DELTA_IMG_TYPE_FLAG)
+    print "servers can tell it from the full image. Pairs whose delta image would be no smaller than the full image are"
+    print "skipped, the full image is the better one to send."
+    print "\nUsage:"
+    print "\t$ %s [-t <tag>] [-o <output>] <old-image> <new-image>" % (sys.argv[0])
+    print "\t$ %s [-t <tag>] [-d <output-dir>] <file|directory|glob> ..." % (sys.argv[0])
+    print "\t$ %s [-t <tag>] -a -o <output> <old-image> <delta-image>" % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-t, --tag"
+    print "\t\tThe 16-bit hex manufacturer specific tag ID the delta is carried in (default: %04x)" % (OTA_DELTA_TAG_ID)
+    print "\t-o, --output"
+    print "\t\tWhere to write the delta image of a single pair, or the rebuilt image with -a"
+    print "\t-d, --output-dir"
+    print "\t\tImages are grouped by manufacturer code, image type, hardware version range and destination, each pair of"
+    print "\t\tsuccessive versions gets a delta image written here as <manufacturer-code>-<image-type>[-hw<min>-<max>]"
+    print "\t\t[-<destination>]-<old-version>-<new-version>.zigbee (images that already are delta images are left out)"
+    print "\t\t(without -o or -d the deltas are only worked out and reported on)"
+    print "\t-a, --apply"
+    print "\t\tRebuilds the new image from the old image and a delta image, with the delta turned back into an"
+    print "\t\tupgrade image sub-element"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nEvery delta is applied again before it's written, to check it rebuilds the new upgrade image exactly."
+
+def read_sub_element(img, tag_id):
+    """Returns the value of an image's (only) sub-element with this tag, raises ValueError if there isn't just one."""
+    found = [(offset, sub_len) for (sub_tag_id, offset, sub_len) in img.sub_elements if sub_tag_id == tag_id]
+    if len(found) != 1:
+        raise ValueError("%s: expected one sub-element with tag 0x%04x, found %u" % (img.path, tag_id, len(found)))
+    (offset, sub_len) = found[0]
+    if sub_len == 0:
+        return ""
+    with open(img.path, "rb") as imgf:
+        mapped = mmap.mmap(imgf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return mapped[offset:offset + sub_len]
+        finally:
+            mapped.close()
+
+def image_builder(img, img_type=None):
+    """Returns an OtaImageBuilder with the same header as a parsed image (but img_type if given), sub-elements are
+    left to the caller."""
+    if img_type is None:
+        img_type = img.img_type
+    return OtaImageBuilder(img.mfg_code, img_type, img.file_ver, img.stack_ver, img.hdr_str, img.sec_cred_ver,
+                           img.dev_spec, img.min_hw, img.max_hw)
+
+def delta_img_type(img):
+    """Returns the Image Type of delta images for a parsed (full) image, raises ValueError if it can't have one."""
+    delta_type = img.img_type | OTA_DELTA_IMG_TYPE_FLAG
+    if (img.img_type & OTA_DELTA_IMG_TYPE_FLAG) or (delta_type > OTA_DELTA_IMG_TYPE_MAX):
+        raise ValueError("%s: image type 0x%04x leaves no room for a delta image type" % (img.path, img.img_type))
+    return delta_type
+
+def is_delta_image(img, tag_id):
+    """Returns True if a parsed image carries a delta rather than an upgrade image."""
+    return tag_id in [sub_tag_id for (sub_tag_id, offset, sub_len) in img.sub_elements]
+
+def write_builder(builder, outfile):
+    """Writes a built image out, swapping it in once it's complete. Returns the image size."""
+    tmp = "%s.%u.tmp" % (outfile, os.getpid())
+    with open(tmp, "wb") as outf:
+        size = builder.write_to(outf)
+    os.rename(tmp, outfile)
+    return size
+
+def make_delta(old, new, tag_id):
+    """Builds the delta image taking a device from old to new (both parsed), checking it rebuilds new.
+
+    Returns (builder, delta length, upgrade image length, signature dropped), raises ValueError if they can't be paired."""
+    if (old.mfg_code, old.img_type) != (new.mfg_code, new.img_type):
+        raise ValueError("%s and %s have a different manufacturer code or image type" % (old.path, new.path))
+    if old.file_ver >= new.file_ver:
+        raise ValueError("%s isn't older than %s" % (old.path, new.path))
+    source = read_sub_element(old, OTA_UPG_TAG_ID_UPG_IMG)
+    target = read_sub_element(new, OTA_UPG_TAG_ID_UPG_IMG)
+    delta = delta_encode(source, target, old.file_ver)
+    if delta_decode(source, delta) != target:
+        raise ValueError("%s -> %s: delta doesn't rebuild the upgrade image" % (old.path, new.path))
+    builder = image_builder(new, delta_img_type(new))
+    dropped = False
+    for (sub_tag_id, offset, sub_len) in new.sub_elements:
+        if sub_tag_id == OTA_UPG_TAG_ID_UPG_IMG:
+            builder.add_sub_element(tag_id, delta)
+        elif sub_tag_id in SIGNATURE_TAG_IDS:
+            dropped = True
+        elif sub_tag_id == tag_id:
+            raise ValueError("%s already has a sub-element with tag 0x%04x" % (new.path, tag_id))
+        else:
+            builder.add_sub_element_file(sub_tag_id, new.path, offset, sub_len)
+    return (builder, len(delta), len(target), dropped)
+
+def apply_delta(old, delta_img, tag_id):
+    """Returns an OtaImageBuilder for the image a delta image was made from, raises ValueError if it doesn't apply."""
+    if (old.mfg_code, delta_img_type(old)) != (delta_img.mfg_code, delta_img.img_type):
+        raise ValueError("%s isn't a delta image for the manufacturer code and image type of %s" % (delta_img.path, old.path))
+    delta = read_sub_element(delta_img, tag_id)
+    (base_file_ver, source_len, target_len) = delta_info(delta)
+    if base_file_ver != old.file_ver:
+        raise ValueError("%s applies to version 0x%08x, not 0x%08x" % (delta_img.path, base_file_ver, old.file_ver))
+    target = delta_decode(read_sub_element(old, OTA_UPG_TAG_ID_UPG_IMG), delta)
+    builder = image_builder(delta_img, old.img_type)
+    for (sub_tag_id, offset, sub_len) in delta_img.sub_elements:
+        if sub_tag_id == tag_id:
+            builder.add_sub_element(OTA_UPG_TAG_ID_UPG_IMG, target)
+        else:
+            builder.add_sub_element_file(sub_tag_id, delta_img.path, offset, sub_len)
+    return builder
+
+def family_name(img):
+    """Returns "<manufacturer-code>-<image-type>", with "-hw<min>-<max>" for a hardware version range and
+    "-<destination>" for a device specific image, which together tell the devices a family of images is for."""
+    name = "%04x-%04x" % (img.mfg_code, img.img_type)
+    if img.min_hw is not None:
+        name = name + "-hw%04x-%04x" % (img.min_hw, img.max_hw)
+    if img.dev_spec is not None:
+        name = name + "-%016x" % (img.dev_spec)
+    return name
+
+def successive_pairs(imgs):
+    """Groups parsed images by manufacturer code, image type, hardware version range and upgrade file destination
+    (so the older image of a pair is one the newer one's devices can have), returns each (older, newer) pair of
+    successive versions."""
+    families = {}
+    for img in imgs:
+        families.setdefault((img.mfg_code, img.img_type, img.min_hw, img.max_hw, img.dev_spec), []).append(img)
+    pairs = []
+    for key in sorted(families):
+        family = sorted(families[key], key=lambda img: img.file_ver)
+        pairs.extend([(old, new) for (old, new) in zip(family, family[1:]) if old.file_ver != new.file_ver])
+    return pairs
+
+def pair_report(old, new, delta_size, full_size, dropped):
+    """Returns the report line for a pair, with the transfer size saved by sending the delta image instead."""
+    line = "%s 0x%08x -> 0x%08x: full %u bytes, delta %u bytes" % (family_name(new), old.file_ver, new.file_ver, full_size, delta_size)
+    if delta_size >= full_size:
+        return line + ", skipped (no smaller than the full image)"
+    line = line + ", saving %.1f%%" % (100.0 * (full_size - delta_size) / full_size)
+    if dropped:
+        line = line + " (signature dropped)"
+    return line
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "ht:o:d:a", ["help","tag=","output=","output-dir=","apply"])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    tag_id = OTA_DELTA_TAG_ID
+    outfile = None
+    outdir = None
+    apply_mode = False
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-t", "--tag"):
+            tag_id = int(a, 16)
+        elif o in ("-o", "--output"):
+            outfile = a
+        elif o in ("-d", "--output-dir"):
+            outdir = a
+        elif o in ("-a", "--apply"):
+            apply_mode = True
+        else:
+            usage()
+            sys.exit(1)
+
+    if not (0xf000 <= tag_id <= 0xffff):
+        print "Tag ID must be a manufacturer specific one (f000-ffff)"
+        sys.exit(1)
+    if (outfile is not None) and (outdir is not None):
+        print "Only one of -o and -d can be given"
+        sys.exit(1)
+    if (apply_mode or (outfile is not None)) and (len(args) != 2):
+        usage()
+        sys.exit(1)
+    if (len(args) < 1) or (apply_mode and (outfile is None)):
+        usage()
+        sys.exit(1)
+
+    imgs = []
+    for filepath in expand_paths(args):
+        img = parse_image(filepath)
+        if not img.valid:
+            print "%s: skipped, invalid image (%s)" % (filepath, "; ".join(img.errors))
+        elif (not apply_mode) and (outfile is None) and is_delta_image(img, tag_id):
+            print "%s: skipped, already a delta image" % (filepath)
+        else:
+            imgs.append(img)
+    if (apply_mode or (outfile is not None)) and (len(imgs) != 2):
+        sys.exit(1)
+
+    # Apply mode, rebuild the new image
+    if apply_mode:
+        try:
+            size = write_builder(apply_delta(imgs[0], imgs[1], tag_id), outfile)
+        except (IOError, OSError, ValueError), e:
+            print "Unable to apply delta: %s" % (e)
+            sys.exit(1)
+        print "%s: %u bytes" % (outfile, size)
+        sys.exit(0)
+
+    if outfile is not None:
+        pairs = [tuple(imgs)]
+    else:
+        if (outdir is not None) and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        pairs = successive_pairs(imgs)
+        if not pairs:
+            print "No successive versions of an image (same manufacturer code, image type, hardware versions and destination) to pair up"
+    n_failed = 0
+    n_skipped = 0
+    total_full = 0
+    total_delta = 0
+    for (old, new) in pairs:
+        try:
+            (builder, delta_len, target_len, dropped) = make_delta(old, new, tag_id)
+            if builder.total_img_sz >= new.file_size:
+                # Devices are better off with the full image, so that's what counts towards the totals
+                print pair_report(old, new, builder.total_img_sz, new.file_size, dropped)
+                n_skipped = n_skipped + 1
+                total_full = total_full + new.file_size
+                total_delta = total_delta + new.file_size
+                continue
+            if outdir is not None:
+                write_builder(builder, os.path.join(outdir, "%s-%08x-%08x.zigbee" % (family_name(new), old.file_ver, new.file_ver)))
+            elif outfile is not None:
+                write_builder(builder, outfile)
+        except (IOError, OSError, ValueError), e:
+            print "Unable to make a delta: %s" % (e)
+            n_failed = n_failed + 1
+            continue
+        print pair_report(old, new, builder.total_img_sz, new.file_size, dropped)
+        total_full = total_full + new.file_size
+        total_delta = total_delta + builder.total_img_sz
+    if len(pairs) > 1:
+        saving = 0.0
+        if total_full:
+            saving = 100.0 * (total_full - total_delta) / total_full
+        print "Summary: %u pairs (%u skipped), full %u bytes, with deltas %u bytes, saving %.1f%%" % (len(pairs) - n_failed, n_skipped, total_full, total_delta, saving)
+    # A single pair asked for with -o that was skipped means there's no output
+    if n_failed or not pairs or ((outfile is not None) and n_skipped):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt
+from zigbee_ota import OTA_UPG_TAG_ID_UPG_IMG, expand_paths, extract_sub_element, tag_id_str
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nCopies the raw value of a sub-element (by default the Upgrade Image) out of ZigBee OTA Upgrade images."
+    print "\nUsage:"
+    print "\t$ %s [-t <tag>|-n <index>] [-o <output>] <zigbee-ota-image>" % (sys.argv[0])
+    print "\t$ %s [-t <tag>|-n <index>] -d <output-dir> <file|directory|glob> ..." % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-t, --tag"
+    print "\t\tThe 16-bit hex tag ID of the sub-element, only one sub-element may have it (default: %04x)" % (OTA_UPG_TAG_ID_UPG_IMG)
+    print "\t-n, --index"
+    print "\t\tThe position of the sub-element instead, counting from 0"
+    print "\t-o, --output"
+    print "\t\tWhere to write the value of a single image's sub-element ('-' for stdout, the default)"
+    print "\t-d, --output-dir"
+    print "\t\tWrites each image's sub-element here as <image name>-<tag>.bin (or <image name>-<index>.bin)"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nValues are copied kernel side (copy_file_range(2) or sendfile(2)) from their offset in the image, sub-element"
+    print "offsets come from an image's sidecar index when it has an up to date one."
+
+def extract_to_file(filepath, outfile, tag_id, index):
+    """Extracts a sub-element to a file, swapping it in once it's complete. Returns the sub-element."""
+    tmp = "%s.%u.tmp" % (outfile, os.getpid())
+    try:
+        with open(tmp, "wb") as outf:
+            sub_element = extract_sub_element(filepath, outf, tag_id, index)
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.rename(tmp, outfile)
+    return sub_element
+
+def report_line(filepath, sub_element, outfile):
+    """Returns the report line for an extracted sub-element."""
+    (tag_id, offset, sub_len) = sub_element
+    return "%s: tag 0x%04x (%s), %u bytes at 0x%08x -> %s" % (filepath, tag_id, tag_id_str(tag_id), sub_len, offset, outfile)
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "ht:n:o:d:", ["help","tag=","index=","output=","output-dir="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    tag_id = None
+    index = None
+    outfile = None
+    outdir = None
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-t", "--tag"):
+            tag_id = int(a, 16)
+        elif o in ("-n", "--index"):
+            index = int(a)
+        elif o in ("-o", "--output"):
+            outfile = a
+        elif o in ("-d", "--output-dir"):
+            outdir = a
+        else:
+            usage()
+            sys.exit(1)
+
+    if (tag_id is not None) and (index is not None):
+        print "Only one of -t and -n can be given"
+        sys.exit(1)
+    if tag_id is None:
+        tag_id = OTA_UPG_TAG_ID_UPG_IMG
+    if (outfile is not None) and (outdir is not None):
+        print "Only one of -o and -d can be given"
+        sys.exit(1)
+    if not args:
+        usage()
+        sys.exit(1)
+
+    # Single image, to a file or stdout
+    if outdir is None:
+        if len(args) != 1 or os.path.isdir(args[0]):
+            print "Several images need an output directory (-d)"
+            sys.exit(1)
+        try:
+            if (outfile is None) or (outfile == "-"):
+                extract_sub_element(args[0], sys.stdout, tag_id, index)
+                sys.stdout.flush()
+            else:
+                print report_line(args[0], extract_to_file(args[0], outfile, tag_id, index), outfile)
+        except (IOError, OSError, ValueError), e:
+            sys.stderr.write("Unable to extract from '%s': %s\n" % (args[0], e))
+            sys.exit(1)
+        sys.exit(0)
+
+    # Batch mode, every image to the output directory
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    n_failed = 0
+    n_extracted = 0
+    written = {}
+    for filepath in expand_paths(args):
+        name = os.path.basename(filepath)
+        if index is not None:
+            outfile = os.path.join(outdir, "%s-%u.bin" % (name, index))
+        else:
+            outfile = os.path.join(outdir, "%s-%04x.bin" % (name, tag_id))
+        # Images with the same name in different directories would overwrite each other
+        if outfile in written:
+            print "%s: skipped, %s was already extracted to %s" % (filepath, written[outfile], outfile)
+            n_failed = n_failed + 1
+            continue
+        written[outfile] = filepath
+        try:
+            print report_line(filepath, extract_to_file(filepath, outfile, tag_id, index), outfile)
+        except (IOError, OSError, ValueError), e:
+            print "%s: skipped, %s" % (filepath, e)
+            n_failed = n_failed + 1
+            continue
+        n_extracted = n_extracted + 1
+    print "Summary: %u sub-elements extracted, %u images skipped" % (n_extracted, n_failed)
+    if n_failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
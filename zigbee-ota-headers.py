@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, mmap, json
+from zigbee_ota import OTA_UPG_HDR_MIN_HDR_LEN, OTA_BULK_SIZE_BUCKETS, numpy, expand_paths, load_mfg_codes, mfg_code_str, zigbee_stack_str
+from zigbee_ota import bulk_decode_headers, bulk_check_headers, bulk_error_counts, bulk_histograms, bulk_catalog_fields
+
+# Useful Defines
+BULK_CHUNK_HEADERS = 1 << 20 # Headers decoded per batch, bounds the memory taken by the temporary arrays
+OUTPUT_FORMATS = ("text", "jsonl")
+JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nReports on large sets of ZigBee OTA Upgrade headers in bulk: checks them and counts them by manufacturer,"
+    print "stack version and size. Needs NumPy."
+    print "\nUsage:"
+    print "\t$ %s [-s <stride>] [-a] [-o <format>] [-c <catalog>] [<header-dump> ...]" % (sys.argv[0])
+    print "\t$ %s [-s <stride>] [-a] [-o <format>] [-w <header-dump>] -i <file|directory|glob> ..." % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-s, --stride"
+    print "\t\tThe size of each record in a header dump, the fixed header (%u bytes) comes first (default: %u)" % (OTA_UPG_HDR_MIN_HDR_LEN, OTA_UPG_HDR_MIN_HDR_LEN)
+    print "\t-c, --catalog"
+    print "\t\tA catalog written by zigbee-ota-check.py -c, its valid images are counted (it keeps no raw headers to check)"
+    print "\t-i, --images"
+    print "\t\tThe arguments are images rather than header dumps, their headers are read into a dump in memory and"
+    print "\t\tchecked against the file sizes too"
+    print "\t-w, --write-dump"
+    print "\t\tWrites the headers read with -i out as a header dump, one record of <stride> bytes per image"
+    print "\t-a, --all"
+    print "\t\tCounts invalid headers in the histograms too (default: only valid ones)"
+    print "\t-o, --format"
+    print "\t\tOutput format, \"text\" (default) or \"jsonl\" for the whole report as one JSON object"
+    print "\t-M, --mfg-codes"
+    print "\t\tLoads the manufacturer names from a data file or a copy of Wireshark's packet-zbee.h"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nA header dump is headers back to back, each padded out to the stride. Checks and histograms are worked out"
+    print "with whole array operations, a batch of up to %u headers at a time." % (BULK_CHUNK_HEADERS)
+
+class HeaderReport(object):
+    """Running totals over batches of headers: how many, their problems, and the histograms."""
+
+    def __init__(self, include_invalid=False):
+        self.include_invalid = include_invalid
+        self.headers = 0
+        self.invalid = 0
+        self.errors = {}
+        self.trailing = 0
+        self.mfg_counts = numpy.zeros(0x10000, numpy.int64)
+        self.stack_counts = numpy.zeros(0x10000, numpy.int64)
+        self.size_counts = numpy.zeros(OTA_BULK_SIZE_BUCKETS, numpy.int64)
+
+    def add_headers(self, headers, file_sizes=None):
+        """Checks a batch of decoded headers and adds them in."""
+        errors = bulk_check_headers(headers, file_sizes)
+        for (message, n) in bulk_error_counts(errors):
+            self.errors[message] = self.errors.get(message, 0) + n
+        good = errors == 0
+        self.headers = self.headers + len(headers)
+        self.invalid = self.invalid + len(headers) - int(numpy.count_nonzero(good))
+        (mfg_codes, stack_vers, sizes) = (headers["mfg_code"], headers["stack_ver"], headers["total_img_sz"])
+        if not self.include_invalid:
+            # Just the fields that are counted, rather than copying whole headers
+            (mfg_codes, stack_vers, sizes) = (mfg_codes[good], stack_vers[good], sizes[good])
+        self.add_histograms(mfg_codes, stack_vers, sizes)
+
+    def add_catalog(self, dbpath):
+        """Adds in the images in a catalog, only the valid ones have fields to count."""
+        (mfg_codes, stack_vers, sizes, n_invalid) = bulk_catalog_fields(dbpath)
+        self.headers = self.headers + len(mfg_codes) + n_invalid
+        self.invalid = self.invalid + n_invalid
+        self.add_histograms(mfg_codes, stack_vers, sizes)
+
+    def add_histograms(self, mfg_codes, stack_vers, sizes):
+        (mfg_counts, stack_counts, size_counts) = bulk_histograms(mfg_codes, stack_vers, sizes)
+        self.mfg_counts += mfg_counts
+        self.stack_counts += stack_counts
+        self.size_counts += size_counts
+
+    def as_dict(self):
+        """Returns the report as a dict of plain (JSON friendly) values."""
+        return {"headers": self.headers, "valid": self.headers - self.invalid, "invalid": self.invalid,
+                "errors": self.errors, "trailing_bytes": self.trailing,
+                "mfg_codes": [{"mfg_code": code, "mfg_name": mfg_code_str(code), "count": n} for (code, n) in ranked(self.mfg_counts)],
+                "stack_vers": [{"stack_ver": ver, "stack_name": zigbee_stack_str(ver), "count": n} for (ver, n) in ranked(self.stack_counts)],
+                "sizes": [{"min": size_bucket_range(bucket)[0], "max": size_bucket_range(bucket)[1], "count": int(self.size_counts[bucket])}
+                          for bucket in numpy.flatnonzero(self.size_counts)]}
+
+def ranked(counts):
+    """Returns [(value, count)] for the non-zero counts, most common first."""
+    values = numpy.flatnonzero(counts)
+    return sorted([(int(value), int(counts[value])) for value in values], key=lambda item: (-item[1], item[0]))
+
+def size_bucket_range(bucket):
+    """Returns the (smallest, biggest) size in a size histogram bucket, biggest is None for the open ended last one."""
+    if bucket == 0:
+        return (0, 0)
+    if bucket == OTA_BULK_SIZE_BUCKETS - 1:
+        return (1 << (bucket - 1), None)
+    return (1 << (bucket - 1), (1 << bucket) - 1)
+
+def report_dump(report, dumppath, stride):
+    """Adds the headers in a dump file to the report, mapping it and decoding a batch at a time."""
+    with open(dumppath, "rb") as dumpf:
+        if os.fstat(dumpf.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(dumpf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            step = BULK_CHUNK_HEADERS * stride
+            for offset in xrange(0, len(mapped) - len(mapped) % stride, step):
+                # The headers view the mapping, so they have to be gone before it's closed
+                headers = bulk_decode_headers(buffer(mapped, offset, step), stride)
+                report.add_headers(headers)
+                del headers
+            report.trailing = report.trailing + len(mapped) % stride
+        finally:
+            mapped.close()
+
+def read_headers(filepaths, stride):
+    """Reads the first stride bytes of each image, returns (records padded out to stride, file sizes)."""
+    records = []
+    sizes = []
+    for filepath in filepaths:
+        try:
+            with open(filepath, "rb", 0) as imgf:
+                size = os.fstat(imgf.fileno()).st_size
+                record = imgf.read(stride)
+        except (IOError, OSError), e:
+            sys.stderr.write("Unable to read '%s': %s\n" % (filepath, e))
+            continue
+        records.append(record + "\0" * (stride - len(record)))
+        sizes.append(size)
+    return (records, sizes)
+
+def report_images(report, filepaths, stride, dumpf=None):
+    """Adds the headers of images to the report a batch at a time, writing them to a dump file as well if given."""
+    for start in xrange(0, len(filepaths), BULK_CHUNK_HEADERS):
+        (records, sizes) = read_headers(filepaths[start:start + BULK_CHUNK_HEADERS], stride)
+        if not records:
+            continue
+        buf = "".join(records)
+        report.add_headers(bulk_decode_headers(buf, stride), numpy.array(sizes, numpy.int64))
+        if dumpf is not None:
+            dumpf.write(buf)
+
+def print_report(report, stride):
+    """Prints the report as text."""
+    print "Headers: %u (%u valid, %u invalid)" % (report.headers, report.headers - report.invalid, report.invalid)
+    if report.trailing:
+        print "\t%u trailing bytes short of a %u byte record ignored" % (report.trailing, stride)
+    if report.errors:
+        print "Problems"
+        for (message, n) in sorted(report.errors.items(), key=lambda item: -item[1]):
+            print "\t%s: %u" % (message, n)
+    counted = max(int(report.size_counts.sum()), 1)
+    print "Manufacturers"
+    for (mfg_code, n) in ranked(report.mfg_counts):
+        print "\t0x%04x (%s): %u (%.1f%%)" % (mfg_code, mfg_code_str(mfg_code), n, n * 100.0 / counted)
+    print "Stack Versions"
+    for (stack_ver, n) in ranked(report.stack_counts):
+        print "\t0x%04x (%s): %u (%.1f%%)" % (stack_ver, zigbee_stack_str(stack_ver), n, n * 100.0 / counted)
+    print "Total Image Sizes"
+    for bucket in numpy.flatnonzero(report.size_counts):
+        n = int(report.size_counts[bucket])
+        (smallest, biggest) = size_bucket_range(bucket)
+        if biggest is None:
+            label = "%u bytes and up" % (smallest)
+        else:
+            label = "%u-%u bytes" % (smallest, biggest)
+        print "\t%s: %u (%.1f%%)" % (label, n, n * 100.0 / counted)
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hs:c:iw:ao:M:", ["help","stride=","catalog=","images","write-dump=","all","format=","mfg-codes="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    stride = OTA_UPG_HDR_MIN_HDR_LEN
+    catalog_path = None
+    images = False
+    dump_path = None
+    include_invalid = False
+    output_format = "text"
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-s", "--stride"):
+            stride = int(a)
+        elif o in ("-c", "--catalog"):
+            catalog_path = a
+        elif o in ("-i", "--images"):
+            images = True
+        elif o in ("-w", "--write-dump"):
+            dump_path = a
+        elif o in ("-a", "--all"):
+            include_invalid = True
+        elif o in ("-o", "--format"):
+            output_format = a
+        elif o in ("-M", "--mfg-codes"):
+            load_mfg_codes(a)
+        else:
+            usage()
+            sys.exit(1)
+
+    if numpy is None:
+        print "NumPy is needed for bulk header decoding, it couldn't be imported"
+        sys.exit(1)
+    if stride < OTA_UPG_HDR_MIN_HDR_LEN:
+        print "Stride must be at least %u bytes" % (OTA_UPG_HDR_MIN_HDR_LEN)
+        sys.exit(1)
+    if output_format not in OUTPUT_FORMATS:
+        print "Output format must be one of: %s" % (", ".join(OUTPUT_FORMATS))
+        sys.exit(1)
+    if (dump_path is not None) and not images:
+        print "Only headers read from images (-i) can be written out as a dump"
+        sys.exit(1)
+    if (not args) and (catalog_path is None):
+        usage()
+        sys.exit(1)
+
+    report = HeaderReport(include_invalid)
+    try:
+        if catalog_path is not None:
+            report.add_catalog(catalog_path)
+        if images:
+            if dump_path is None:
+                report_images(report, expand_paths(args), stride)
+            else:
+                tmp = "%s.%u.tmp" % (dump_path, os.getpid())
+                with open(tmp, "wb") as dumpf:
+                    report_images(report, expand_paths(args), stride, dumpf)
+                os.rename(tmp, dump_path)
+        else:
+            for dumppath in expand_paths(args):
+                report_dump(report, dumppath, stride)
+    except (IOError, OSError, ValueError), e:
+        print "Unable to read headers: %s" % (e)
+        sys.exit(1)
+
+    if output_format == "jsonl":
+        print JSON_ENCODER.encode(report.as_dict())
+    else:
+        print_report(report, stride)
+
+if __name__ == "__main__":
+    main()
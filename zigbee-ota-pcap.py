@@ -0,0 +1,745 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, struct, io, json, math, zlib, collections
+from zigbee_ota import OTA_UPG_HDR_MAX_HDR_LEN, OtaImage, parse_header, load_mfg_codes, mfg_code_str
+from zigbee_ota_crypto import CCM_STAR_L, aes_block_cipher, ccm_star_decrypt, xor_bytes
+
+# Useful Defines
+READ_BUFFER_SIZE = 1024 * 1024
+MAX_RECORD_LEN = 256 * 1024 # Anything longer is a damaged capture rather than a frame
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_HDR_LEN = 24
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_OPT_IF_TSRESOL = 9
+LINKTYPE_ETHERNET = 1
+LINKTYPE_IEEE802_15_4_WITHFCS = 195
+LINKTYPE_IEEE802_15_4_NONASK_PHY = 215
+LINKTYPE_IEEE802_15_4_NOFCS = 230
+LINKTYPE_IEEE802_15_4_TAP = 283
+ETHERTYPE_VLAN = 0x8100
+ETHERTYPE_IPV4 = 0x0800
+IP_PROTO_UDP = 17
+ZEP_PORT = 17754
+ZEP_V2_TYPE_DATA = 1
+TAP_TLV_FCS_TYPE = 0
+MAC_FRAME_TYPE_DATA = 1
+NWK_FRAME_TYPE_DATA = 0
+NWK_SEC_LEVEL = 5 # ENC-MIC-32, the only level ZigBee uses. It's zeroed over the air, so gets put back for decryption
+NWK_SEC_MIC_LEN = 4
+NWK_SEC_KEY_ID_NETWORK = 1
+APS_FRAME_TYPE_DATA = 0
+APS_DELIVERY_GROUP = 3
+ZCL_FRAME_TYPE_CLUSTER = 1
+OTA_CLUSTER_ID = 0x0019
+OTA_CMD_QUERY_NEXT_IMAGE_REQ = 0x01
+OTA_CMD_QUERY_NEXT_IMAGE_RSP = 0x02
+OTA_CMD_IMAGE_BLOCK_REQ = 0x03
+OTA_CMD_IMAGE_BLOCK_RSP = 0x05
+OTA_CMD_UPGRADE_END_REQ = 0x06
+ZCL_STATUS_SUCCESS = 0x00
+ZCL_STATUS_ABORT = 0x95
+ZCL_STATUS_WAIT_FOR_DATA = 0x97
+ZCL_STATUS_NAMES = {0x00: "SUCCESS", 0x7e: "NOT_AUTHORIZED", 0x80: "MALFORMED_COMMAND", 0x81: "UNSUP_CLUSTER_COMMAND",
+                    0x95: "ABORT", 0x96: "INVALID_IMAGE", 0x97: "WAIT_FOR_DATA", 0x98: "NO_IMAGE_AVAILABLE",
+                    0x99: "REQUIRE_MORE_IMAGE"}
+OTA_IMAGE_ID_STRUCT = struct.Struct("<HHI") # Manufacturer code, image type, file version, as in most OTA commands
+DEDUPE_CACHE_SIZE = 4096 # Frames remembered to spot the same frame sniffed again on another hop, or a MAC retry
+DEDUPE_WINDOW = 5.0
+LATENCY_BUCKET_BASE = 0.0001 # Seconds, latencies are bucketed on a log scale, 5% wide, from here up
+LATENCY_BUCKET_GROWTH = 1.05
+OUTPUT_FORMATS = ("text", "jsonl")
+JSON_ENCODER = json.JSONEncoder(separators=(",", ":"), sort_keys=True)
+
+# CRC-16/KERMIT, the 802.15.4 FCS
+crc16_table = []
+for byte in xrange(256):
+    crc = byte
+    for bit in xrange(8):
+        crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    crc16_table.append(crc)
+
+# Latency Histogram
+class LatencyHistogram(object):
+    """Block latencies in log scale buckets, so a transfer of any length takes the same (small) amount of memory."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, seconds):
+        bucket = 0
+        if seconds > LATENCY_BUCKET_BASE:
+            bucket = int(math.log(seconds / LATENCY_BUCKET_BASE) / math.log(LATENCY_BUCKET_GROWTH)) + 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, pct):
+        """Returns the upper edge of the bucket the pct percentile falls in (capped at the maximum), or None."""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(pct / 100.0 * self.count)))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen = seen + self.buckets[bucket]
+            if seen >= rank:
+                return min(LATENCY_BUCKET_BASE * LATENCY_BUCKET_GROWTH ** bucket, self.max)
+        return self.max
+
+# Transfer
+class OtaTransfer(object):
+    """One client downloading one image, as seen in a capture. Times are capture timestamps (seconds)."""
+    __slots__ = ("pan", "client", "ieee", "mfg_code", "img_type", "file_ver", "current_ver", "image_size", "started",
+                 "last_seen", "last_request", "requests", "retries", "responses", "waits", "aborts", "received",
+                 "next_offset", "pending", "latency", "stalls", "longest_stall", "end_status", "ended", "header")
+
+    def __init__(self, pan, client, mfg_code, img_type, file_ver, now):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        (self.pan, self.client, self.mfg_code, self.img_type, self.file_ver) = (pan, client, mfg_code, img_type, file_ver)
+        self.started = self.last_seen = now
+        (self.requests, self.retries, self.responses, self.waits, self.aborts, self.received, self.next_offset,
+         self.stalls, self.longest_stall) = (0, 0, 0, 0, 0, 0, 0, 0, 0.0)
+        self.latency = LatencyHistogram()
+        self.header = ""
+
+    def image(self):
+        """Returns the OtaImage decoded from the start of the transferred data, or None if too little was seen."""
+        if len(self.header) < OTA_UPG_HDR_MAX_HDR_LEN and ((self.image_size is None) or (len(self.header) < self.image_size)):
+            return None
+        img = OtaImage()
+        img.file_size = self.image_size or len(self.header)
+        parse_header(self.header, img)
+        return img
+
+    def as_dict(self):
+        """Returns the transfer as a dict of plain (JSON friendly) values."""
+        end = self.ended if self.ended is not None else self.last_seen
+        duration = end - self.started
+        record = {"pan": self.pan, "client": self.client, "mfg_code": self.mfg_code, "mfg_name": mfg_code_str(self.mfg_code),
+                  "img_type": self.img_type, "file_ver": self.file_ver, "started": self.started, "duration": duration,
+                  "received": self.received, "requests": self.requests, "retries": self.retries, "responses": self.responses,
+                  "waits": self.waits, "aborts": self.aborts, "stalls": self.stalls, "longest_stall": self.longest_stall,
+                  "complete": (self.end_status is not None) or ((self.image_size is not None) and (self.next_offset >= self.image_size))}
+        for name in ("ieee", "current_ver", "image_size", "end_status"):
+            value = getattr(self, name)
+            if value is not None:
+                record[name] = value
+        if duration > 0:
+            record["throughput"] = self.received / duration
+        if self.requests:
+            record["retry_rate"] = float(self.retries) / self.requests
+        if self.latency.count:
+            record["latency"] = {"mean": self.latency.total / self.latency.count, "p50": self.latency.percentile(50),
+                                 "p90": self.latency.percentile(90), "p99": self.latency.percentile(99), "max": self.latency.max}
+        img = self.image()
+        if (img is not None) and img.valid:
+            record["hdr_str"] = img.hdr_str.rstrip("\0").decode("latin-1")
+            record["total_img_sz"] = img.total_img_sz
+        return record
+
+# Capture Decoder
+class OtaCaptureDecoder(object):
+    """Digs OTA Upgrade cluster commands out of captured frames, keeping count of what it had to skip and why."""
+
+    def __init__(self, keys=(), check_fcs=True):
+        self.keys = list(keys)
+        self.check_fcs = check_fcs
+        self.seen = collections.OrderedDict()
+        self.counts = collections.defaultdict(int)
+
+    def frame(self, linktype, data):
+        """Returns (802.15.4 frame, FCS length, FCS is real) for a captured packet, or None if it doesn't carry one."""
+        if linktype == LINKTYPE_IEEE802_15_4_WITHFCS:
+            return (data, 2, True)
+        if linktype == LINKTYPE_IEEE802_15_4_NOFCS:
+            return (data, 0, True)
+        if linktype == LINKTYPE_IEEE802_15_4_NONASK_PHY:
+            if len(data) < 6:
+                return None
+            return (data[6:6 + (ord(data[5]) & 0x7f)], 2, True)
+        if linktype == LINKTYPE_IEEE802_15_4_TAP:
+            if len(data) < 4:
+                return None
+            tap_len = struct.unpack_from("<H", data, 2)[0]
+            fcs_len = 2
+            offset = 4
+            while offset + 4 <= tap_len:
+                (tlv_type, tlv_len) = struct.unpack_from("<HH", data, offset)
+                if (tlv_type == TAP_TLV_FCS_TYPE) and (tlv_len >= 1):
+                    fcs_len = {0: 0, 1: 2, 2: 4}.get(ord(data[offset + 4]), 2)
+                offset = offset + 4 + tlv_len + (-tlv_len % 4)
+            return (data[tap_len:], fcs_len, True)
+        if linktype == LINKTYPE_ETHERNET:
+            return self.zep_frame(data)
+        return None
+
+    def zep_frame(self, data):
+        """Returns the 802.15.4 frame carried by a ZEP (ZigBee Encapsulation Protocol) over UDP/IPv4 packet."""
+        offset = 12
+        ethertype = struct.unpack_from(">H", data, offset)[0] if len(data) >= 14 else None
+        if ethertype == ETHERTYPE_VLAN:
+            offset = offset + 4
+            ethertype = struct.unpack_from(">H", data, offset)[0] if len(data) >= offset + 2 else None
+        offset = offset + 2
+        if (ethertype != ETHERTYPE_IPV4) or (len(data) < offset + 20) or (ord(data[offset + 9]) != IP_PROTO_UDP):
+            return None
+        offset = offset + (ord(data[offset]) & 0x0f) * 4
+        if (len(data) < offset + 8) or (ZEP_PORT not in struct.unpack_from(">HH", data, offset)):
+            return None
+        zep = data[offset + 8:]
+        if (len(zep) < 16) or (zep[0:2] != "EX"):
+            return None
+        version = ord(zep[2])
+        if version == 1:
+            (crc_mode, zep_len, start) = (ord(zep[6]), ord(zep[15]), 16)
+        elif (version == 2) and (ord(zep[3]) == ZEP_V2_TYPE_DATA) and (len(zep) >= 32):
+            (crc_mode, zep_len, start) = (ord(zep[7]), ord(zep[31]), 32)
+        else:
+            return None
+        # The last two bytes are either the FCS or the LQI and RSSI
+        return (zep[start:start + zep_len], 2, crc_mode == 1)
+
+    def fcs_ok(self, frame, fcs_len):
+        """Checks a frame's FCS."""
+        if fcs_len == 2:
+            crc = 0
+            for char in frame[:-2]:
+                crc = (crc >> 8) ^ crc16_table[(crc ^ ord(char)) & 0xff]
+            return struct.pack("<H", crc) == frame[-2:]
+        if fcs_len == 4:
+            return struct.pack("<I", zlib.crc32(frame[:-4]) & 0xffffffff) == frame[-4:]
+        return True
+
+    def decrypt(self, nwk, aux_offset):
+        """Decrypts a NWK secured frame (nwk runs from the NWK header on), returns the payload or None.
+
+        Only the first block is decrypted to start with, frames for other clusters go no further. OTA frames are then
+        decrypted in full and authenticated, with each key in turn."""
+        sec_ctrl = ord(nwk[aux_offset])
+        if not (sec_ctrl & 0x20): # No extended nonce, the source address would have to be looked up
+            self.counts["no_nonce"] = self.counts["no_nonce"] + 1
+            return None
+        payload_offset = aux_offset + 13
+        if (sec_ctrl >> 3) & 0x03 == NWK_SEC_KEY_ID_NETWORK:
+            payload_offset = payload_offset + 1
+        if len(nwk) < payload_offset + NWK_SEC_MIC_LEN:
+            return None
+        sec_ctrl = chr((sec_ctrl & ~0x07) | NWK_SEC_LEVEL)
+        nonce = nwk[aux_offset + 5:aux_offset + 13] + nwk[aux_offset + 1:aux_offset + 5] + sec_ctrl
+        auth_data = nwk[:aux_offset] + sec_ctrl + nwk[aux_offset + 1:payload_offset]
+        counter_block = chr(CCM_STAR_L - 1) + nonce + struct.pack(">H", 1)
+        encrypted = nwk[payload_offset:len(nwk) - NWK_SEC_MIC_LEN]
+        for (index, key) in enumerate(self.keys):
+            if not is_ota_aps(xor_bytes(encrypted, aes_block_cipher(key)(counter_block))):
+                continue
+            payload = ccm_star_decrypt(key, nonce, auth_data, nwk[payload_offset:], NWK_SEC_MIC_LEN)
+            if payload is not None:
+                if index:
+                    self.keys.insert(0, self.keys.pop(index)) # The key in use goes first next time
+                self.counts["decrypted"] = self.counts["decrypted"] + 1
+                return payload
+            self.counts["bad_mic"] = self.counts["bad_mic"] + 1
+        return None
+
+    def decode(self, now, linktype, data):
+        """Returns (pan, NWK source, NWK destination, source IEEE address or None, server to client, ZCL command,
+        ZCL payload) if the packet is an OTA Upgrade cluster command, otherwise None.
+
+        A packet that's too short for the headers and fields it says it has is counted as malformed and skipped, so
+        one bad frame doesn't end the capture."""
+        self.counts["packets"] = self.counts["packets"] + 1
+        try:
+            return self.decode_packet(now, linktype, data)
+        except (struct.error, IndexError):
+            self.counts["malformed"] = self.counts["malformed"] + 1
+            return None
+
+    def decode_packet(self, now, linktype, data):
+        """Does the work of decode(), any header or field that runs past the end of the packet raises."""
+        carried = self.frame(linktype, data)
+        if carried is None:
+            return None
+        (frame, fcs_len, fcs_real) = carried
+        if len(frame) < 3 + fcs_len:
+            return None
+        # 802.15.4 MAC, data frames only
+        fcf = struct.unpack_from("<H", frame)[0]
+        if (fcf & 0x07) != MAC_FRAME_TYPE_DATA:
+            return None
+        if fcf & 0x08:
+            self.counts["mac_secured"] = self.counts["mac_secured"] + 1
+            return None
+        dst_mode = (fcf >> 10) & 0x03
+        src_mode = (fcf >> 14) & 0x03
+        offset = 3
+        pan = None
+        if dst_mode:
+            pan = struct.unpack_from("<H", frame, offset)[0]
+            offset = offset + 2 + (8 if dst_mode == 3 else 2)
+        if src_mode:
+            if not (fcf & 0x40):
+                if pan is None:
+                    pan = struct.unpack_from("<H", frame, offset)[0]
+                offset = offset + 2
+            offset = offset + (8 if src_mode == 3 else 2)
+        nwk = frame[offset:len(frame) - fcs_len]
+        # NWK, data frames only
+        if len(nwk) < 8:
+            return None
+        nwk_fcf = struct.unpack_from("<H", nwk)[0]
+        if ((nwk_fcf & 0x03) != NWK_FRAME_TYPE_DATA) or (((nwk_fcf >> 2) & 0x0f) not in (2, )):
+            return None
+        (nwk_dst, nwk_src, radius, nwk_seq) = struct.unpack_from("<HHBB", nwk, 2)
+        offset = 8
+        if nwk_fcf & 0x0800:
+            offset = offset + 8
+        src_ieee = None
+        if nwk_fcf & 0x1000:
+            if len(nwk) >= offset + 8:
+                src_ieee = struct.unpack_from("<Q", nwk, offset)[0]
+            offset = offset + 8
+        if nwk_fcf & 0x0100:
+            offset = offset + 1
+        if nwk_fcf & 0x0400:
+            if len(nwk) < offset + 2:
+                return None
+            offset = offset + 2 + 2 * ord(nwk[offset])
+        if len(nwk) <= offset:
+            return None
+        fcs_checked = not (self.check_fcs and fcs_real)
+        if nwk_fcf & 0x0200:
+            self.counts["nwk_secured"] = self.counts["nwk_secured"] + 1
+            if not self.keys:
+                return None
+            # Cheaper than decrypting, and keeps damaged frames out of the no key count
+            if not (fcs_checked or self.fcs_ok(frame, fcs_len)):
+                self.counts["bad_fcs"] = self.counts["bad_fcs"] + 1
+                return None
+            fcs_checked = True
+            aps = self.decrypt(nwk, offset)
+            if aps is None:
+                return None
+        else:
+            aps = nwk[offset:]
+        # APS, unfragmented data frames only
+        if len(aps) < 1:
+            return None
+        aps_fcf = ord(aps[0])
+        if (aps_fcf & 0x03) != APS_FRAME_TYPE_DATA:
+            return None
+        offset = 1 + (2 if ((aps_fcf >> 2) & 0x03) == APS_DELIVERY_GROUP else 1)
+        if len(aps) < offset + 6:
+            return None
+        (cluster, profile, src_ep, aps_counter) = struct.unpack_from("<HHBB", aps, offset)
+        if cluster != OTA_CLUSTER_ID:
+            return None
+        if aps_fcf & 0x20:
+            self.counts["aps_secured"] = self.counts["aps_secured"] + 1
+            return None
+        offset = offset + 6
+        if aps_fcf & 0x80:
+            if (len(aps) <= offset) or (ord(aps[offset]) & 0x03):
+                self.counts["fragmented"] = self.counts["fragmented"] + 1
+                return None
+            offset = offset + 1
+        # ZCL, cluster specific commands only
+        zcl = aps[offset:]
+        if (len(zcl) < 3) or ((ord(zcl[0]) & 0x03) != ZCL_FRAME_TYPE_CLUSTER):
+            return None
+        offset = 1 + (2 if ord(zcl[0]) & 0x04 else 0)
+        if len(zcl) < offset + 2:
+            return None
+        (zcl_seq, command) = (ord(zcl[offset]), ord(zcl[offset + 1]))
+        payload = zcl[offset + 2:]
+        # Only OTA (or secured) frames pay for the FCS check, and only OTA frames for the duplicate lookup
+        if not (fcs_checked or self.fcs_ok(frame, fcs_len)):
+            self.counts["bad_fcs"] = self.counts["bad_fcs"] + 1
+            return None
+        key = (pan, nwk_src, nwk_seq, zcl_seq, command, payload[:16])
+        last = self.seen.pop(key, None)
+        self.seen[key] = now
+        if len(self.seen) > DEDUPE_CACHE_SIZE:
+            self.seen.popitem(last=False)
+        if (last is not None) and (now - last < DEDUPE_WINDOW):
+            self.counts["duplicates"] = self.counts["duplicates"] + 1
+            return None
+        self.counts["ota"] = self.counts["ota"] + 1
+        return (pan, nwk_src, nwk_dst, src_ieee, bool(ord(zcl[0]) & 0x08), command, payload)
+
+# Transfer Tracker
+class OtaTransferTracker(object):
+    """Follows the OTA commands of every client in a capture, handing each transfer to report() once it's over.
+
+    A transfer is over when its client sends Upgrade End, starts on another image, or goes quiet for idle seconds
+    (of capture time). Only transfers in progress are kept, so memory is bounded by the number of active clients."""
+
+    def __init__(self, report, stall=5.0, idle=600.0):
+        self.report = report
+        self.stall = stall
+        self.idle = idle
+        self.transfers = {} # (pan, client) -> OtaTransfer
+        self.ieee = {} # (pan, NWK address) -> IEEE address
+        self.current = {} # (pan, client) -> (current file version, hardware version) from Query Next Image
+        self.counts = collections.defaultdict(int)
+        self.last_sweep = None
+
+    def finish(self, client_key, now=None):
+        transfer = self.transfers.pop(client_key, None)
+        if transfer is not None:
+            if now is not None:
+                transfer.ended = now
+            self.report(transfer)
+
+    def transfer(self, now, pan, client, mfg_code, img_type, file_ver):
+        """Returns the client's transfer of this image, starting one (and finishing any other) if need be."""
+        client_key = (pan, client)
+        transfer = self.transfers.get(client_key)
+        if (transfer is not None) and ((transfer.mfg_code, transfer.img_type, transfer.file_ver) != (mfg_code, img_type, file_ver)):
+            self.finish(client_key)
+            transfer = None
+        if transfer is None:
+            transfer = self.transfers[client_key] = OtaTransfer(pan, client, mfg_code, img_type, file_ver, now)
+            transfer.ieee = self.ieee.get(client_key)
+            transfer.current_ver = self.current.get(client_key)
+            self.counts["transfers"] = self.counts["transfers"] + 1
+        transfer.last_seen = now
+        return transfer
+
+    def sweep(self, now):
+        """Finishes transfers that have been idle too long."""
+        for (client_key, transfer) in self.transfers.items():
+            if now - transfer.last_seen > self.idle:
+                self.finish(client_key)
+
+    def command(self, now, pan, nwk_src, nwk_dst, src_ieee, from_server, command, payload):
+        """Follows one OTA Upgrade cluster command."""
+        if src_ieee is not None:
+            self.ieee[(pan, nwk_src)] = src_ieee
+        if (self.last_sweep is None) or (now - self.last_sweep > self.idle / 10):
+            self.sweep(now)
+            self.last_sweep = now
+        client = nwk_dst if from_server else nwk_src
+        try:
+            if (command == OTA_CMD_QUERY_NEXT_IMAGE_REQ) and not from_server:
+                self.counts["queries"] = self.counts["queries"] + 1
+                (field_ctrl, ) = struct.unpack_from("<B", payload)
+                (mfg_code, img_type, file_ver) = OTA_IMAGE_ID_STRUCT.unpack_from(payload, 1)
+                self.current[(pan, client)] = file_ver
+            elif (command == OTA_CMD_QUERY_NEXT_IMAGE_RSP) and from_server:
+                status = ord(payload[0])
+                if status == ZCL_STATUS_SUCCESS:
+                    (mfg_code, img_type, file_ver) = OTA_IMAGE_ID_STRUCT.unpack_from(payload, 1)
+                    transfer = self.transfers.get((pan, client))
+                    if (transfer is not None) and transfer.requests:
+                        self.finish((pan, client)) # Starting over, even if it's on the same image
+                    transfer = self.transfer(now, pan, client, mfg_code, img_type, file_ver)
+                    transfer.image_size = struct.unpack_from("<I", payload, 9)[0]
+                else:
+                    self.counts["no_image"] = self.counts["no_image"] + 1
+            elif (command == OTA_CMD_IMAGE_BLOCK_REQ) and not from_server:
+                (mfg_code, img_type, file_ver) = OTA_IMAGE_ID_STRUCT.unpack_from(payload, 1)
+                (offset, ) = struct.unpack_from("<I", payload, 9)
+                transfer = self.transfer(now, pan, client, mfg_code, img_type, file_ver)
+                if transfer.last_request is not None:
+                    gap = now - transfer.last_request
+                    if gap > self.stall:
+                        transfer.stalls = transfer.stalls + 1
+                        transfer.longest_stall = max(transfer.longest_stall, gap)
+                transfer.requests = transfer.requests + 1
+                if (offset < transfer.next_offset) or ((transfer.pending is not None) and (transfer.pending[0] == offset)):
+                    transfer.retries = transfer.retries + 1
+                transfer.pending = (offset, now)
+                transfer.last_request = now
+            elif (command == OTA_CMD_IMAGE_BLOCK_RSP) and from_server:
+                status = ord(payload[0])
+                transfer = self.transfers.get((pan, client))
+                if status == ZCL_STATUS_SUCCESS:
+                    (mfg_code, img_type, file_ver) = OTA_IMAGE_ID_STRUCT.unpack_from(payload, 1)
+                    (offset, data_size) = struct.unpack_from("<IB", payload, 9)
+                    data = payload[14:14 + data_size]
+                    transfer = self.transfer(now, pan, client, mfg_code, img_type, file_ver)
+                    transfer.responses = transfer.responses + 1
+                    if (transfer.pending is not None) and (transfer.pending[0] == offset):
+                        transfer.latency.add(now - transfer.pending[1])
+                        transfer.pending = None
+                    if offset + len(data) > transfer.next_offset:
+                        transfer.received = transfer.received + offset + len(data) - max(offset, transfer.next_offset)
+                        transfer.next_offset = offset + len(data)
+                    if (offset <= len(transfer.header) < OTA_UPG_HDR_MAX_HDR_LEN) and (offset + len(data) > len(transfer.header)):
+                        transfer.header = (transfer.header + data[len(transfer.header) - offset:])[:OTA_UPG_HDR_MAX_HDR_LEN]
+                elif transfer is not None:
+                    transfer.last_seen = now
+                    transfer.pending = None
+                    if status == ZCL_STATUS_WAIT_FOR_DATA:
+                        transfer.waits = transfer.waits + 1
+                    elif status == ZCL_STATUS_ABORT:
+                        transfer.aborts = transfer.aborts + 1
+            elif (command == OTA_CMD_UPGRADE_END_REQ) and not from_server:
+                status = ord(payload[0])
+                (mfg_code, img_type, file_ver) = OTA_IMAGE_ID_STRUCT.unpack_from(payload, 1)
+                transfer = self.transfer(now, pan, client, mfg_code, img_type, file_ver)
+                transfer.end_status = status
+                self.finish((pan, client), now)
+        except (struct.error, IndexError):
+            self.counts["malformed"] = self.counts["malformed"] + 1
+
+    def close(self):
+        """Finishes every transfer still in progress."""
+        for client_key in sorted(self.transfers.keys()):
+            self.finish(client_key)
+
+# Helper Functions
+def is_ota_aps(aps):
+    """Returns True if the start of an APS frame could be an OTA Upgrade cluster data frame."""
+    if not aps:
+        return False
+    aps_fcf = ord(aps[0])
+    offset = 1 + (2 if ((aps_fcf >> 2) & 0x03) == APS_DELIVERY_GROUP else 1)
+    return ((aps_fcf & 0x03) == APS_FRAME_TYPE_DATA) and (aps[offset:offset + 2] == struct.pack("<H", OTA_CLUSTER_ID))
+
+def usage():
+    """Prints out usage info."""
+    print "\nMeasures ZigBee OTA Upgrade transfers in pcap/pcapng captures, per device and per image."
+    print "\nUsage:"
+    print "\t$ %s [-k <network-key> ...] [-s <seconds>] [-i <seconds>] [-o <format>] [--ignore-fcs] <capture> ..." % (sys.argv[0])
+    print "\nWhere:"
+    print "\t<capture>"
+    print "\t\tA pcap or pcapng file (\"-\" for stdin), several are read one after the other. Link types: IEEE 802.15.4"
+    print "\t\t(with or without FCS, non-ASK PHY, TAP) and Ethernet carrying ZEP (UDP port %u)" % (ZEP_PORT)
+    print "\t-k, --key"
+    print "\t\tA 16 byte hex network key, to read NWK secured frames with (can be repeated)"
+    print "\t-s, --stall"
+    print "\t\tA gap between a client's block requests longer than this many seconds counts as a stall (default: 5)"
+    print "\t-i, --idle"
+    print "\t\tA transfer that goes quiet for this many seconds is reported as it stands (default: 600)"
+    print "\t-o, --format"
+    print "\t\tOutput format, \"text\" (default) or \"jsonl\" for one compact JSON object per transfer"
+    print "\t--ignore-fcs"
+    print "\t\tDon't drop frames with a bad FCS (some sniffers put other things there)"
+    print "\t-M, --mfg-codes"
+    print "\t\tLoads the manufacturer names from a data file or a copy of Wireshark's packet-zbee.h"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+    print "\nTransfers are reported as they finish, with NWK addresses (and IEEE addresses where a frame gave them away)."
+
+def read_exactly(capture, length):
+    """Reads length bytes, raises EOFError if the capture ends first."""
+    data = capture.read(length)
+    if len(data) != length:
+        raise EOFError("capture is truncated")
+    return data
+
+def read_pcap(capture, magic):
+    """Yields (timestamp, link type, packet) from a pcap file, the first four bytes having been read."""
+    for endian in ("<", ">"):
+        (magic_value, ) = struct.unpack(endian + "I", magic)
+        if magic_value in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            break
+    resolution = 1e-9 if magic_value == PCAP_MAGIC_NSEC else 1e-6
+    (major, minor, thiszone, sigfigs, snaplen, linktype) = struct.unpack(endian + "HHiIII", read_exactly(capture, PCAP_HDR_LEN - 4))
+    record = struct.Struct(endian + "IIII")
+    while True:
+        header = capture.read(record.size)
+        if not header:
+            return
+        if len(header) != record.size:
+            raise EOFError("capture is truncated")
+        (ts_sec, ts_frac, incl_len, orig_len) = record.unpack(header)
+        if incl_len > MAX_RECORD_LEN:
+            raise ValueError("record of %u bytes, the capture is damaged" % (incl_len))
+        yield (ts_sec + ts_frac * resolution, linktype & 0x0fffffff, read_exactly(capture, incl_len))
+
+def read_pcapng(capture):
+    """Yields (timestamp, link type, packet) from a pcapng file, the first four bytes having been read.
+
+    Each section has its own byte order and interfaces, packets on interfaces that weren't described are dropped."""
+    endian = "<"
+    interfaces = []
+    block_type = PCAPNG_SHB
+    while True:
+        raw_len = read_exactly(capture, 4)
+        if block_type == PCAPNG_SHB:
+            endian = "<" if struct.unpack("<I", read_exactly(capture, 4))[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            (block_len, ) = struct.unpack(endian + "I", raw_len)
+            if (block_len < 28) or (block_len > MAX_RECORD_LEN):
+                raise ValueError("section header of %u bytes, the capture is damaged" % (block_len))
+            read_exactly(capture, block_len - 12)
+            interfaces = []
+        else:
+            (block_len, ) = struct.unpack(endian + "I", raw_len)
+            if (block_len < 12) or (block_len > MAX_RECORD_LEN) or (block_len % 4):
+                raise ValueError("block of %u bytes, the capture is damaged" % (block_len))
+            body = read_exactly(capture, block_len - 12)
+            read_exactly(capture, 4)
+            if block_type == PCAPNG_IDB:
+                (linktype, reserved, snaplen) = struct.unpack_from(endian + "HHI", body)
+                resolution = 1e-6
+                offset = 8
+                while offset + 4 <= len(body):
+                    (code, opt_len) = struct.unpack_from(endian + "HH", body, offset)
+                    if code == 0:
+                        break
+                    if (code == PCAPNG_OPT_IF_TSRESOL) and (opt_len >= 1):
+                        tsresol = ord(body[offset + 4])
+                        resolution = 2.0 ** -(tsresol & 0x7f) if tsresol & 0x80 else 10.0 ** -tsresol
+                    offset = offset + 4 + opt_len + (-opt_len % 4)
+                interfaces.append((linktype, resolution))
+            elif block_type == PCAPNG_EPB:
+                (interface, ts_high, ts_low, cap_len, orig_len) = struct.unpack_from(endian + "IIIII", body)
+                if interface < len(interfaces):
+                    (linktype, resolution) = interfaces[interface]
+                    yield (((ts_high << 32) | ts_low) * resolution, linktype, body[20:20 + cap_len])
+        block_type = capture.read(4)
+        if not block_type:
+            return
+        if len(block_type) != 4:
+            raise EOFError("capture is truncated")
+        (block_type, ) = struct.unpack(endian + "I", block_type)
+
+def read_capture(capture):
+    """Yields (timestamp, link type, packet) from a pcap or pcapng file object, reading it front to back."""
+    magic = capture.read(4)
+    if len(magic) != 4:
+        return iter(())
+    if struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+        return read_pcapng(capture)
+    if (struct.unpack("<I", magic)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC)) or (struct.unpack(">I", magic)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC)):
+        return read_pcap(capture, magic)
+    raise ValueError("not a pcap or pcapng file")
+
+def address_str(address, width):
+    """Formats a NWK (width 4) or IEEE (width 16) address."""
+    if address is None:
+        return "unknown"
+    return "0x%0*x" % (width, address)
+
+def ms_str(seconds):
+    """Formats a latency."""
+    if seconds is None:
+        return "-"
+    return "%.1f ms" % (seconds * 1000)
+
+def format_transfer(transfer, output_format):
+    """Formats a finished transfer, returns the text to write."""
+    record = transfer.as_dict()
+    if output_format == "jsonl":
+        return JSON_ENCODER.encode(record) + "\n"
+    lines = ["Device %s (%s), PAN %s" % (address_str(transfer.client, 4), address_str(transfer.ieee, 16), address_str(transfer.pan, 4))]
+    image = "\tImage: Manufacturer 0x%04x (%s), Type 0x%04x, Version " % (transfer.mfg_code, record["mfg_name"], transfer.img_type)
+    if transfer.current_ver is not None:
+        image = image + "0x%08x -> " % (transfer.current_ver)
+    image = image + "0x%08x" % (transfer.file_ver)
+    if "hdr_str" in record:
+        image = image + ", \"%s\"" % (record["hdr_str"].encode("utf-8"))
+    lines.append(image)
+    size = transfer.image_size or record.get("total_img_sz")
+    lines.append("\tTransferred: %u%s bytes in %.3f s (%.1f B/s)" % (transfer.received, " of %u" % (size) if size else "", record["duration"], record.get("throughput", 0.0)))
+    lines.append("\tBlocks: %u requests, %u retries (%.2f%%), %u responses, %u waits, %u aborts" % (transfer.requests, transfer.retries, record.get("retry_rate", 0.0) * 100, transfer.responses, transfer.waits, transfer.aborts))
+    latency = record.get("latency", {})
+    lines.append("\tBlock latency: p50 %s, p90 %s, p99 %s, max %s" % (ms_str(latency.get("p50")), ms_str(latency.get("p90")), ms_str(latency.get("p99")), ms_str(latency.get("max"))))
+    lines.append("\tStalls: %u (longest %.3f s)" % (transfer.stalls, transfer.longest_stall))
+    if transfer.end_status is not None:
+        lines.append("\tUpgrade End: %s (0x%02x)" % (ZCL_STATUS_NAMES.get(transfer.end_status, "Unknown"), transfer.end_status))
+    else:
+        lines.append("\tUpgrade End: not seen")
+    return "\n".join(lines) + "\n"
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hk:s:i:o:M:", ["help","key=","stall=","idle=","format=","ignore-fcs","mfg-codes="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    keys = []
+    stall = 5.0
+    idle = 600.0
+    output_format = "text"
+    check_fcs = True
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-k", "--key"):
+            try:
+                key = a.replace(":", "").decode("hex")
+            except TypeError:
+                key = ""
+            if len(key) != 16:
+                print "Network keys must be 16 bytes of hex"
+                sys.exit(1)
+            keys.append(key)
+        elif o in ("-s", "--stall"):
+            stall = float(a)
+        elif o in ("-i", "--idle"):
+            idle = float(a)
+        elif o in ("-o", "--format"):
+            output_format = a
+        elif o == "--ignore-fcs":
+            check_fcs = False
+        elif o in ("-M", "--mfg-codes"):
+            load_mfg_codes(a)
+        else:
+            usage()
+            sys.exit(1)
+
+    if not args:
+        usage()
+        sys.exit(1)
+    if output_format not in OUTPUT_FORMATS:
+        print "Output format must be one of: %s" % (", ".join(OUTPUT_FORMATS))
+        sys.exit(1)
+
+    sys.stdout.flush()
+    output = io.open(sys.stdout.fileno(), "wb", READ_BUFFER_SIZE, closefd=False)
+    decoder = OtaCaptureDecoder(keys, check_fcs)
+    tracker = OtaTransferTracker(lambda transfer: output.write(format_transfer(transfer, output_format)), stall, idle)
+    ok = True
+    try:
+        for path in args:
+            try:
+                if path == "-":
+                    capture = io.open(sys.stdin.fileno(), "rb", READ_BUFFER_SIZE, closefd=False)
+                else:
+                    capture = io.open(path, "rb", READ_BUFFER_SIZE)
+                with capture:
+                    for (now, linktype, data) in read_capture(capture):
+                        command = decoder.decode(now, linktype, data)
+                        if command is not None:
+                            tracker.command(now, *command)
+            except (IOError, OSError, ValueError, EOFError, struct.error), e:
+                sys.stderr.write("%s: %s\n" % (path, e))
+                ok = False
+        tracker.close()
+    except KeyboardInterrupt:
+        ok = False
+    finally:
+        output.flush()
+
+    # Keep stdout to just the records when it's being consumed by a machine
+    counts = dict(decoder.counts)
+    for (name, count) in tracker.counts.items():
+        counts[name] = counts.get(name, 0) + count
+    summary = sys.stderr if output_format == "jsonl" else sys.stdout
+    summary.write("Summary: %u packets, %u OTA commands, %u transfers, %u queries (%u with no image), %u duplicates, %u bad FCS\n" % (counts.get("packets", 0), counts.get("ota", 0), counts.get("transfers", 0), counts.get("queries", 0), counts.get("no_image", 0), counts.get("duplicates", 0), counts.get("bad_fcs", 0)))
+    summary.write("\tSecured: %u NWK (%u OTA frames decrypted, %u failed authentication, %u without a nonce), %u APS, %u MAC, %u fragmented, %u malformed\n" % (counts.get("nwk_secured", 0), counts.get("decrypted", 0), counts.get("bad_mic", 0), counts.get("no_nonce", 0), counts.get("aps_secured", 0), counts.get("mac_secured", 0), counts.get("fragmented", 0), counts.get("malformed", 0)))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+# Imports
+import os, sys, getopt, time
+from zigbee_ota import OtaUpgradeIndex, expand_paths
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nFinds the newest ZigBee OTA Upgrade image for a device, out of a set of images and/or a catalog."
+    print "\nUsage:"
+    print "\t$ %s [-c <catalog>] [<file|directory|glob> ...] -m <manufacturer-code> -i <image-type> -v <current-version>" % (sys.argv[0])
+    print "\t\t[--hw <hardware-version>] [--stack <stack-version>] [--ieee <address>] [--max-version <version>]"
+    print "\t$ %s [-c <catalog>] [<file|directory|glob> ...] -q <query-file> [-r <seconds>]" % (sys.argv[0])
+    print "\nWhere:"
+    print "\t-c, --catalog"
+    print "\t\tA catalog written by zigbee-ota-check.py -c, its valid (fully checked) images are included"
+    print "\t-m, --manufacturer-code"
+    print "\t\tThe 16-bit hex ZigBee assigned manufacturer code"
+    print "\t-i, --image-type"
+    print "\t\tThe 16-bit hex image type"
+    print "\t-v, --version"
+    print "\t\tThe 32-bit hex file version the device is running now"
+    print "\t--hw"
+    print "\t\tThe 16-bit hex hardware version of the device, images with a hardware version range need it to be inside it"
+    print "\t--stack"
+    print "\t\tOnly considers images for this 16-bit hex ZigBee stack version"
+    print "\t--ieee"
+    print "\t\tThe 64-bit hex IEEE address of the device, device specific images only match their destination"
+    print "\t--max-version"
+    print "\t\tThe newest 32-bit hex file version to offer"
+    print "\t-q, --queries"
+    print "\t\tAnswers a query per line ('-' for stdin): <manufacturer-code> <image-type> <current-version> [<hardware-version>"
+    print "\t\t[<ieee>]], all hex, \"-\" for a missing hardware version. Prints \"<version> <path>\" or \"-\" for each, as it goes"
+    print "\t\t--stack and --max-version apply to every query"
+    print "\t-r, --refresh"
+    print "\t\tWhile answering queries, picks up added, changed and removed images at most this often (in seconds)"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+
+def refresh_index(index, paths, catalog_path):
+    """Brings the index up to date with the image paths and the catalog, returns (images added or changed, removed)."""
+    (n_changed, n_removed) = (0, 0)
+    if paths:
+        (n_changed, n_removed) = index.refresh(expand_paths(paths))
+    if catalog_path is not None:
+        # The catalog is its own layer of the index, so only its changes are applied
+        (n_added, n_gone) = index.load_catalog(catalog_path)
+        (n_changed, n_removed) = (n_changed + n_added, n_removed + n_gone)
+    return (n_changed, n_removed)
+
+def format_result(result):
+    """Formats a query result for output."""
+    if result is None:
+        return "-"
+    return "0x%08x %s" % result
+
+def answer_queries(index, queries, paths, catalog_path, refresh, stack_ver=None, max_ver=None):
+    """Answers queries a line at a time, refreshing the index between them if it's due. stack_ver and max_ver are
+    applied to every query."""
+    refreshed = time.time()
+    for line in queries:
+        fields = line.split()
+        if not fields:
+            continue
+        if (refresh is not None) and (time.time() - refreshed >= refresh):
+            refresh_index(index, paths, catalog_path)
+            refreshed = time.time()
+        try:
+            if not (3 <= len(fields) <= 5):
+                raise ValueError("expected 3 to 5 fields")
+            (mfg_code, img_type, file_ver) = [int(field, 16) for field in fields[:3]]
+            hw_ver = None
+            ieee = None
+            if (len(fields) > 3) and (fields[3] != "-"):
+                hw_ver = int(fields[3], 16)
+            if len(fields) > 4:
+                ieee = int(fields[4], 16)
+        except ValueError, e:
+            sys.stdout.write("error: %s\n" % (e))
+        else:
+            sys.stdout.write(format_result(index.query(mfg_code, img_type, file_ver, hw_ver, stack_ver, ieee, max_ver)) + "\n")
+        sys.stdout.flush()
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hc:m:i:v:q:r:", ["help","catalog=","manufacturer-code=","image-type=","version=","hw=","stack=","ieee=",
+                                                                      "max-version=","queries=","refresh="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    catalog_path = None
+    mfg_code = None
+    img_type = None
+    version = None
+    hw_ver = None
+    stack_ver = None
+    ieee = None
+    max_ver = None
+    queries_path = None
+    refresh = None
+
+    # Process options
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-c", "--catalog"):
+            catalog_path = a
+        elif o in ("-m", "--manufacturer-code"):
+            mfg_code = int(a, 16)
+        elif o in ("-i", "--image-type"):
+            img_type = int(a, 16)
+        elif o in ("-v", "--version"):
+            version = int(a, 16)
+        elif o == "--hw":
+            hw_ver = int(a, 16)
+        elif o == "--stack":
+            stack_ver = int(a, 16)
+        elif o == "--ieee":
+            ieee = int(a, 16)
+        elif o == "--max-version":
+            max_ver = int(a, 16)
+        elif o in ("-q", "--queries"):
+            queries_path = a
+        elif o in ("-r", "--refresh"):
+            refresh = float(a)
+        else:
+            usage()
+            sys.exit(1)
+
+    if (not args) and (catalog_path is None):
+        usage()
+        sys.exit(1)
+    if (queries_path is None) and ((mfg_code is None) or (img_type is None) or (version is None)):
+        usage()
+        sys.exit(1)
+    if (catalog_path is not None) and not os.path.isfile(catalog_path):
+        print "Catalog '%s' doesn't exist" % (catalog_path)
+        sys.exit(1)
+
+    index = OtaUpgradeIndex()
+    refresh_index(index, args, catalog_path)
+    if queries_path is None:
+        result = index.query(mfg_code, img_type, version, hw_ver, stack_ver, ieee, max_ver)
+        print format_result(result)
+        if result is None:
+            sys.exit(1)
+        sys.exit(0)
+
+    try:
+        if queries_path == "-":
+            answer_queries(index, iter(sys.stdin.readline, ""), args, catalog_path, refresh, stack_ver, max_ver)
+        else:
+            with open(queries_path, "r") as queries:
+                answer_queries(index, queries, args, catalog_path, refresh, stack_ver, max_ver)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+
+# Imports
+import sys, getopt, heapq, random, math, itertools, json, collections, time
+from zigbee_ota import OTA_UPG_SUB_ELEM_STRUCT, parse_image, tag_id_str
+
+# Useful Defines
+RADIO_RATE = 250000 # 2.4 GHz O-QPSK, bits per second
+REQUEST_FRAME_SIZE = 62 # Image Block Request on air, PHY/MAC/NWK (secured)/APS/ZCL headers and the request itself
+RESPONSE_FRAME_OVERHEAD = 60 # Image Block Response on air, less the image data it carries
+SESSION_CYCLES = 2 # Query Next Image and Upgrade End, a request/response cycle each on top of the blocks
+NB_EXACT_MEAN = 20.0 # Retry counts expected to be higher than this are drawn from a normal approximation
+OUTPUT_FORMATS = ("text", "jsonl")
+PERCENTILES = (50, 90, 99)
+
+# Rollout Model
+class Rollout(object):
+    """One image pushed to a fleet, along with the radio and client behaviour it's simulated with. Times are seconds.
+
+    Each coordinator serves up to concurrency clients at a time out of its share of the fleet, on a channel of its
+    own. A client's Image Block Request/Response cycle holds the channel for the frames' air-time, then takes the
+    (jittered) latency for the response to come back, then the client waits the block period before asking for the
+    next block. A lost cycle is retried after retry_timeout, a block lost more than max_retries times in a row aborts
+    the download, which goes to the back of the queue until the device has had max_attempts goes."""
+
+    def __init__(self, img_size, block_size, latency, concurrency, coordinators=1, loss=0.0, retry_timeout=1.0,
+                 max_retries=3, block_period=0.0, jitter=0.2, max_attempts=3):
+        self.img_size = img_size
+        self.block_size = block_size
+        self.latency = latency
+        self.concurrency = concurrency
+        self.coordinators = coordinators
+        self.loss = loss
+        self.retry_timeout = retry_timeout
+        self.max_retries = max_retries
+        self.block_period = block_period
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.blocks = (img_size + block_size - 1) // block_size
+        self.cycles = self.blocks + SESSION_CYCLES
+        self.airtime = (REQUEST_FRAME_SIZE + RESPONSE_FRAME_OVERHEAD + block_size) * 8.0 / RADIO_RATE
+        self.abort = loss ** (max_retries + 1) # Chance of any one block aborting the download
+
+    def draw_failures(self, rng, successes):
+        """Draws how many cycles are lost on the way to this many successful ones."""
+        if (successes == 0) or (self.loss == 0.0):
+            return 0
+        mean = successes * self.loss / (1.0 - self.loss)
+        if mean > NB_EXACT_MEAN:
+            return max(0, int(round(rng.gauss(mean, math.sqrt(mean / (1.0 - self.loss))))))
+        # Skip from one lost cycle to the next
+        failures = 0
+        log_kept = math.log(1.0 - self.loss)
+        while True:
+            run = int(math.log(1.0 - rng.random()) / log_kept)
+            if run >= successes:
+                return failures
+            successes = successes - run
+            failures = failures + 1
+
+    def draw_session(self, rng, active):
+        """Draws one download sharing the coordinator with active clients (itself included).
+
+        Returns (seconds, completed, lost cycles, cycles on air). Once more clients are active than the channel can
+        keep up with, cycles stretch to the channel's pace rather than the latency's."""
+        cycle = max(self.airtime + self.latency + self.block_period, active * self.airtime)
+        cycles = self.cycles
+        completed = True
+        if self.abort > 0.0:
+            if self.abort >= 1.0:
+                aborted_at = 0
+            else:
+                aborted_at = int(math.log(1.0 - rng.random()) / math.log(1.0 - self.abort))
+            if aborted_at < self.blocks:
+                cycles = 1 + aborted_at
+                completed = False
+        failures = self.draw_failures(rng, cycles)
+        if not completed:
+            failures = failures + self.max_retries + 1
+        seconds = cycles * cycle + failures * self.retry_timeout
+        if self.jitter:
+            seconds = seconds + rng.gauss(0.0, self.latency * self.jitter * math.sqrt(cycles / 3.0))
+        return (max(seconds, 0.0), completed, failures, cycles + failures)
+
+    def draw_latency(self, rng):
+        """Draws the latency of a single cycle."""
+        if not self.jitter:
+            return self.latency
+        return rng.uniform(self.latency * (1.0 - self.jitter), self.latency * (1.0 + self.jitter))
+
+# Helper Functions
+def usage():
+    """Prints out usage info."""
+    print "\nSimulates pushing a ZigBee OTA Upgrade image to a fleet of devices, to estimate how long the rollout takes."
+    print "\nUsage:"
+    print "\t$ %s (-f <zigbee-ota-image> | -s <size>) [-n <devices>] [-b <block-size>] [-l <latency>] [-c <concurrency>]" % (sys.argv[0])
+    print "\t\t[-k <coordinators>] [-p <loss>] [-t <retry-timeout>] [-r <max-retries>] [--block-period <ms>] [--jitter <fraction>]"
+    print "\t\t[--max-attempts <attempts>] [--seed <seed>] [--blocks] [-o <format>]"
+    print "\nWhere:"
+    print "\t-f, --file"
+    print "\t\tThe image to push, its Total Image Size and sub-element layout are used"
+    print "\t-s, --size"
+    print "\t\tThe Total Image Size (in bytes) of a hypothetical image instead"
+    print "\t-n, --devices"
+    print "\t\tThe number of devices in the fleet (default: 1000)"
+    print "\t-b, --block-size"
+    print "\t\tImage data bytes per Image Block Response (default: 64)"
+    print "\t-l, --latency"
+    print "\t\tMilliseconds from a block request going out to its response coming back, less air-time (default: 50)"
+    print "\t-c, --concurrency"
+    print "\t\tClients each coordinator serves at a time (default: 1)"
+    print "\t\t-b, -l and -c take comma separated lists, every combination gets simulated"
+    print "\t-k, --coordinators"
+    print "\t\tCoordinators (each on its own channel) the fleet is split between (default: 1)"
+    print "\t-p, --loss"
+    print "\t\tThe chance of a request/response cycle being lost (default: 0)"
+    print "\t-t, --retry-timeout"
+    print "\t\tMilliseconds a client waits for a lost response before asking again (default: 1000)"
+    print "\t-r, --max-retries"
+    print "\t\tRetries of a block before a client aborts the download (default: 3)"
+    print "\t--block-period"
+    print "\t\tMilliseconds a client waits between blocks, the Minimum Block Period (default: 0)"
+    print "\t--jitter"
+    print "\t\tLatencies are spread evenly this fraction either side of -l (default: 0.2)"
+    print "\t--max-attempts"
+    print "\t\tDownloads a device gets before it's counted as failed (default: 3)"
+    print "\t--seed"
+    print "\t\tSeeds the random draws, so runs can be repeated (default: 1)"
+    print "\t--blocks"
+    print "\t\tSimulates every block request/response cycle rather than drawing whole downloads, much slower but a check"
+    print "\t\ton the default model for small fleets"
+    print "\t-o, --format"
+    print "\t\tOutput format, \"text\" (default) or \"jsonl\" for one JSON object per combination"
+    print "\t-h, --help"
+    print "\t\tShows this usage info"
+
+def simulate_sessions(model, devices, seed):
+    """Simulates a rollout a download at a time, returns (completion times, stats).
+
+    Events are downloads finishing, each coordinator starts the next queued download as a slot frees up."""
+    rng = random.Random(seed)
+    queues = [collections.deque() for coordinator in xrange(model.coordinators)]
+    for device in xrange(devices):
+        queues[device % model.coordinators].append((device, 1))
+    active = [0] * model.coordinators
+    events = []
+    seq = itertools.count()
+    stats = {"lost": 0, "aborted": 0, "failed": 0, "cycles": 0}
+    done = []
+
+    def start(coordinator, now):
+        (device, attempt) = queues[coordinator].popleft()
+        active[coordinator] = active[coordinator] + 1
+        # Slots still to be filled from the queue will be sharing the channel too
+        sharing = min(model.concurrency, active[coordinator] + len(queues[coordinator]))
+        (seconds, completed, failures, cycles) = model.draw_session(rng, sharing)
+        stats["lost"] = stats["lost"] + failures
+        stats["cycles"] = stats["cycles"] + cycles
+        heapq.heappush(events, (now + seconds, next(seq), coordinator, device, attempt, completed))
+
+    for coordinator in xrange(model.coordinators):
+        while queues[coordinator] and (active[coordinator] < model.concurrency):
+            start(coordinator, 0.0)
+    while events:
+        (now, unused, coordinator, device, attempt, completed) = heapq.heappop(events)
+        active[coordinator] = active[coordinator] - 1
+        if completed:
+            done.append(now)
+        else:
+            stats["aborted"] = stats["aborted"] + 1
+            if attempt < model.max_attempts:
+                queues[coordinator].append((device, attempt + 1))
+            else:
+                stats["failed"] = stats["failed"] + 1
+        while queues[coordinator] and (active[coordinator] < model.concurrency):
+            start(coordinator, now)
+    return (done, stats)
+
+def simulate_blocks(model, devices, seed):
+    """Simulates a rollout a request/response cycle at a time, returns (completion times, stats).
+
+    Events are clients sending requests, each coordinator's channel serves them first come first served."""
+    rng = random.Random(seed)
+    queues = [collections.deque() for coordinator in xrange(model.coordinators)]
+    for device in xrange(devices):
+        queues[device % model.coordinators].append((device, 1))
+    active = [0] * model.coordinators
+    channel_free = [0.0] * model.coordinators
+    events = []
+    seq = itertools.count()
+    stats = {"lost": 0, "aborted": 0, "failed": 0, "cycles": 0}
+    done = []
+
+    def start(coordinator, now):
+        (device, attempt) = queues[coordinator].popleft()
+        active[coordinator] = active[coordinator] + 1
+        heapq.heappush(events, (now, next(seq), coordinator, device, attempt, 0, 0))
+
+    def finish(coordinator, now):
+        active[coordinator] = active[coordinator] - 1
+        while queues[coordinator] and (active[coordinator] < model.concurrency):
+            start(coordinator, now)
+
+    for coordinator in xrange(model.coordinators):
+        while queues[coordinator] and (active[coordinator] < model.concurrency):
+            start(coordinator, 0.0)
+    while events:
+        (now, unused, coordinator, device, attempt, cycle, tries) = heapq.heappop(events)
+        on_air = max(now, channel_free[coordinator])
+        channel_free[coordinator] = on_air + model.airtime
+        stats["cycles"] = stats["cycles"] + 1
+        if rng.random() < model.loss:
+            stats["lost"] = stats["lost"] + 1
+            if tries < model.max_retries:
+                heapq.heappush(events, (now + model.retry_timeout, next(seq), coordinator, device, attempt, cycle, tries + 1))
+                continue
+            stats["aborted"] = stats["aborted"] + 1
+            if attempt < model.max_attempts:
+                queues[coordinator].append((device, attempt + 1))
+            else:
+                stats["failed"] = stats["failed"] + 1
+            finish(coordinator, now + model.retry_timeout)
+            continue
+        response = on_air + model.airtime + model.draw_latency(rng)
+        if cycle + 1 == model.cycles:
+            done.append(response)
+            finish(coordinator, response)
+        else:
+            heapq.heappush(events, (response + model.block_period, next(seq), coordinator, device, attempt, cycle + 1, 0))
+    return (done, stats)
+
+def percentile(ordered, pct):
+    """Returns the pct percentile of an ascending list (nearest rank)."""
+    return ordered[max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1)]
+
+def duration_str(seconds):
+    """Formats seconds as [<days>d]hh:mm:ss."""
+    seconds = int(round(seconds))
+    (days, seconds) = divmod(seconds, 86400)
+    text = "%02u:%02u:%02u" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    if days:
+        text = "%ud%s" % (days, text)
+    return text
+
+def summarise(model, devices, done, stats, elapsed):
+    """Returns the result of a simulation as a dict of plain (JSON friendly) values, times in seconds."""
+    done.sort()
+    record = {"block_size": model.block_size, "latency_ms": model.latency * 1000.0, "concurrency": model.concurrency,
+              "coordinators": model.coordinators, "devices": devices, "blocks": model.blocks, "completed": len(done),
+              "failed": stats["failed"], "aborted": stats["aborted"], "lost_cycles": stats["lost"],
+              "simulated_in": round(elapsed, 3)}
+    if done:
+        record["mean"] = sum(done) / len(done)
+        for pct in PERCENTILES:
+            record["p%u" % (pct)] = percentile(done, pct)
+        record["fleet"] = done[-1]
+        record["channel_utilisation"] = stats["cycles"] * model.airtime / (done[-1] * model.coordinators)
+    return record
+
+def layout_lines(img, block_size):
+    """Returns lines describing which blocks each sub-element of an image ends up in."""
+    lines = []
+    for (tag_id, offset, sub_len) in img.sub_elements:
+        first = (offset - OTA_UPG_SUB_ELEM_STRUCT.size) // block_size
+        last = (offset + max(sub_len, 1) - 1) // block_size
+        lines.append("\tSub-element 0x%04x (%s): %u bytes, blocks %u-%u" % (tag_id, tag_id_str(tag_id), sub_len, first, last))
+    return lines
+
+def parse_list(value, convert):
+    """Returns a comma separated option value as a list."""
+    return [convert(item) for item in value.split(",") if item.strip()]
+
+# Main function
+def main():
+    # Set-up options
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hf:s:n:b:l:c:k:p:t:r:o:", ["help","file=","size=","devices=","block-size=","latency=","concurrency=",
+                                                                               "coordinators=","loss=","retry-timeout=","max-retries=","block-period=",
+                                                                               "jitter=","max-attempts=","seed=","blocks","format="])
+    except getopt.GetoptError, e:
+        sys.stderr.write(str(e))
+        usage()
+        sys.exit(1)
+
+    # Default options
+    filepath = None
+    img_size = None
+    devices = 1000
+    block_sizes = [64]
+    latencies = [50.0]
+    concurrencies = [1]
+    coordinators = 1
+    loss = 0.0
+    retry_timeout = 1000.0
+    max_retries = 3
+    block_period = 0.0
+    jitter = 0.2
+    max_attempts = 3
+    seed = 1
+    per_block = False
+    output_format = "text"
+
+    # Process options
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit(0)
+            elif o in ("-f", "--file"):
+                filepath = a
+            elif o in ("-s", "--size"):
+                img_size = int(a)
+            elif o in ("-n", "--devices"):
+                devices = int(a)
+            elif o in ("-b", "--block-size"):
+                block_sizes = parse_list(a, int)
+            elif o in ("-l", "--latency"):
+                latencies = parse_list(a, float)
+            elif o in ("-c", "--concurrency"):
+                concurrencies = parse_list(a, int)
+            elif o in ("-k", "--coordinators"):
+                coordinators = int(a)
+            elif o in ("-p", "--loss"):
+                loss = float(a)
+            elif o in ("-t", "--retry-timeout"):
+                retry_timeout = float(a)
+            elif o in ("-r", "--max-retries"):
+                max_retries = int(a)
+            elif o == "--block-period":
+                block_period = float(a)
+            elif o == "--jitter":
+                jitter = float(a)
+            elif o == "--max-attempts":
+                max_attempts = int(a)
+            elif o == "--seed":
+                seed = int(a)
+            elif o == "--blocks":
+                per_block = True
+            elif o in ("-o", "--format"):
+                output_format = a
+            else:
+                usage()
+                sys.exit(1)
+    except ValueError, e:
+        print "Bad option value: %s" % (e)
+        sys.exit(1)
+
+    if (filepath is None) == (img_size is None):
+        usage()
+        sys.exit(1)
+    if output_format not in OUTPUT_FORMATS:
+        print "Output format must be one of: %s" % (", ".join(OUTPUT_FORMATS))
+        sys.exit(1)
+    if (devices < 1) or (coordinators < 1) or (max_attempts < 1) or (max_retries < 0):
+        print "Devices, coordinators and attempts must be at least 1, retries at least 0"
+        sys.exit(1)
+    if (not block_sizes) or (not latencies) or (not concurrencies) or (min(block_sizes) < 1) or (min(concurrencies) < 1) or (min(latencies) < 0):
+        print "Block sizes and concurrencies must be at least 1, latencies at least 0"
+        sys.exit(1)
+    if not (0.0 <= loss < 1.0) or not (0.0 <= jitter <= 1.0):
+        print "Loss must be at least 0 and less than 1, jitter between 0 and 1"
+        sys.exit(1)
+
+    img = None
+    if filepath is not None:
+        img = parse_image(filepath)
+        if not img.valid:
+            print "%s: invalid image (%s)" % (filepath, "; ".join(img.errors))
+            sys.exit(1)
+        img_size = img.total_img_sz
+
+    simulate = simulate_blocks if per_block else simulate_sessions
+    if output_format == "text":
+        print "Image: %u bytes, %u devices, %u coordinator(s), loss %g, retry timeout %g ms, %u retries, %s model" % (img_size, devices, coordinators, loss, retry_timeout, max_retries, "per block" if per_block else "per download")
+        if (img is not None) and (len(block_sizes) == 1):
+            for line in layout_lines(img, block_sizes[0]):
+                print line
+        print "%6s %8s %5s %8s %12s %12s %12s %12s %8s %8s %6s" % ("block", "latency", "conc", "blocks", "p50", "p90", "p99", "fleet", "aborted", "failed", "chan%")
+    for (block_size, latency, concurrency) in itertools.product(block_sizes, latencies, concurrencies):
+        model = Rollout(img_size, block_size, latency / 1000.0, concurrency, coordinators, loss, retry_timeout / 1000.0,
+                        max_retries, block_period / 1000.0, jitter, max_attempts)
+        started = time.time()
+        (done, stats) = simulate(model, devices, seed)
+        record = summarise(model, devices, done, stats, time.time() - started)
+        if output_format == "jsonl":
+            sys.stdout.write(json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n")
+        elif done:
+            print "%6u %8g %5u %8u %12s %12s %12s %12s %8u %8u %6.1f" % (block_size, latency, concurrency, model.blocks, duration_str(record["p50"]), duration_str(record["p90"]),
+                                                                       duration_str(record["p99"]), duration_str(record["fleet"]), stats["aborted"], stats["failed"], record["channel_utilisation"] * 100)
+        else:
+            print "%6u %8g %5u %8u %12s %12s %12s %12s %8u %8u %6s" % (block_size, latency, concurrency, model.blocks, "-", "-", "-", "-", stats["aborted"], stats["failed"], "-")
+
+if __name__ == "__main__":
+    main()
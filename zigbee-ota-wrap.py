@@ -1,34 +1,23 @@
 #!/usr/bin/python
 
 # Imports
-import os, sys, getopt, struct
+import os, sys, getopt, csv, json, multiprocessing, tempfile, functools
+from zigbee_ota import OTA_UPG_TAG_ID_UPG_IMG, OtaImageBuilder, OtaWrapCache, wrap_cached
 
 # Useful Defines
-OTA_UPG_FILE_ID = 0x0beef11e
-OTA_UPG_HDR_VER = 0x0100
-OTA_UPG_HDR_MIN_HDR_LEN = 0x0038
-OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER = 0x0001
-OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC = 0x0002
-OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER = 0x0004
-OTA_UPG_HDR_FIELD_CTRL_MASK = (OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER | OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC | OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER)
-OTA_UPG_HDR_ZIGBEE_STACK_2006 = 0x0000
-OTA_UPG_HDR_ZIGBEE_STACK_2007 = 0x0001
-OTA_UPG_HDR_ZIGBEE_STACK_PRO = 0x0002
-OTA_UPG_HDR_ZIGBEE_STACK_IP = 0x0003
-OTA_UPG_HDR_SEC_CRED_VER_SE_1_0 = 0x00
-OTA_UPG_HDR_SEC_CRED_VER_SE_1_1 = 0x01
-OTA_UPG_HDR_SEC_CRED_VER_SE_2_0 = 0x02
-OTA_UPG_TAG_ID_UPG_IMG = 0x0000
-OTA_UPG_TAG_ID_ECDSA_SIG = 0x0001
-OTA_UPG_TAG_ID_ECDSA_SIGN_CERT = 0x0002
+MANIFEST_FIELDS = ("file", "manufacturer_code", "image_type", "version", "description", "output")
+MANIFEST_OPTIONAL_FIELDS = ("security_credential", "destination", "min_hw", "max_hw")
 
 # Helper Functions
 def usage():
     """Prints out usage info."""
     print "\nWraps a file in a ZigBee OTA Upgrade image header."
-    print "NB: Very basic, assumes ZigBee Pro stack, doesn't allow for optional header fields, assumes a single upgrade image sub-element"
+    print "NB: Assumes ZigBee Pro stack, the file to wrap becomes the upgrade image sub-element"
     print "\nUsage:"
-    print "\t$ %s -f <file-to-wrap> -m <manufacturer-code> -i <image-type> -v <version> [-d <description>]" % (sys.argv[0])
+    print "\t$ %s -f <file-to-wrap> -m <manufacturer-code> -i <image-type> -v <version> [-d <description>] [-o <output>]" % (sys.argv[0])
+    print "\t\t[-s <security-credential-version>] [-u <destination>] [--min-hw <version> --max-hw <version>] [-e <tag>:<file> ...]"
+    print "\t$ %s -b <manifest> [-j <jobs>]" % (sys.argv[0])
+    print "\tEither form can add [-C <cache-dir> [--cache-max-age <days>] [--cache-max-size <MiB>]]"
     print "\nWhere:"
     print "\t-f, --file"
     print "\t\tThe path to the file to wrap"
@@ -40,14 +29,209 @@ def usage():
     print "\t\tThe 32-bit hex image version"
     print "\t-d, --description"
     print "\t\tASCII string describing the upgrade image (optional, cut-off at 32 characters)"
+    print "\t-o, --output"
+    print "\t\tWhere to write the image, \"-\" for stdout (default: <tmpdir>/<manufacturer-code>-<image-type>-<version>.zigbee)"
+    print "\t-s, --security-credential"
+    print "\t\tThe 8-bit hex security credential version (optional header field)"
+    print "\t-u, --destination"
+    print "\t\tThe 64-bit hex IEEE address of the device the upgrade file is for (optional header field)"
+    print "\t--min-hw, --max-hw"
+    print "\t\tThe 16-bit hex hardware version range the image applies to (optional header field, give both)"
+    print "\t-e, --sub-element"
+    print "\t\tAn extra sub-element after the upgrade image, a 16-bit hex tag ID and the file holding its value (can be repeated)"
+    print "\t-b, --batch"
+    print "\t\tWrap every row of a CSV (with a header row) or JSON (list of objects) manifest, \"-\" for a CSV on stdin"
+    print "\t\tColumns: %s, optionally %s" % (", ".join(MANIFEST_FIELDS), ", ".join(MANIFEST_OPTIONAL_FIELDS))
+    print "\t\tCodes and versions are hex as above, description and output are optional, relative paths are relative to the manifest"
+    print "\t\tAll rows are checked before anything is wrapped"
+    print "\t-j, --jobs"
+    print "\t\tNumber of parallel workers for batch mode (default: number of CPUs)"
+    print "\t-C, --cache"
+    print "\t\tKeep wrapped images in a content addressed cache directory, outputs whose inputs and header are unchanged"
+    print "\t\tare copied from it (or left alone if they already hold the image) instead of being wrapped again. Cached"
+    print "\t\timages and outputs are checked against the content digest before they're reused, unless their stat hasn't"
+    print "\t\tchanged since they were last checked"
+    print "\t--cache-max-age"
+    print "\t\tEvict cached images that haven't been used for this many days"
+    print "\t--cache-max-size"
+    print "\t\tEvict the least recently used cached images until the cache holds at most this many MiB"
     print "\t-h, --help"
     print "\t\tShows this usage info"
 
+def default_outfile(mfg_code, img_type, version):
+    """Returns where an image gets written if no output path is given."""
+    return os.path.join(tempfile.gettempdir(), "%04x-%04x-%08x.zigbee" % (mfg_code, img_type, version))
+
+def parse_hex(value):
+    """Returns a hex string (or a JSON number) as an int, None stays None."""
+    if (value is None) or isinstance(value, (int, long)):
+        return value
+    return int(value, 16)
+
+def wrap_image(builder, outfile, cachedir=None, digests=None, stats=None):
+    """Writes a built image to outfile ("-" for stdout), going through the wrap cache if there is one.
+
+    Returns (size, status, cache key, inputs hashed, file stats), see zigbee_ota.wrap_cached()."""
+    if outfile == "-":
+        size = builder.write_to(sys.stdout)
+        sys.stdout.flush()
+        return (size, "wrapped", None, [], [])
+    if cachedir is not None:
+        (status, key, hashed, files) = wrap_cached(builder, outfile, cachedir, digests, stats)
+        return (builder.total_img_sz, status, key, hashed, files)
+    if os.path.isfile(outfile):
+        os.unlink(outfile) # Could be hard linked from a wrap cache made by an older version, so don't truncate it in place
+    with open(outfile, "wb") as outf:
+        return (builder.write_to(outf), "wrapped", None, [], [])
+
+def cache_summary(cache, counts, max_age, max_size):
+    """Evicts from and closes the wrap cache, then prints what it did."""
+    (n_evicted, n_freed) = cache.evict(max_age, max_size)
+    cache.close()
+    print "Cache: %u wrapped, %u copied, %u unchanged, %u evicted (%u bytes)" % (counts.get("wrapped", 0), counts.get("copied", 0), counts.get("unchanged", 0), n_evicted, n_freed)
+
+def load_manifest(manifestpath):
+    """Reads a batch manifest, returns (rows, errors).
+
+    Each row is a (builder, outfile) tuple, every row is checked so all the problems in a manifest get reported in
+    one go. Errors are strings prefixed with the row they refer to."""
+    if manifestpath == "-":
+        basedir = ""
+        records = list(csv.DictReader(sys.stdin))
+    else:
+        basedir = os.path.dirname(manifestpath)
+        with open(manifestpath, "rb") as manifest:
+            if manifestpath.lower().endswith(".json"):
+                records = json.load(manifest)
+                if not isinstance(records, list):
+                    return ([], ["%s: expected a list of rows" % (manifestpath)])
+            else:
+                records = list(csv.DictReader(manifest))
+    rows = []
+    errors = []
+    outfiles = {}
+    for (index, record) in enumerate(records):
+        where = "row %u" % (index + 1)
+        if not isinstance(record, dict):
+            errors.append("%s: expected an object" % (where))
+            continue
+        values = []
+        for name in MANIFEST_FIELDS + MANIFEST_OPTIONAL_FIELDS:
+            value = record.get(name)
+            if isinstance(value, basestring):
+                value = value.strip()
+            values.append(value if value not in ("", None) else None)
+        (filepath, mfg_code, img_type, version, description, outfile) = values[:len(MANIFEST_FIELDS)]
+        row_errors = []
+        for name in [name for (name, value) in zip(MANIFEST_FIELDS, values)[:4] if value is None]:
+            row_errors.append("missing %s" % (name))
+        try:
+            (mfg_code, img_type, version, sec_cred_ver, dev_spec, min_hw, max_hw) = [parse_hex(value) for value in values[1:4] + values[len(MANIFEST_FIELDS):]]
+        except (TypeError, ValueError):
+            if not row_errors:
+                row_errors.append("%s must be hex values" % (", ".join(MANIFEST_FIELDS[1:4] + MANIFEST_OPTIONAL_FIELDS)))
+        if not row_errors:
+            if description is None:
+                description = ""
+            description = str(description)
+            builder = OtaImageBuilder(mfg_code, img_type, version, hdr_str=description, sec_cred_ver=sec_cred_ver,
+                                      dev_spec=dev_spec, min_hw=min_hw, max_hw=max_hw)
+            filepath = os.path.join(basedir, filepath)
+            if os.path.isfile(filepath):
+                builder.add_sub_element_file(OTA_UPG_TAG_ID_UPG_IMG, filepath)
+            else:
+                row_errors.append("'%s' isn't a file" % (filepath))
+            row_errors.extend(builder.check())
+            if outfile is None:
+                outfile = default_outfile(mfg_code, img_type, version)
+            elif outfile == "-":
+                row_errors.append("output can't be stdout in a manifest")
+            else:
+                outfile = os.path.join(basedir, outfile)
+            key = os.path.abspath(outfile)
+            if key in outfiles:
+                row_errors.append("'%s' is also written by row %u" % (outfile, outfiles[key] + 1))
+            else:
+                outfiles[key] = index
+        if row_errors:
+            errors.extend(["%s: %s" % (where, error) for error in row_errors])
+        else:
+            rows.append((builder, outfile))
+    return (rows, errors)
+
+def batch_wrap(row, cachedir=None):
+    """Wraps one manifest row in a pool worker, returns (outfile, (size, status, cache key, inputs hashed, file stats),
+    error or None)."""
+    (builder, outfile, digests, stats) = row
+    try:
+        return (outfile, wrap_image(builder, outfile, cachedir, digests, stats), None)
+    except (IOError, OSError), e:
+        return (outfile, None, str(e))
+
+def batch_main(manifestpath, jobs, cachedir, max_age, max_size):
+    """Checks then wraps every row of a manifest, returns True if they were all wrapped."""
+    try:
+        (rows, errors) = load_manifest(manifestpath)
+    except (IOError, OSError, ValueError, csv.Error), e:
+        print "Unable to read manifest '%s': %s" % (manifestpath, e)
+        return False
+    if errors:
+        for error in errors:
+            print error
+        print "Manifest has %u problems, nothing wrapped" % (len(errors))
+        return False
+    for (builder, outfile) in rows:
+        if (len(builder.hdr_str) > 32):
+            print "%s: Description string will be cut-off at 32 characters" % (outfile)
+    cache = None
+    if cachedir is not None:
+        cache = OtaWrapCache(cachedir)
+        rows = [(builder, outfile, cache.input_digests(builder)) for (builder, outfile) in rows]
+        rows = [(builder, outfile, digests, cache.file_stats(builder, outfile, digests)) for (builder, outfile, digests) in rows]
+    else:
+        rows = [(builder, outfile, None, None) for (builder, outfile) in rows]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    n_wrapped = 0
+    n_failed = 0
+    n_bytes = 0
+    counts = {}
+    if rows:
+        pool = multiprocessing.Pool(min(jobs, len(rows)))
+        try:
+            for (outfile, result, error) in pool.imap(functools.partial(batch_wrap, cachedir=cachedir), rows):
+                if error is None:
+                    (size, status, key, hashed, files) = result
+                    n_wrapped = n_wrapped + 1
+                    n_bytes = n_bytes + size
+                    counts[status] = counts.get(status, 0) + 1
+                    if cache is not None:
+                        cache.store(key, size, hashed, files)
+                    if status == "wrapped":
+                        print "Created '%s' (%u bytes)" % (outfile, size)
+                    else:
+                        print "Created '%s' (%u bytes, %s from cache)" % (outfile, size, status)
+                else:
+                    n_failed = n_failed + 1
+                    print "Failed '%s': %s" % (outfile, error)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    print "Summary: %u images wrapped (%u bytes), %u failed" % (n_wrapped, n_bytes, n_failed)
+    if cache is not None:
+        cache_summary(cache, counts, max_age, max_size)
+    return n_failed == 0
+
 # Main function
 def main():
     # Set-up options
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hf:m:i:v:d:", ["help","file=","manufacturer-code=","image-type=","version=","description="])
+        opts, args = getopt.getopt(sys.argv[1:], "hf:m:i:v:d:b:j:o:s:u:e:C:", ["help","file=","manufacturer-code=","image-type=","version=","description=","batch=","jobs=",
+                                                                      "output=","security-credential=","destination=","min-hw=","max-hw=","sub-element=",
+                                                                         "cache=","cache-max-age=","cache-max-size="])
     except getopt.GetoptError, e:
         sys.stderr.write(str(e))
         usage()
@@ -59,8 +243,17 @@ def main():
     mfg_code = None
     img_type = None
     version = None
-    stack = None
     description = None
+    sec_cred_ver = None
+    dev_spec = None
+    min_hw = None
+    max_hw = None
+    sub_elements = []
+    manifestpath = None
+    jobs = None
+    cachedir = None
+    max_age = None
+    max_size = None
 
     # Process options
     for o, a in opts:
@@ -77,46 +270,89 @@ def main():
             version = int(a, 16)
         elif o in ("-d", "--description"):
             description = a
+        elif o in ("-o", "--output"):
+            outfile = a
+        elif o in ("-s", "--security-credential"):
+            sec_cred_ver = int(a, 16)
+        elif o in ("-u", "--destination"):
+            dev_spec = int(a, 16)
+        elif o == "--min-hw":
+            min_hw = int(a, 16)
+        elif o == "--max-hw":
+            max_hw = int(a, 16)
+        elif o in ("-e", "--sub-element"):
+            (tag_id, sep, sub_path) = a.partition(":")
+            if not (sep and sub_path):
+                print "Sub-element must be given as <tag>:<file>"
+                sys.exit(1)
+            sub_elements.append((int(tag_id, 16), sub_path))
+        elif o in ("-b", "--batch"):
+            manifestpath = a
+        elif o in ("-j", "--jobs"):
+            jobs = int(a)
+        elif o in ("-C", "--cache"):
+            cachedir = a
+        elif o == "--cache-max-age":
+            max_age = float(a) * 24 * 60 * 60
+        elif o == "--cache-max-size":
+            max_size = int(float(a) * 1024 * 1024)
         else:
             usage()
             sys.exit(1)
 
+    if (jobs is not None) and (jobs < 1):
+        print "Number of jobs must be at least 1"
+        sys.exit(1)
+    if manifestpath is not None:
+        if not batch_main(manifestpath, jobs, cachedir, max_age, max_size):
+            sys.exit(1)
+        sys.exit(0)
+
     if (filepath is None) or (mfg_code is None) or (img_type is None) or (version is None):
         usage()
         sys.exit(1)
     if (description is None):
         description = ""
+    # Keep stdout to just the image when it's written there
+    messages = sys.stdout
+    if outfile == "-":
+        messages = sys.stderr
 
-    if (mfg_code > 0xffff):
-        print "Manufacturer Code must be a 16-bit hex value"
-        sys.exit(1)
-    if (img_type > 0xffff):
-        print "Image Type must be a 16-bit hex value"
+    builder = OtaImageBuilder(mfg_code, img_type, version, hdr_str=description, sec_cred_ver=sec_cred_ver,
+                              dev_spec=dev_spec, min_hw=min_hw, max_hw=max_hw)
+    try:
+        builder.add_sub_element_file(OTA_UPG_TAG_ID_UPG_IMG, filepath)
+        for (tag_id, sub_path) in sub_elements:
+            builder.add_sub_element_file(tag_id, sub_path)
+    except (IOError, OSError), e:
+        messages.write("%s\n" % (e))
         sys.exit(1)
-    if (version > 0xffffffff):
-        print "Version must be a 32-bit hex value"
+    errors = builder.check()
+    if errors:
+        messages.write("%s\n" % (errors[0]))
         sys.exit(1)
     if (len(description) > 32):
-        print "Description string will be cut-off at 32 characters"
-
-    # Open file
-    with open(filepath, "rb") as myfile:
-        # stat the file and squirrel away the size for later
-        filestat = os.stat(filepath)
-        filestat_size = filestat.st_size
-
-        stack = OTA_UPG_HDR_ZIGBEE_STACK_PRO
-        field_ctrl = 0
-        total_img_sz = filestat_size + OTA_UPG_HDR_MIN_HDR_LEN + 6
-        outfile = "/tmp/%04x-%04x-%08x.zigbee" % (mfg_code, img_type, version)
+        messages.write("Description string will be cut-off at 32 characters\n")
+
+    if outfile is None:
+        outfile = default_outfile(mfg_code, img_type, version)
+    if outfile != "-":
         print "Creating '%s'" % outfile
-        with open(outfile, "wb+") as outf:
-            ota_hdr = struct.pack("<IHHHHHIH32sI", OTA_UPG_FILE_ID, OTA_UPG_HDR_VER, OTA_UPG_HDR_MIN_HDR_LEN, field_ctrl, mfg_code, img_type, version, stack, description, total_img_sz)
-            outf.write(ota_hdr)
-            sub_elem_upg_img = struct.pack("<HI", 0, filestat_size)
-            outf.write(sub_elem_upg_img)
-            img = myfile.read()
-            outf.write(img)
+    cache = None
+    digests = None
+    stats = None
+    if (cachedir is not None) and (outfile != "-"):
+        cache = OtaWrapCache(cachedir)
+        digests = cache.input_digests(builder)
+        stats = cache.file_stats(builder, outfile, digests)
+    try:
+        (size, status, key, hashed, files) = wrap_image(builder, outfile, cachedir, digests, stats)
+    except (IOError, OSError), e:
+        messages.write("%s\n" % (e))
+        sys.exit(1)
+    if cache is not None:
+        cache.store(key, size, hashed, files)
+        cache_summary(cache, {status: 1}, max_age, max_size)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,2054 @@
+# ZigBee OTA Upgrade image parsing, shared by the zigbee-ota-* tools
+#
+# Importable counterpart of zigbee-ota-check.py, e.g.
+#   img = zigbee_ota.parse_image("/path/to/image.zigbee")
+#   if not img.valid:
+#       print img.errors
+
+# Imports
+import os, struct, sqlite3, hashlib, errno, mmap, time, resource, glob, bisect, json, zipfile, tarfile, zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from zigbee_ota_crypto import AesMmoHash, ecqv_public_key, ecdsa_verify, ECQV_CERT_LEN, ECQV_CERT_SUBJECT_OFFSET, ECDSA_SIG_LEN
+
+# Useful Defines
+OTA_UPG_FILE_ID = 0x0beef11e
+OTA_UPG_HDR_VER = 0x0100
+OTA_UPG_HDR_MIN_HDR_LEN = 0x0038
+OTA_UPG_HDR_MAX_HDR_LEN = OTA_UPG_HDR_MIN_HDR_LEN + 1 + 8 + 4 # With all the optional fields present
+OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER = 0x0001
+OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC = 0x0002
+OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER = 0x0004
+OTA_UPG_HDR_FIELD_CTRL_MASK = (OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER | OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC | OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER)
+OTA_UPG_HDR_ZIGBEE_STACK_2006 = 0x0000
+OTA_UPG_HDR_ZIGBEE_STACK_2007 = 0x0001
+OTA_UPG_HDR_ZIGBEE_STACK_PRO = 0x0002
+OTA_UPG_HDR_ZIGBEE_STACK_IP = 0x0003
+OTA_UPG_HDR_SEC_CRED_VER_SE_1_0 = 0x00
+OTA_UPG_HDR_SEC_CRED_VER_SE_1_1 = 0x01
+OTA_UPG_HDR_SEC_CRED_VER_SE_2_0 = 0x02
+OTA_UPG_TAG_ID_UPG_IMG = 0x0000
+OTA_UPG_TAG_ID_ECDSA_SIG = 0x0001
+OTA_UPG_TAG_ID_ECDSA_SIGN_CERT = 0x0002
+OTA_UPG_ECDSA_SIG_LEN = 8 + ECDSA_SIG_LEN # Signer IEEE address, r, s
+
+# Precompiled layouts, shared by the parser and OtaImageBuilder
+OTA_UPG_HDR_PREFIX_STRUCT = struct.Struct("<IHH")
+OTA_UPG_HDR_STRUCT = struct.Struct("<IHHHHHIH32sI")
+OTA_UPG_SUB_ELEM_STRUCT = struct.Struct("<HI")
+OTA_UPG_HDR_SEC_CRED_VER_STRUCT = struct.Struct("<B")
+OTA_UPG_HDR_DEV_SPEC_STRUCT = struct.Struct("<Q")
+OTA_UPG_HDR_HW_VER_STRUCT = struct.Struct("<HH")
+
+# Digests are computed from large reads, hashlib drops the GIL while hashing each one
+OTA_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Archives whose members are validated in place (streamed out, never extracted), recognised by their suffix
+OTA_ARCHIVE_ZIP_SUFFIXES = (".zip", )
+OTA_ARCHIVE_TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tbz")
+OTA_ARCHIVE_ERRORS = (IOError, OSError, EOFError, zipfile.BadZipfile, zipfile.LargeZipFile, tarfile.TarError, zlib.error,
+                      RuntimeError, NotImplementedError)
+
+# Carving, embedded images are found by searching for the upgrade file identifier as it's laid out in a file
+OTA_CARVE_MAGIC = struct.pack("<I", OTA_UPG_FILE_ID)
+
+# Payload copies are done kernel side where possible, in steps of at most this many bytes per system call. Anything
+# the kernel can't copy between (pipes, sockets on older kernels, cross-device copy_file_range) gets a chunked copy.
+OTA_COPY_MAX_STEP = 1 << 30
+OTA_COPY_CHUNK_SIZE = 1024 * 1024
+OTA_COPY_FALLBACK_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ESPIPE, errno.EBADF)
+
+# ZigBee Manufacturer Codes
+# "Borrowed" from the nice list in Wireshark (epan/dissectors/packet-zbee.h), kept in a data file alongside
+# this script. Most codes are allocated densely from 0x1000, so those live in a list indexed by code, the few
+# stragglers (RF4CE codes below 0x1000, anything past the dense range) live in a dict.
+MFG_CODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zigbee-mfg-codes.txt")
+MFG_TABLE_BASE = 0x1000
+MFG_TABLE_SIZE = 0x0200
+mfg_table = [None] * MFG_TABLE_SIZE
+mfg_sparse = {}
+mfg_codes = {}
+
+# Catalog Schema
+OTA_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    header_only INTEGER NOT NULL,
+    mfg_code INTEGER,
+    img_type INTEGER,
+    file_ver INTEGER,
+    stack_ver INTEGER,
+    hdr_str BLOB,
+    min_hw INTEGER,
+    max_hw INTEGER,
+    valid INTEGER NOT NULL,
+    errors TEXT NOT NULL,
+    file_sha256 TEXT,
+    upg_img_sha256 TEXT,
+    sig_checked INTEGER NOT NULL DEFAULT 0,
+    sig_valid INTEGER,
+    dev_spec TEXT
+);
+CREATE INDEX IF NOT EXISTS images_by_key ON images (mfg_code, img_type, file_ver);
+"""
+OTA_CATALOG_COLUMNS = ("path", "size", "mtime", "header_only", "mfg_code", "img_type", "file_ver", "stack_ver", "hdr_str",
+                       "min_hw", "max_hw", "valid", "errors", "file_sha256", "upg_img_sha256", "sig_checked", "sig_valid", "dev_spec")
+OTA_CATALOG_ADDED_COLUMNS = (("file_sha256", "TEXT"), ("upg_img_sha256", "TEXT"), ("sig_checked", "INTEGER NOT NULL DEFAULT 0"),
+                             ("sig_valid", "INTEGER"), ("dev_spec", "TEXT"))
+OTA_CATALOG_RESCAN_COLUMNS = ("dev_spec", ) # Added columns that every existing row needs re-parsing to fill in
+
+# Digest Cache Schema
+OTA_DIGEST_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    file_sha256 TEXT NOT NULL,
+    upg_img_sha256 TEXT,
+    PRIMARY KEY (dev, ino)
+);
+"""
+
+# Wrap Cache Schema, the wrapped images themselves live alongside as <key[:2]>/<key>.zigbee. A key is the SHA-256 of
+# the header, then each sub-element's tag ID and length followed by the SHA-256 (hex) of its value, so a cached
+# image can be checked against its key. files records the key of each output and cached image that was checked or
+# written, with its stat, so one that hasn't changed since doesn't have to be read again.
+OTA_WRAP_CACHE_DB = "cache.db"
+OTA_WRAP_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (dev, ino, offset, length)
+);
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    key TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+# Sidecar Index, written next to an image as <image><suffix>. The binary form is a header (magic, image size,
+# image mtime, header length, sub-element count) followed by a (tag ID, value offset, value length) per sub-element.
+OTA_SIDECAR_SUFFIXES = {"bin": ".otaidx", "json": ".otaidx.json"}
+OTA_SIDECAR_FORMATS = ("bin", "json")
+OTA_SIDECAR_MAGIC = "ZBOTAIDX"
+OTA_SIDECAR_HDR_STRUCT = struct.Struct("<8sQdHI")
+OTA_SIDECAR_ENTRY_STRUCT = struct.Struct("<HII")
+
+# Binary Deltas, an Upgrade Image rebuilt from the one a device already has. The delta (carried in a manufacturer
+# specific sub-element) is a header (magic, format version, base file version, source and target lengths, source
+# and target SHA-256) followed by ops: copy (op, source offset, length) or add (op, length, literal bytes). A delta
+# image has the File Version of the image it rebuilds and that image's Image Type with OTA_DELTA_IMG_TYPE_FLAG set,
+# so OTA servers (and OtaUpgradeIndex) keep the two apart.
+OTA_DELTA_TAG_ID = 0xf0d1
+OTA_DELTA_IMG_TYPE_FLAG = 0x8000
+OTA_DELTA_IMG_TYPE_MAX = 0xffbf # Image Types from 0xffc0 up are reserved by the specification
+OTA_DELTA_MAGIC = "ZBOD"
+OTA_DELTA_VER = 1
+OTA_DELTA_HDR_STRUCT = struct.Struct("<4sBIII32s32s")
+OTA_DELTA_COPY_STRUCT = struct.Struct("<BII")
+OTA_DELTA_ADD_STRUCT = struct.Struct("<BI")
+OTA_DELTA_OP_COPY = 0x00
+OTA_DELTA_OP_ADD = 0x01
+OTA_DELTA_BLOCK_SIZE = 16 # Source blocks indexed for matching, any run at least twice this long gets copied
+
+# Bulk Header Decoding (needs NumPy), fixed headers (the OTA_UPG_HDR_STRUCT part) back to back at a fixed stride,
+# decoded as a structured array. Each header's problems are a mask of OTA_BULK_ERR_* bits, size histogram buckets
+# are powers of two (bucket n holds sizes from 2^(n-1) up to 2^n - 1, bucket 0 is empty images).
+OTA_BULK_HDR_FIELDS = (("file_id", "<u4"), ("hdr_ver", "<u2"), ("hdr_len", "<u2"), ("field_ctrl", "<u2"), ("mfg_code", "<u2"),
+                       ("img_type", "<u2"), ("file_ver", "<u4"), ("stack_ver", "<u2"), ("hdr_str", "S32"), ("total_img_sz", "<u4"))
+OTA_BULK_ERR_FILE_ID = 0x01
+OTA_BULK_ERR_HDR_VER = 0x02
+OTA_BULK_ERR_HDR_LEN = 0x04
+OTA_BULK_ERR_FIELD_CTRL = 0x08
+OTA_BULK_ERR_SHORT = 0x10
+OTA_BULK_ERR_SIZE = 0x20
+OTA_BULK_ERRORS = ((OTA_BULK_ERR_FILE_ID, "file identifier is incorrect"),
+                   (OTA_BULK_ERR_HDR_VER, "header version is unsupported"),
+                   (OTA_BULK_ERR_HDR_LEN, "header length doesn't match the optional fields"),
+                   (OTA_BULK_ERR_FIELD_CTRL, "unknown optional header fields"),
+                   (OTA_BULK_ERR_SHORT, "insufficient data for header"),
+                   (OTA_BULK_ERR_SIZE, "file size doesn't match total image size in header"))
+OTA_BULK_SIZE_BUCKETS = 33 # The last bucket takes anything bigger too
+
+# Profiling, parse_image() phases in the order they happen
+OTA_PROFILE_PHASES = ("open", "header", "sub_elements", "signature", "digest")
+
+# Image Record
+class OtaImage(object):
+    """A parsed ZigBee OTA Upgrade image.
+
+    Header fields that weren't reached (because of an earlier error) or optional fields that aren't present are
+    None. sub_elements is a list of (tag ID, value offset, value length) tuples and errors is a list of messages,
+    an image is valid when there are none. The SHA-256 digests (hex) and the signature verdict are only filled in
+    when asked for, sig_valid stays None for an unsigned image. profile is an OtaProfile if one was asked for."""
+    __slots__ = ("path", "file_size", "file_id", "hdr_ver", "hdr_len", "field_ctrl", "mfg_code", "img_type",
+                 "file_ver", "stack_ver", "hdr_str", "total_img_sz", "sec_cred_ver", "dev_spec", "min_hw",
+                 "max_hw", "sub_elements", "errors", "file_sha256", "upg_img_sha256", "sig_signer", "sig_valid",
+                 "profile")
+
+    def __init__(self, path=None):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.path = path
+        self.sub_elements = []
+        self.errors = []
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<OtaImage %r mfg_code=%r img_type=%r file_ver=%r errors=%u>" % (self.path, self.mfg_code, self.img_type, self.file_ver, len(self.errors))
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    def as_dict(self):
+        """Returns the image as a dict of plain (JSON friendly) values, leaving out fields that weren't filled in."""
+        record = {"path": self.path, "valid": self.valid, "errors": self.errors}
+        for name in ("file_size", "file_id", "hdr_ver", "hdr_len", "field_ctrl", "mfg_code", "img_type", "file_ver",
+                     "stack_ver", "total_img_sz", "sec_cred_ver", "dev_spec", "min_hw", "max_hw", "file_sha256",
+                     "upg_img_sha256", "sig_signer", "sig_valid"):
+            value = getattr(self, name)
+            if value is not None:
+                record[name] = value
+        if self.mfg_code is not None:
+            record["mfg_name"] = mfg_code_str(self.mfg_code)
+        if self.hdr_str is not None:
+            record["hdr_str"] = self.hdr_str.rstrip("\0").decode("latin-1")
+        record["sub_elements"] = [{"tag": tag_id, "offset": offset, "length": sub_len} for (tag_id, offset, sub_len) in self.sub_elements]
+        if self.profile is not None:
+            record["profile"] = self.profile.as_dict()
+        return record
+
+# Profile
+class OtaProfile(object):
+    """Wall time per phase, read calls and bytes read, and peak memory, for one image or added up over many.
+
+    Phases are timed back to back: start() then mark(phase) at the end of each one. Peak memory is the process's
+    ru_maxrss in KiB (Python 2 has no tracemalloc)."""
+
+    def __init__(self):
+        self.times = {}
+        self.images = 0
+        self.reads = 0
+        self.bytes_read = 0
+        self.peak_mem = 0
+        self.last = None
+
+    def start(self):
+        self.last = time.time()
+
+    def mark(self, phase):
+        now = time.time()
+        self.times[phase] = self.times.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def sample_memory(self):
+        self.peak_mem = max(self.peak_mem, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    def add(self, other):
+        """Adds another profile into this one."""
+        for (phase, seconds) in other.times.items():
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.images = self.images + other.images
+        self.reads = self.reads + other.reads
+        self.bytes_read = self.bytes_read + other.bytes_read
+        self.peak_mem = max(self.peak_mem, other.peak_mem)
+
+    def as_dict(self):
+        return {"times": self.times, "reads": self.reads, "bytes_read": self.bytes_read, "peak_mem_kb": self.peak_mem}
+
+# Counting File
+class OtaCountingFile(object):
+    """Wraps a file object, counting read calls and bytes read into an OtaProfile. Only used when profiling."""
+
+    def __init__(self, myfile, profile):
+        self.myfile = myfile
+        self.profile = profile
+
+    def read(self, size=-1):
+        data = self.myfile.read(size)
+        self.profile.reads = self.profile.reads + 1
+        self.profile.bytes_read = self.profile.bytes_read + len(data)
+        return data
+
+    def readinto(self, buf):
+        n = self.myfile.readinto(buf)
+        self.profile.reads = self.profile.reads + 1
+        self.profile.bytes_read = self.profile.bytes_read + n
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.myfile, name)
+
+# Stream Reader
+class OtaStream(object):
+    """Reads forward through a stream (a pipe, an archive member) that can't be seeked or stat'ed.
+
+    Everything read is fed to the hashes in ranges, a list of [start, end, hash] with end None for the rest of the
+    stream, and pos counts the bytes read so far."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pos = 0
+        self.ranges = []
+
+    def read(self, size):
+        """Reads size bytes, fewer only at the end of the stream."""
+        parts = []
+        n = 0
+        while n < size:
+            data = self.stream.read(min(size - n, OTA_DIGEST_CHUNK_SIZE))
+            if not data:
+                break
+            self.feed(data)
+            parts.append(data)
+            n = n + len(data)
+        return "".join(parts)
+
+    def skip(self, size=None):
+        """Reads past size bytes (or to the end of the stream) in chunks, returns how many there were."""
+        n = 0
+        while (size is None) or (n < size):
+            chunk = OTA_DIGEST_CHUNK_SIZE
+            if size is not None:
+                chunk = min(size - n, chunk)
+            data = self.stream.read(chunk)
+            if not data:
+                break
+            self.feed(data)
+            n = n + len(data)
+        return n
+
+    def feed(self, data):
+        for (start, end, h) in self.ranges:
+            if ((end is None) or (self.pos < end)) and (self.pos + len(data) > start):
+                first = max(start - self.pos, 0)
+                last = len(data)
+                if end is not None:
+                    last = min(end - self.pos, last)
+                h.update(buffer(data, first, last - first))
+        self.pos = self.pos + len(data)
+
+# Mapped Region
+class OtaRegion(object):
+    """A read-only file-like window onto part of a mapping (or string), so an embedded image can be parsed in place."""
+
+    def __init__(self, mapped, start, size):
+        self.mapped = mapped
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset = offset + self.pos
+        elif whence == os.SEEK_END:
+            offset = offset + self.size
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.size
+        if size >= 0:
+            end = min(self.pos + size, end)
+        if end <= self.pos:
+            return ""
+        data = self.mapped[self.start + self.pos:self.start + end]
+        self.pos = end
+        return data
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[0:len(data)] = data
+        return len(data)
+
+# Signing certificates already turned into public keys, keyed by (certificate, CA public key)
+ota_cert_keys = {}
+
+# libc copy system call wrappers looked up so far, keyed by name (None if libc doesn't have it)
+libc_copy_functions = {}
+
+# libc memmem() and the C API call giving a buffer's address, once looked up (None if either isn't there)
+libc_search_functions = {}
+
+# Image Catalog
+class OtaCatalog(object):
+    """A persistent SQLite catalog of parsed OTA images, keyed by path.
+
+    Each row remembers the size and mtime the image had when it was parsed, so a rescan only needs to stat the
+    files. stale() picks out what needs (re-)parsing, unchanged() returns the catalogued results of the rest,
+    update() stores the results and prune() drops images that have been deleted."""
+
+    def __init__(self, dbpath):
+        self.db = sqlite3.connect(dbpath)
+        self.db.text_factory = str
+        self.db.executescript(OTA_CATALOG_SCHEMA)
+        # Catalogs created by older versions need the columns added since
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(images)")]
+        for (column, column_type) in OTA_CATALOG_ADDED_COLUMNS:
+            if column not in columns:
+                self.db.execute("ALTER TABLE images ADD COLUMN %s %s" % (column, column_type))
+                if column in OTA_CATALOG_RESCAN_COLUMNS:
+                    self.db.execute("UPDATE images SET size = -1")
+        self.seen = {}
+        self.fresh = []
+
+    def stale(self, paths, header_only=False, digest=False, verify=False):
+        """Returns the paths that are new or whose size or mtime has changed since they were catalogued.
+
+        Images that were only header checked are stale when a full check is asked for, likewise images without
+        digests or signature checks when those are asked for. The rest are kept for unchanged()."""
+        known = {}
+        for (path, size, mtime, was_header_only, file_sha256, sig_checked) in self.db.execute("SELECT path, size, mtime, header_only, file_sha256, sig_checked FROM images"):
+            if (header_only or not was_header_only) and ((not digest) or (file_sha256 is not None)) and ((not verify) or sig_checked):
+                known[path] = (size, mtime)
+        stale = []
+        for path in paths:
+            try:
+                filestat = os.stat(path)
+            except OSError:
+                stale.append(path) # Let the parse report it
+                continue
+            self.seen[path] = (filestat.st_size, filestat.st_mtime)
+            if known.get(path) != self.seen[path]:
+                stale.append(path)
+            else:
+                self.fresh.append(path)
+        return stale
+
+    def unchanged(self):
+        """Returns the images stale() passed over as OtaImages, in the order they were listed, with the fields and
+        verdict (errors, digests, signature check) they were catalogued with."""
+        rows = {}
+        for row in self.db.execute("SELECT %s FROM images" % (", ".join(OTA_CATALOG_COLUMNS))):
+            rows[row[0]] = dict(zip(OTA_CATALOG_COLUMNS, row))
+        imgs = []
+        for path in self.fresh:
+            row = rows[path]
+            img = OtaImage(path)
+            for name in ("mfg_code", "img_type", "file_ver", "stack_ver", "min_hw", "max_hw", "file_sha256", "upg_img_sha256", "sig_valid"):
+                setattr(img, name, row[name])
+            if row["hdr_str"] is not None:
+                img.hdr_str = str(row["hdr_str"])
+            if row["dev_spec"] is not None:
+                img.dev_spec = int(row["dev_spec"], 16)
+            if row["sig_valid"] is not None:
+                img.sig_valid = bool(row["sig_valid"])
+            if row["errors"]:
+                img.errors = row["errors"].split("\n")
+            imgs.append(img)
+        return imgs
+
+    def update(self, img, header_only=False, verify=False):
+        """Stores a parsed image, using the size and mtime stale() saw for it."""
+        if img.path not in self.seen:
+            return
+        (size, mtime) = self.seen[img.path]
+        hdr_str = None
+        if img.hdr_str is not None:
+            hdr_str = buffer(img.hdr_str)
+        dev_spec = None
+        if img.dev_spec is not None:
+            dev_spec = "%016x" % (img.dev_spec) # Too big for an SQLite integer
+        self.db.execute("INSERT OR REPLACE INTO images (%s) VALUES (%s)" % (", ".join(OTA_CATALOG_COLUMNS), ", ".join("?" * len(OTA_CATALOG_COLUMNS))),
+                        (img.path, size, mtime, int(header_only), img.mfg_code, img.img_type, img.file_ver,
+                         img.stack_ver, hdr_str, img.min_hw, img.max_hw, int(img.valid), "\n".join(img.errors),
+                         img.file_sha256, img.upg_img_sha256, int(verify), img.sig_valid, dev_spec))
+
+    def prune(self):
+        """Drops images that stale() didn't see and that no longer exist, returns how many were dropped."""
+        gone = [path for (path, ) in self.db.execute("SELECT path FROM images") if (path not in self.seen) and not os.path.exists(path)]
+        self.db.executemany("DELETE FROM images WHERE path = ?", [(path, ) for path in gone])
+        return len(gone)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# Upgrade Index
+class OtaUpgradeBucket(object):
+    """The images OtaUpgradeIndex has under one (manufacturer code, image type, stack version, upgrade file
+    destination) key, as sorted (file version, path) lists.
+
+    Images for any hardware version share one list. The hardware version ranges of the others split the hardware
+    versions into segments, each with a list of the images whose ranges cover it, so a lookup is a bisect for the
+    segment and a bisect in each of the two lists. The segments are worked out again on the first lookup after a
+    ranged image is added or removed."""
+
+    def __init__(self):
+        self.versions = []
+        self.ranged = {} # path -> (min_hw, max_hw, file_ver)
+        self.bounds = None # Hardware version each segment starts at, None until worked out
+        self.segments = None
+
+    def __len__(self):
+        return len(self.versions) + len(self.ranged)
+
+    def add(self, path, file_ver, min_hw=None, max_hw=None):
+        if min_hw is None:
+            bisect.insort(self.versions, (file_ver, path))
+        else:
+            self.ranged[path] = (min_hw, max_hw, file_ver)
+            self.bounds = None
+
+    def remove(self, path, file_ver, min_hw=None):
+        if min_hw is None:
+            del self.versions[bisect.bisect_left(self.versions, (file_ver, path))]
+        else:
+            del self.ranged[path]
+            self.bounds = None
+
+    def split(self):
+        """Works out the hardware version segments and the images covering each one."""
+        bounds = set()
+        for (min_hw, max_hw, file_ver) in self.ranged.itervalues():
+            bounds.add(min_hw)
+            bounds.add(max_hw + 1)
+        bounds = sorted(bounds)
+        segments = [[] for bound in bounds]
+        for (path, (min_hw, max_hw, file_ver)) in self.ranged.iteritems():
+            for index in xrange(bisect.bisect_left(bounds, min_hw), bisect.bisect_left(bounds, max_hw + 1)):
+                segments[index].append((file_ver, path))
+        for segment in segments:
+            segment.sort()
+        (self.bounds, self.segments) = (bounds, segments)
+
+    def newest(self, hw_ver=None, max_ver=None):
+        """Returns the (file version, path) of the newest image for a hardware version (None if it isn't known, which
+        only images for any hardware version match), at most max_ver if given. None if there isn't one."""
+        best = newest_version(self.versions, max_ver)
+        if (hw_ver is not None) and self.ranged:
+            if self.bounds is None:
+                self.split()
+            index = bisect.bisect_right(self.bounds, hw_ver) - 1
+            if index >= 0:
+                found = newest_version(self.segments[index], max_ver)
+                if (found is not None) and ((best is None) or (found > best)):
+                    best = found
+        return best
+
+class OtaUpgradeIndex(object):
+    """Answers "what's the newest image for this device" over a set of valid images, e.g. on every device check-in.
+
+    Images are kept in OtaUpgradeBucket's keyed by (manufacturer code, image type, stack version, upgrade file
+    destination), each image under its own stack version and under None for queries that don't give one. A query
+    looks up the bucket for any device and, given an IEEE address, the one for that device, nothing else is looked
+    at. Images come in two layers: image files (add(), refresh()) and catalog rows (load_catalog()). Each layer is
+    brought up to date on its own, by size and mtime, and an image file is indexed ahead of its catalog row."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.images = {} # path -> (mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec) as indexed
+        self.layers = {"files": {}, "catalog": {}} # layer -> {path: (entry, (size, mtime))}
+
+    def __len__(self):
+        return len(self.images)
+
+    def add(self, path, mfg_code, img_type, file_ver, min_hw=None, max_hw=None, stack_ver=None, dev_spec=None, stat=None, layer="files"):
+        """Adds (or replaces) an image, stat is the (size, mtime) it had so refreshes can tell if it's changed."""
+        self.layers[layer][path] = ((mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec), stat)
+        self.reindex(path)
+
+    def add_image(self, img, stat=None):
+        """Adds a parsed image if it's valid (and fully checked), returns True if it was added."""
+        if (not img.valid) or (img.file_ver is None):
+            self.remove(img.path)
+            return False
+        self.add(img.path, img.mfg_code, img.img_type, img.file_ver, img.min_hw, img.max_hw, img.stack_ver, img.dev_spec, stat)
+        return True
+
+    def remove(self, path, layer="files"):
+        """Removes an image from a layer, returns True if it was there."""
+        if self.layers[layer].pop(path, None) is None:
+            return False
+        self.reindex(path)
+        return True
+
+    def reindex(self, path):
+        """Puts whichever layer's entry for path comes first into the buckets, in place of what was there."""
+        layered = self.layers["files"].get(path) or self.layers["catalog"].get(path)
+        entry = None
+        if layered is not None:
+            entry = layered[0]
+        current = self.images.get(path)
+        if current == entry:
+            return
+        if current is not None:
+            (mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec) = current
+            for stack_key in set([stack_ver, None]):
+                key = (mfg_code, img_type, stack_key, dev_spec)
+                bucket = self.buckets[key]
+                bucket.remove(path, file_ver, min_hw)
+                if not bucket:
+                    del self.buckets[key]
+            del self.images[path]
+        if entry is not None:
+            (mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec) = entry
+            for stack_key in set([stack_ver, None]):
+                self.buckets.setdefault((mfg_code, img_type, stack_key, dev_spec), OtaUpgradeBucket()).add(path, file_ver, min_hw, max_hw)
+            self.images[path] = entry
+
+    def refresh(self, paths):
+        """Brings the image file layer in line with a list of image files, returns (images parsed, images removed).
+
+        Only files that are new, or whose size or mtime changed, get parsed. Files no longer listed go, images that
+        came from a catalog are left alone."""
+        files = self.layers["files"]
+        listed = set()
+        n_parsed = 0
+        for path in paths:
+            listed.add(path)
+            try:
+                filestat = os.stat(path)
+            except OSError:
+                continue
+            stat = (filestat.st_size, filestat.st_mtime)
+            if (path in files) and (files[path][1] == stat):
+                continue
+            self.add_image(parse_image(path), stat)
+            n_parsed = n_parsed + 1
+        gone = [path for path in files if path not in listed]
+        for path in gone:
+            self.remove(path)
+        return (n_parsed, len(gone))
+
+    def load_catalog(self, dbpath):
+        """Brings the catalog layer in line with the fully checked, valid images in a catalog, returns (added, removed)."""
+        db = sqlite3.connect(dbpath)
+        db.text_factory = str
+        try:
+            rows = db.execute("SELECT path, size, mtime, mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec FROM images WHERE valid AND NOT header_only AND size >= 0").fetchall()
+        finally:
+            db.close()
+        catalog = self.layers["catalog"]
+        listed = set()
+        n_added = 0
+        for (path, size, mtime, mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec) in rows:
+            listed.add(path)
+            if (path in catalog) and (catalog[path][1] == (size, mtime)):
+                continue
+            if dev_spec is not None:
+                dev_spec = int(dev_spec, 16)
+            self.add(path, mfg_code, img_type, file_ver, min_hw, max_hw, stack_ver, dev_spec, (size, mtime), "catalog")
+            n_added = n_added + 1
+        gone = [path for path in catalog if path not in listed]
+        for path in gone:
+            self.remove(path, "catalog")
+        return (n_added, len(gone))
+
+    def query(self, mfg_code, img_type, file_ver, hw_ver=None, stack_ver=None, ieee=None, max_ver=None):
+        """Returns (file version, path) of the newest image newer than file_ver, or None if there isn't one.
+
+        Images with a hardware version range only match a hw_ver inside it, images for a particular device (an
+        upgrade file destination) only match its ieee address. stack_ver, if given, has to match exactly and
+        max_ver caps the file version (e.g. for a staged roll-out)."""
+        best = None
+        for dev_spec in set([None, ieee]):
+            bucket = self.buckets.get((mfg_code, img_type, stack_ver, dev_spec))
+            if bucket is None:
+                continue
+            found = bucket.newest(hw_ver, max_ver)
+            if (found is not None) and ((best is None) or (found > best)):
+                best = found
+        if (best is None) or (best[0] <= file_ver):
+            return None
+        return best
+
+# Digest Cache
+class OtaDigestCache(object):
+    """A persistent SQLite cache of image digests, keyed by (device, inode) and checked against size and mtime.
+
+    lookup() returns the cached (file SHA-256, Upgrade Image SHA-256) for an unchanged file, store() saves the
+    digests of a freshly hashed one."""
+
+    def __init__(self, dbpath):
+        self.db = sqlite3.connect(dbpath)
+        self.db.text_factory = str
+        self.db.executescript(OTA_DIGEST_CACHE_SCHEMA)
+        self.digests = {}
+        for (dev, ino, size, mtime, file_sha256, upg_img_sha256) in self.db.execute("SELECT * FROM digests"):
+            self.digests[(dev, ino)] = (size, mtime, file_sha256, upg_img_sha256)
+        self.pending = {}
+
+    def lookup(self, path):
+        """Returns (file SHA-256, Upgrade Image SHA-256) if path hasn't changed since it was hashed, else None."""
+        try:
+            filestat = os.stat(path)
+        except OSError:
+            return None
+        key = (filestat.st_dev, filestat.st_ino)
+        cached = self.digests.get(key)
+        if (cached is not None) and (cached[0:2] == (filestat.st_size, filestat.st_mtime)):
+            return cached[2:4]
+        self.pending[path] = (key, filestat.st_size, filestat.st_mtime)
+        return None
+
+    def store(self, img):
+        """Stores the digests of an image that lookup() missed on."""
+        if (img.file_sha256 is None) or (img.path not in self.pending):
+            return
+        ((dev, ino), size, mtime) = self.pending.pop(img.path)
+        self.digests[(dev, ino)] = (size, mtime, img.file_sha256, img.upg_img_sha256)
+        self.db.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)", (dev, ino, size, mtime, img.file_sha256, img.upg_img_sha256))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# Wrap Cache
+class OtaWrapCache(object):
+    """A content addressed cache of wrapped images, keyed by a digest of the header and the sub-element payloads.
+
+    The cache directory holds the wrapped images and an SQLite database of payload digests, keyed by (device, inode,
+    range) and checked against size and mtime so unchanged inputs aren't hashed again. The database also has the
+    stat of every output and cached image with the key it was checked against, so unchanged ones aren't read again
+    either. Wrapping itself is done by wrap_cached(), which only needs the directory, so it can run in pool workers
+    while the database stays with the parent: input_digests() and file_stats() before, store() after."""
+
+    def __init__(self, cachedir):
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.cachedir = cachedir
+        self.db = sqlite3.connect(os.path.join(cachedir, OTA_WRAP_CACHE_DB))
+        self.db.text_factory = str
+        self.db.executescript(OTA_WRAP_CACHE_SCHEMA)
+        self.inputs = {}
+        for (dev, ino, offset, length, size, mtime, sha256, last_used) in self.db.execute("SELECT * FROM inputs"):
+            self.inputs[(dev, ino, offset, length)] = (size, mtime, sha256)
+        self.files = {}
+        for (path, dev, ino, size, mtime, key, last_used) in self.db.execute("SELECT * FROM files"):
+            self.files[path] = (dev, ino, size, mtime, key)
+
+    def input_digests(self, builder):
+        """Returns {(path, offset, length): SHA-256} for the file payloads of builder that haven't changed."""
+        digests = {}
+        for (tag_id, data, source, offset, length) in builder.sub_elements:
+            if not isinstance(source, basestring):
+                continue
+            try:
+                filestat = os.stat(source)
+            except OSError:
+                continue
+            cached = self.inputs.get((filestat.st_dev, filestat.st_ino, offset, length))
+            if (cached is not None) and (cached[0:2] == (filestat.st_size, filestat.st_mtime)):
+                digests[(source, offset, length)] = cached[2]
+        return digests
+
+    def file_stats(self, builder, outfile, digests):
+        """Returns {path: (device, inode, size, mtime, key)} as last recorded for outfile and, if its key can be worked
+        out from digests without hashing anything, the builder's cached image. For wrap_cached()."""
+        stats = {}
+        outfile = os.path.abspath(outfile)
+        if outfile in self.files:
+            stats[outfile] = self.files[outfile]
+        for (tag_id, data, source, offset, length) in builder.sub_elements:
+            if (data is None) and ((source, offset, length) not in digests):
+                return stats
+        cachepath = os.path.abspath(wrap_cache_path(self.cachedir, wrap_cache_key(builder, digests)[0]))
+        if cachepath in self.files:
+            stats[cachepath] = self.files[cachepath]
+        return stats
+
+    def store(self, key, size, hashed, files=()):
+        """Records a wrapped (or reused) image, the payload digests wrap_cached() had to compute for it and the stats
+        of the files it found (or left) holding the image."""
+        now = time.time()
+        for (dev, ino, offset, length, filesize, mtime, sha256) in hashed:
+            self.inputs[(dev, ino, offset, length)] = (filesize, mtime, sha256)
+            self.db.execute("INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (dev, ino, offset, length, filesize, mtime, sha256, now))
+        for (path, dev, ino, filesize, mtime) in [filestat for filestat in files if filestat is not None]:
+            self.files[path] = (dev, ino, filesize, mtime, key)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (path, dev, ino, filesize, mtime, key, now))
+        self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (key, size, now))
+
+    def evict(self, max_age=None, max_size=None):
+        """Removes images not used for max_age seconds, then the least recently used until the total is at most
+        max_size bytes. Returns (images removed, bytes freed)."""
+        evicted = []
+        if max_age is not None:
+            cutoff = time.time() - max_age
+            evicted.extend(self.db.execute("SELECT key, size FROM images WHERE last_used < ?", (cutoff, )).fetchall())
+            self.db.execute("DELETE FROM inputs WHERE last_used < ?", (cutoff, ))
+            self.db.execute("DELETE FROM files WHERE last_used < ?", (cutoff, ))
+        if max_size is not None:
+            total = 0
+            for (key, size) in self.db.execute("SELECT key, size FROM images ORDER BY last_used DESC").fetchall():
+                total = total + size
+                if (total > max_size) and ((key, size) not in evicted):
+                    evicted.append((key, size))
+        for (key, size) in evicted:
+            self.db.execute("DELETE FROM images WHERE key = ?", (key, ))
+            self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(wrap_cache_path(self.cachedir, key)), ))
+            try:
+                os.unlink(wrap_cache_path(self.cachedir, key))
+            except OSError:
+                pass
+        return (len(evicted), sum([size for (key, size) in evicted]))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# Image Builder
+class OtaImageBuilder(object):
+    """Assembles an OTA upgrade image from header values and a list of sub-elements.
+
+    Sub-element payloads can be strings/buffers or ranges of files, file payloads are only read while the image is
+    being written out, so the total image size (and the header) is known without buffering anything. e.g.
+        builder = OtaImageBuilder(0x1002, 0x0001, 0x00000002, hdr_str="Widget", min_hw=1, max_hw=3)
+        builder.add_sub_element_file(OTA_UPG_TAG_ID_UPG_IMG, "firmware.bin")
+        builder.add_sub_element(0xf000, extra_data)
+        builder.write_to(sock.makefile("wb"))"""
+    def __init__(self, mfg_code, img_type, file_ver, stack_ver=OTA_UPG_HDR_ZIGBEE_STACK_PRO, hdr_str="",
+                 sec_cred_ver=None, dev_spec=None, min_hw=None, max_hw=None):
+        self.mfg_code = mfg_code
+        self.img_type = img_type
+        self.file_ver = file_ver
+        self.stack_ver = stack_ver
+        self.hdr_str = hdr_str
+        self.sec_cred_ver = sec_cred_ver
+        self.dev_spec = dev_spec
+        self.min_hw = min_hw
+        self.max_hw = max_hw
+        self.sub_elements = [] # (tag, data, path or file object, offset, length), one of data or file is set
+
+    def add_sub_element(self, tag_id, data):
+        """Adds a sub-element holding a string or buffer."""
+        self.sub_elements.append((tag_id, data, None, 0, len(data)))
+
+    def add_sub_element_file(self, tag_id, source, offset=None, length=None):
+        """Adds a sub-element holding (part of) a file, source is either a path or a file object.
+
+        The range defaults to the rest of the file from offset, which itself defaults to the start of the file for a
+        path and the current position for a file object."""
+        if offset is None:
+            if isinstance(source, basestring):
+                offset = 0
+            else:
+                offset = source.tell()
+        if length is None:
+            if isinstance(source, basestring):
+                length = os.stat(source).st_size - offset
+            else:
+                length = os.fstat(source.fileno()).st_size - offset
+        self.sub_elements.append((tag_id, None, source, offset, length))
+
+    def check(self):
+        """Range checks the header values and sub-elements, returns a list of problems (empty if they're all fine)."""
+        errors = []
+        if not (0 <= self.mfg_code <= 0xffff):
+            errors.append("Manufacturer Code must be a 16-bit hex value")
+        if not (0 <= self.img_type <= 0xffff):
+            errors.append("Image Type must be a 16-bit hex value")
+        if not (0 <= self.file_ver <= 0xffffffff):
+            errors.append("Version must be a 32-bit hex value")
+        if not (0 <= self.stack_ver <= 0xffff):
+            errors.append("ZigBee Stack Version must be a 16-bit hex value")
+        if (self.sec_cred_ver is not None) and not (0 <= self.sec_cred_ver <= 0xff):
+            errors.append("Security Credential Version must be an 8-bit hex value")
+        if (self.dev_spec is not None) and not (0 <= self.dev_spec <= 0xffffffffffffffff):
+            errors.append("Upgrade File Destination must be a 64-bit hex IEEE address")
+        if (self.min_hw is None) != (self.max_hw is None):
+            errors.append("Minimum and Maximum Hardware Version must be given together")
+        elif self.min_hw is not None:
+            if not ((0 <= self.min_hw <= 0xffff) and (0 <= self.max_hw <= 0xffff)):
+                errors.append("Hardware Versions must be 16-bit hex values")
+            elif self.min_hw > self.max_hw:
+                errors.append("Minimum Hardware Version is greater than the Maximum Hardware Version")
+        for (tag_id, data, source, offset, length) in self.sub_elements:
+            if not (0 <= tag_id <= 0xffff):
+                errors.append("Sub-element Tag ID must be a 16-bit hex value (got 0x%x)" % (tag_id))
+            if not (0 <= length <= 0xffffffff):
+                errors.append("Sub-element 0x%04x is too long (%u bytes)" % (tag_id & 0xffff, length))
+        if self.total_img_sz > 0xffffffff:
+            errors.append("Total Image Size is too big (%u bytes)" % (self.total_img_sz))
+        return errors
+
+    @property
+    def field_ctrl(self):
+        field_ctrl = 0
+        if self.sec_cred_ver is not None:
+            field_ctrl = field_ctrl | OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER
+        if self.dev_spec is not None:
+            field_ctrl = field_ctrl | OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC
+        if self.min_hw is not None:
+            field_ctrl = field_ctrl | OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER
+        return field_ctrl
+
+    @property
+    def hdr_len(self):
+        hdr_len = OTA_UPG_HDR_MIN_HDR_LEN
+        if self.sec_cred_ver is not None:
+            hdr_len = hdr_len + OTA_UPG_HDR_SEC_CRED_VER_STRUCT.size
+        if self.dev_spec is not None:
+            hdr_len = hdr_len + OTA_UPG_HDR_DEV_SPEC_STRUCT.size
+        if self.min_hw is not None:
+            hdr_len = hdr_len + OTA_UPG_HDR_HW_VER_STRUCT.size
+        return hdr_len
+
+    @property
+    def total_img_sz(self):
+        return self.hdr_len + sum([OTA_UPG_SUB_ELEM_STRUCT.size + length for (tag_id, data, source, offset, length) in self.sub_elements])
+
+    def header(self):
+        """Returns the packed OTA header, raises ValueError if check() finds any problems."""
+        errors = self.check()
+        if errors:
+            raise ValueError(errors[0])
+        parts = [OTA_UPG_HDR_STRUCT.pack(OTA_UPG_FILE_ID, OTA_UPG_HDR_VER, self.hdr_len, self.field_ctrl, self.mfg_code,
+                                         self.img_type, self.file_ver, self.stack_ver, self.hdr_str, self.total_img_sz)]
+        if self.sec_cred_ver is not None:
+            parts.append(OTA_UPG_HDR_SEC_CRED_VER_STRUCT.pack(self.sec_cred_ver))
+        if self.dev_spec is not None:
+            parts.append(OTA_UPG_HDR_DEV_SPEC_STRUCT.pack(self.dev_spec))
+        if self.min_hw is not None:
+            parts.append(OTA_UPG_HDR_HW_VER_STRUCT.pack(self.min_hw, self.max_hw))
+        return "".join(parts)
+
+    def buffers(self):
+        """Returns the whole image as a list of buffers, ready for os.writev() or a loop of write() calls.
+
+        File payloads are memory mapped rather than read, so nothing is copied until the buffers are written."""
+        bufs = [self.header()]
+        for (tag_id, data, source, offset, length) in self.sub_elements:
+            bufs.append(OTA_UPG_SUB_ELEM_STRUCT.pack(tag_id, length))
+            if data is not None:
+                bufs.append(data)
+            elif length:
+                if isinstance(source, basestring):
+                    with open(source, "rb") as myfile:
+                        mapped = mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+                if offset + length > len(mapped):
+                    raise IOError("insufficient data for sub-element 0x%04x (expected %u, got %u)" % (tag_id, length, max(len(mapped) - offset, 0)))
+                bufs.append(buffer(mapped, offset, length)) # Keeps the mapping alive for as long as it's needed
+        return bufs
+
+    def write_to(self, outf):
+        """Writes the image to a file object (a file, socket file, BytesIO, ...), returns the number of bytes written.
+
+        File payloads are copied kernel side where both ends allow it."""
+        outf.write(self.header())
+        written = self.hdr_len
+        for (tag_id, data, source, offset, length) in self.sub_elements:
+            outf.write(OTA_UPG_SUB_ELEM_STRUCT.pack(tag_id, length))
+            if data is not None:
+                outf.write(data)
+                copied = length
+            elif isinstance(source, basestring):
+                with open(source, "rb") as myfile:
+                    myfile.seek(offset)
+                    copied = copy_file_data(myfile, outf, length)
+            else:
+                source.seek(offset)
+                copied = copy_file_data(source, outf, length)
+            if copied != length:
+                raise IOError("insufficient data for sub-element 0x%04x (expected %u, got %u)" % (tag_id, length, copied))
+            written = written + OTA_UPG_SUB_ELEM_STRUCT.size + length
+        return written
+
+# Helper Functions
+def newest_version(versions, max_ver=None):
+    """Returns the last (file version, path) of a sorted list, or the last one at most max_ver, None if there isn't one."""
+    index = len(versions)
+    if max_ver is not None:
+        index = bisect.bisect_left(versions, (max_ver + 1, ))
+    if not index:
+        return None
+    return versions[index - 1]
+
+def expand_paths(paths):
+    """Expands directories (recursively), globs and plain paths into a list of files, sidecars found in directories are left out."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if not is_sidecar_path(filename):
+                        files.append(os.path.join(dirpath, filename))
+        elif glob.has_magic(path):
+            files.extend(expand_paths(sorted(glob.glob(path))))
+        else:
+            files.append(path)
+    return files
+
+def load_mfg_codes(path):
+    """Loads the ZigBee Manufacturer Code table from a data file.
+
+    Accepts either "<hex-code> <name>" lines or the #define lists from Wireshark's packet-zbee.h, where
+    ZBEE_MFG_CODE_<X> and ZBEE_MFG_<X> are paired up by <X>."""
+    codes = {}
+    hdr_codes = {}
+    hdr_names = {}
+    with open(path, "r") as mfgfile:
+        for line in mfgfile:
+            fields = line.split(None, 2)
+            if not fields:
+                continue
+            if fields[0] == "#define":
+                if len(fields) < 3:
+                    continue
+                value = fields[2].split("/*")[0].strip()
+                if fields[1].startswith("ZBEE_MFG_CODE_"):
+                    try:
+                        hdr_codes[fields[1][len("ZBEE_MFG_CODE_"):]] = int(value, 0)
+                    except ValueError:
+                        pass
+                elif fields[1].startswith("ZBEE_MFG_") and value.startswith("\""):
+                    hdr_names[fields[1][len("ZBEE_MFG_"):]] = value.strip("\"")
+            elif len(fields) > 1:
+                # Anything else that isn't a "<hex-code> <name>" line (comments, C code) is skipped
+                try:
+                    code = int(fields[0], 16)
+                except ValueError:
+                    continue
+                codes[code] = line.strip().split(None, 1)[1]
+    for (key, code) in hdr_codes.iteritems():
+        # packet-zbee.h numbers duplicated codes (e.g. ZBEE_MFG_CODE_HONEYWELL1, ZBEE_MFG_CODE_HUAWEI_2), but not
+        # the matching names
+        name = hdr_names.get(key, hdr_names.get(key.rstrip("0123456789").rstrip("_")))
+        if name is not None:
+            codes[code] = name
+
+    del mfg_table[:]
+    mfg_table.extend([None] * MFG_TABLE_SIZE)
+    mfg_sparse.clear()
+    mfg_codes.clear()
+    for code in sorted(codes):
+        name = intern(codes[code])
+        if MFG_TABLE_BASE <= code < MFG_TABLE_BASE + MFG_TABLE_SIZE:
+            mfg_table[code - MFG_TABLE_BASE] = name
+        else:
+            mfg_sparse[code] = name
+        mfg_codes.setdefault(name.lower(), code)
+
+def mfg_code_str(mfg):
+    """Converts from a ZigBee Manufacturer Code to a string."""
+    if MFG_TABLE_BASE <= mfg < MFG_TABLE_BASE + MFG_TABLE_SIZE:
+        mfg_str = mfg_table[mfg - MFG_TABLE_BASE]
+    else:
+        mfg_str = mfg_sparse.get(mfg)
+    if mfg_str is None:
+        mfg_str = "Unknown"
+    return mfg_str
+
+def mfg_str_code(mfg_str):
+    """Converts from a manufacturer name to its (lowest) ZigBee Manufacturer Code, None if unknown."""
+    return mfg_codes.get(mfg_str.lower())
+
+def zigbee_stack_str(ver):
+    """Converts from a ZigBee Stack Version number to a string."""
+    if ver == OTA_UPG_HDR_ZIGBEE_STACK_2006:
+        ver_str = "2006"
+    elif ver == OTA_UPG_HDR_ZIGBEE_STACK_2007:
+        ver_str = "2007"
+    elif ver == OTA_UPG_HDR_ZIGBEE_STACK_PRO:
+        ver_str = "Pro"
+    elif ver == OTA_UPG_HDR_ZIGBEE_STACK_IP:
+        ver_str = "IP"
+    else:
+        ver_str = "Unknown"
+    return ver_str
+
+def security_credential_str(ver):
+    """Converts from a Security Credential Version number to a string."""
+    if ver == OTA_UPG_HDR_SEC_CRED_VER_SE_1_0:
+        ver_str = "SE 1.0"
+    elif ver == OTA_UPG_HDR_SEC_CRED_VER_SE_1_1:
+        ver_str = "SE 1.1"
+    elif ver == OTA_UPG_HDR_SEC_CRED_VER_SE_2_0:
+        ver_str = "SE 2.0"
+    else:
+        ver_str = "Unknown"
+    return ver_str
+
+def tag_id_str(tag_id):
+    """Converts from a Tag ID number to a string."""
+    if tag_id == OTA_UPG_TAG_ID_UPG_IMG:
+        id_str = "Upgrade Image"
+    elif tag_id == OTA_UPG_TAG_ID_ECDSA_SIG:
+        id_str = "ECDSA Signature"
+    elif tag_id == OTA_UPG_TAG_ID_ECDSA_SIGN_CERT:
+        id_str = "ECDSA Signing Certificate"
+    elif (tag_id >= 0x0003) and (tag_id <= 0xefff):
+        id_str = "Reserved"
+    else:
+        id_str = "Manufacturer Specific"
+    return id_str
+
+def parse_header(buf, img):
+    """Decodes the OTA header at the start of buf into img, returns False after a fatal error.
+
+    buf needs to hold the whole header, reading OTA_UPG_HDR_MAX_HDR_LEN bytes is always enough."""
+    # Check for the OTA upgrade file identifier, and the header version and length fields
+    if len(buf) < OTA_UPG_HDR_PREFIX_STRUCT.size:
+        img.errors.append("insufficient data for header (expected %u, got %u)" % (OTA_UPG_HDR_MIN_HDR_LEN, len(buf)))
+        return False
+    (img.file_id, hdr_ver, hdr_len) = OTA_UPG_HDR_PREFIX_STRUCT.unpack_from(buf)
+    if img.file_id != OTA_UPG_FILE_ID:
+        img.errors.append("file identifier is incorrect (expected 0x%08x, got 0x%08x)" % (OTA_UPG_FILE_ID, img.file_id))
+        return False
+    # The header version and length only mean something once the identifier is right, so they're only kept then
+    (img.hdr_ver, img.hdr_len) = (hdr_ver, hdr_len)
+    if img.hdr_ver != OTA_UPG_HDR_VER:
+        img.errors.append("header version is unsupported (expected 0x%04x, got 0x%04x)" % (OTA_UPG_HDR_VER, img.hdr_ver))
+        return False
+    if img.hdr_len < OTA_UPG_HDR_MIN_HDR_LEN:
+        img.errors.append("header length is too small (minimum %u, got %u)" % (OTA_UPG_HDR_MIN_HDR_LEN, img.hdr_len))
+        return False
+    if len(buf) < min(img.hdr_len, OTA_UPG_HDR_MAX_HDR_LEN):
+        img.errors.append("insufficient data for header (expected %u, got %u)" % (img.hdr_len, len(buf)))
+        return False
+
+    # Decode the rest of the fixed header in one go and check it
+    (img.file_id, img.hdr_ver, img.hdr_len, img.field_ctrl, img.mfg_code, img.img_type, img.file_ver, img.stack_ver, img.hdr_str, img.total_img_sz) = OTA_UPG_HDR_STRUCT.unpack_from(buf)
+    if img.field_ctrl & ~OTA_UPG_HDR_FIELD_CTRL_MASK:
+        img.errors.append("unknown optional header fields (0x%04x)" % (img.field_ctrl & ~OTA_UPG_HDR_FIELD_CTRL_MASK))
+        return False
+    if (img.file_size is not None) and (img.file_size != img.total_img_sz):
+        img.errors.append("file size doesn't match total image size in header (expected %u, got %u)" % (img.file_size, img.total_img_sz))
+
+    # Process any optional header fields
+    offset = OTA_UPG_HDR_MIN_HDR_LEN
+    hdr_len = img.hdr_len - offset
+    if (hdr_len != 0) and (img.field_ctrl == 0):
+        img.errors.append("still header data left (%u bytes), but no optional elements" % (hdr_len))
+        return False
+    if (hdr_len == 0) and (img.field_ctrl != 0):
+        img.errors.append("no header data left, but optional element(s) present")
+        return False
+    if img.field_ctrl & OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER:
+        if hdr_len >= 1:
+            (img.sec_cred_ver, ) = OTA_UPG_HDR_SEC_CRED_VER_STRUCT.unpack_from(buf, offset)
+            offset = offset + 1
+            hdr_len = hdr_len - 1
+        else:
+            img.errors.append("insufficient header data for \"Security Credential Version\" (expected 1, got %u)" % (hdr_len))
+            return False
+    if img.field_ctrl & OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC:
+        if hdr_len >= 8:
+            (img.dev_spec, ) = OTA_UPG_HDR_DEV_SPEC_STRUCT.unpack_from(buf, offset)
+            offset = offset + 8
+            hdr_len = hdr_len - 8
+        else:
+            img.errors.append("insufficient header data for \"Upgrade File Destination\" (expected 8, got %u)" % (hdr_len))
+            return False
+    if img.field_ctrl & OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER:
+        if hdr_len >= 4:
+            (img.min_hw, img.max_hw) = OTA_UPG_HDR_HW_VER_STRUCT.unpack_from(buf, offset)
+            offset = offset + 4
+            hdr_len = hdr_len - 4
+        else:
+            img.errors.append("insufficient header data for \"Hardware Version\" (expected 4, got %u)" % (hdr_len))
+            return False
+    if hdr_len > 0:
+        img.errors.append("still header data left (%u bytes)" % (hdr_len))
+        return False
+    return True
+
+def parse_sub_elements(myfile, img):
+    """Walks the sub-elements (Tag, Length, Value) following the header, returns False after a fatal error."""
+    offset = img.hdr_len
+    myfile.seek(offset)
+    while True:
+        buf = myfile.read(OTA_UPG_SUB_ELEM_STRUCT.size)
+        if len(buf) == OTA_UPG_SUB_ELEM_STRUCT.size:
+            (tag_id, sub_len) = OTA_UPG_SUB_ELEM_STRUCT.unpack(buf)
+            offset = offset + OTA_UPG_SUB_ELEM_STRUCT.size
+            img.sub_elements.append((tag_id, offset, sub_len))
+            # Only the bounds matter here, so skip over the value rather than pulling it into memory
+            if offset + sub_len > img.file_size:
+                img.errors.append("insufficient data for sub-element (expected %u, got %u)" % (sub_len, img.file_size - offset))
+                return False
+            offset = offset + sub_len
+            myfile.seek(offset)
+        else:
+            break # EOF
+    return True
+
+def hash_ranges(myfile, ranges):
+    """Feeds byte ranges of a file to hash objects, all in a single chunked pass over the file.
+
+    ranges is a list of (start, end, hash) tuples, anything with an update() method will do for the hash."""
+    if not ranges:
+        return
+    pos = min([start for (start, end, h) in ranges])
+    stop = max([end for (start, end, h) in ranges])
+    buf = bytearray(OTA_DIGEST_CHUNK_SIZE)
+    myfile.seek(pos)
+    while pos < stop:
+        n = myfile.readinto(buf)
+        if not n:
+            break
+        for (start, end, h) in ranges:
+            if (pos < end) and (pos + n > start):
+                first = max(start - pos, 0)
+                h.update(buffer(buf, first, min(end - pos, n) - first))
+        pos = pos + n
+
+def libc_copy_function(name, argtypes):
+    """Looks up a copy system call wrapper in libc, returns None if there isn't one (e.g. an old glibc or not Linux)."""
+    if name in libc_copy_functions:
+        return libc_copy_functions[name]
+    libc_copy_functions[name] = None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = getattr(libc, name)
+    except (ImportError, OSError, AttributeError):
+        return None
+    func.argtypes = argtypes
+    func.restype = ctypes.c_ssize_t
+    def call(*args):
+        n = func(*args)
+        if n < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        return n
+    libc_copy_functions[name] = call
+    return call
+
+def copy_file_range_step(fd_in, off_in, fd_out, off_out, count):
+    """One copy_file_range(2) call between explicit offsets, returns the number of bytes copied."""
+    if hasattr(os, "copy_file_range"):
+        return os.copy_file_range(fd_in, fd_out, count, off_in, off_out)
+    import ctypes
+    func = libc_copy_function("copy_file_range", [ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+                                                   ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t, ctypes.c_uint])
+    if func is None:
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    return func(fd_in, ctypes.byref(ctypes.c_int64(off_in)), fd_out, ctypes.byref(ctypes.c_int64(off_out)), count, 0)
+
+def sendfile_step(fd_in, off_in, fd_out, off_out, count):
+    """One sendfile(2) call, the output is written at the current position of fd_out which must be off_out (if it
+    has a position at all, otherwise off_out is None)."""
+    if hasattr(os, "sendfile"):
+        return os.sendfile(fd_out, fd_in, off_in, count)
+    import ctypes
+    func = libc_copy_function("sendfile64", [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t])
+    if func is None:
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    return func(fd_out, fd_in, ctypes.byref(ctypes.c_int64(off_in)), count)
+
+def copy_file_data(src, dst, count):
+    """Copies up to count bytes from the current position of src to the current position of dst.
+
+    Uses copy_file_range(2), then sendfile(2), and only falls back to a chunked copy through a reused buffer if
+    neither works for this pair of files. A dst that can't seek (a pipe, e.g. stdout) only gets sendfile(2). Both file
+    positions end up just past the copied data. Returns the number of bytes copied, which is less than count if src
+    ran out of data."""
+    dst.flush()
+    copied = 0
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        src_pos = src.tell()
+    except (IOError, OSError, ValueError, AttributeError):
+        src_pos = None # Not seekable or not a real file, e.g. a pipe or a BytesIO
+    steps = (copy_file_range_step, sendfile_step)
+    dst_pos = None
+    if src_pos is not None:
+        try:
+            dst_pos = dst.tell()
+        except (IOError, OSError):
+            steps = (sendfile_step, ) # sendfile(2) writes at the current position, which is all a pipe has
+    if src_pos is not None:
+        for step in steps:
+            try:
+                while copied < count:
+                    n = step(src_fd, src_pos + copied, dst_fd, None if dst_pos is None else dst_pos + copied, min(count - copied, OTA_COPY_MAX_STEP))
+                    if not n:
+                        break
+                    copied = copied + n
+            except (IOError, OSError), e:
+                if copied or (e.errno not in OTA_COPY_FALLBACK_ERRNOS):
+                    raise
+                continue
+            break
+        src.seek(src_pos + copied)
+        if dst_pos is not None:
+            dst.seek(dst_pos + copied)
+    if copied < count and (src_pos is None or copied == 0):
+        # Chunked fallback, only reached when the kernel copies weren't usable at all
+        buf = bytearray(min(OTA_COPY_CHUNK_SIZE, count))
+        while copied < count:
+            if count - copied < len(buf):
+                buf = bytearray(count - copied) # Don't read past the end of the requested range
+            n = src.readinto(buf)
+            if not n:
+                break
+            dst.write(buffer(buf, 0, n))
+            copied = copied + n
+    return copied
+
+def wrap_cache_path(cachedir, key):
+    """Returns where the wrapped image with the given cache key lives."""
+    return os.path.join(cachedir, key[:2], key + ".zigbee")
+
+def wrap_cache_key(builder, digests):
+    """Works out the cache key of a builder's image, hashing any file payloads that aren't in digests.
+
+    digests is as returned by OtaWrapCache.input_digests(), returns (key, list of inputs hashed for OtaWrapCache.store())."""
+    key = hashlib.sha256(builder.header())
+    hashed = []
+    for (tag_id, data, source, offset, length) in builder.sub_elements:
+        key.update(OTA_UPG_SUB_ELEM_STRUCT.pack(tag_id, length))
+        if data is not None:
+            key.update(hashlib.sha256(data).hexdigest())
+            continue
+        sha256 = None
+        if isinstance(source, basestring):
+            sha256 = digests.get((source, offset, length))
+        if sha256 is None:
+            h = hashlib.sha256()
+            if isinstance(source, basestring):
+                with open(source, "rb", 0) as myfile:
+                    filestat = os.fstat(myfile.fileno())
+                    hash_ranges(myfile, [(offset, offset + length, h)])
+                sha256 = h.hexdigest()
+                hashed.append((filestat.st_dev, filestat.st_ino, offset, length, filestat.st_size, filestat.st_mtime, sha256))
+            else:
+                hash_ranges(source, [(offset, offset + length, h)])
+                sha256 = h.hexdigest()
+        key.update(sha256)
+    return (key.hexdigest(), hashed)
+
+def wrap_cache_check(filepath, key, size):
+    """Returns True if filepath is intact: a valid image of size bytes whose contents hash to the cache key."""
+    img = parse_image(filepath)
+    if (not img.valid) or (img.file_size != size):
+        return False
+    h = hashlib.sha256()
+    ranges = [(0, img.hdr_len, h)] + [(offset, offset + sub_len, hashlib.sha256()) for (tag_id, offset, sub_len) in img.sub_elements]
+    with open(filepath, "rb", 0) as myfile:
+        hash_ranges(myfile, ranges)
+    for ((tag_id, offset, sub_len), (start, end, sub_h)) in zip(img.sub_elements, ranges[1:]):
+        h.update(OTA_UPG_SUB_ELEM_STRUCT.pack(tag_id, sub_len))
+        h.update(sub_h.hexdigest())
+    return h.hexdigest() == key
+
+def replace_file(src, dst):
+    """Copies src over dst (kernel side, which can share the data on filesystems with reflinks), dst is swapped in
+    atomically. Outputs and cache entries never share an inode, so editing one in place can't change the other."""
+    tmp = "%s.%u.tmp" % (dst, os.getpid())
+    try:
+        with open(src, "rb") as srcf:
+            size = os.fstat(srcf.fileno()).st_size
+            with open(tmp, "wb") as dstf:
+                if copy_file_data(srcf, dstf, size) != size:
+                    raise IOError("%s: changed while it was being copied" % (src))
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.rename(tmp, dst)
+
+def wrap_cache_stat(filepath):
+    """Returns (path, device, inode, size, mtime) of a file for OtaWrapCache.store(), or None if it isn't there."""
+    try:
+        filestat = os.stat(filepath)
+    except OSError:
+        return None
+    return (os.path.abspath(filepath), filestat.st_dev, filestat.st_ino, filestat.st_size, filestat.st_mtime)
+
+def wrap_cache_trusted(filepath, key, size, stats):
+    """Returns (True if filepath holds the image with the cache key, its stat or None), trusting a file whose stat
+    matches what stats has for it with the same key, and checking the contents of any other."""
+    filestat = wrap_cache_stat(filepath)
+    if filestat is None:
+        return (False, None)
+    if stats.get(filestat[0]) == filestat[1:] + (key, ):
+        return (True, filestat)
+    return (wrap_cache_check(filepath, key, size), filestat)
+
+def wrap_cached(builder, outfile, cachedir, digests=None, stats=None):
+    """Writes a builder's image to outfile, reusing an identical image from the wrap cache if there is one.
+
+    Returns (status, cache key, inputs hashed, file stats), status is "unchanged" if outfile already held the image,
+    "copied" if it was copied from the cache, or "wrapped" if the image had to be built (and was then added to the
+    cache). Both outfile and the cached image are checked against the key before they're trusted, unless their stat
+    matches stats (from OtaWrapCache.file_stats()), a cached image that fails is replaced. The file stats are those
+    of outfile and the cached image, for OtaWrapCache.store()."""
+    if digests is None:
+        digests = {}
+    if stats is None:
+        stats = {}
+    (key, hashed) = wrap_cache_key(builder, digests)
+    (trusted, outstat) = wrap_cache_trusted(outfile, key, builder.total_img_sz, stats)
+    if trusted:
+        return ("unchanged", key, hashed, [outstat])
+    cachepath = wrap_cache_path(cachedir, key)
+    (trusted, cachestat) = wrap_cache_trusted(cachepath, key, builder.total_img_sz, stats)
+    if trusted:
+        replace_file(cachepath, outfile)
+        return ("copied", key, hashed, [wrap_cache_stat(outfile), cachestat])
+    # Outputs from older versions may be hard links into the cache, so new ones are always written to a fresh inode
+    tmp = "%s.%u.tmp" % (outfile, os.getpid())
+    try:
+        with open(tmp, "wb") as outf:
+            builder.write_to(outf)
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.rename(tmp, outfile)
+    if not os.path.isdir(os.path.dirname(cachepath)):
+        try:
+            os.makedirs(os.path.dirname(cachepath))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(cachepath)):
+                raise
+    replace_file(outfile, cachepath)
+    return ("wrapped", key, hashed, [wrap_cache_stat(outfile), wrap_cache_stat(cachepath)])
+
+def is_archive_path(path):
+    """Returns True if path is named like an archive whose members are images."""
+    return path.endswith(OTA_ARCHIVE_ZIP_SUFFIXES + OTA_ARCHIVE_TAR_SUFFIXES)
+
+def is_sidecar_path(path):
+    """Returns True if path is named like a sidecar index."""
+    for suffix in OTA_SIDECAR_SUFFIXES.values():
+        if path.endswith(suffix):
+            return True
+    return False
+
+def write_sidecar(img, sidecar_format="bin"):
+    """Writes the sidecar index of a fully parsed, valid image next to it, returns the sidecar's path.
+
+    The sidecar is keyed to the image's current size and mtime, an image that has changed size since it was
+    parsed raises ValueError rather than getting an index that doesn't describe it."""
+    filestat = os.stat(img.path)
+    if (not img.valid) or (img.hdr_len is None) or (filestat.st_size != img.file_size):
+        raise ValueError("%s: image has changed or isn't valid" % (img.path))
+    if sidecar_format == "json":
+        data = json.dumps({"file_size": img.file_size, "mtime": filestat.st_mtime, "hdr_len": img.hdr_len,
+                           "sub_elements": [[tag_id, offset, sub_len] for (tag_id, offset, sub_len) in img.sub_elements]},
+                          separators=(",", ":")) + "\n"
+    else:
+        data = [OTA_SIDECAR_HDR_STRUCT.pack(OTA_SIDECAR_MAGIC, img.file_size, filestat.st_mtime, img.hdr_len, len(img.sub_elements))]
+        for entry in img.sub_elements:
+            data.append(OTA_SIDECAR_ENTRY_STRUCT.pack(*entry))
+        data = "".join(data)
+    sidecar = img.path + OTA_SIDECAR_SUFFIXES[sidecar_format]
+    tmp = "%s.%u.tmp" % (sidecar, os.getpid())
+    with open(tmp, "wb") as sidecarf:
+        sidecarf.write(data)
+    os.rename(tmp, sidecar)
+    return sidecar
+
+def read_sidecar(filepath):
+    """Reads the sidecar index of an image, in whichever format it was written.
+
+    Returns (header length, [(tag ID, value offset, value length), ...]), or None if there's no sidecar, or it's
+    stale (the image's size or mtime no longer match) or damaged, in which case the image needs parsing instead."""
+    for sidecar_format in OTA_SIDECAR_FORMATS:
+        try:
+            with open(filepath + OTA_SIDECAR_SUFFIXES[sidecar_format], "rb") as sidecarf:
+                data = sidecarf.read()
+            filestat = os.stat(filepath)
+        except (IOError, OSError):
+            continue
+        try:
+            if sidecar_format == "json":
+                record = json.loads(data)
+                (file_size, mtime, hdr_len) = (record["file_size"], record["mtime"], record["hdr_len"])
+                sub_elements = [tuple(entry) for entry in record["sub_elements"]]
+            else:
+                (magic, file_size, mtime, hdr_len, count) = OTA_SIDECAR_HDR_STRUCT.unpack_from(data)
+                if (magic != OTA_SIDECAR_MAGIC) or (len(data) != OTA_SIDECAR_HDR_STRUCT.size + count * OTA_SIDECAR_ENTRY_STRUCT.size):
+                    continue
+                sub_elements = [OTA_SIDECAR_ENTRY_STRUCT.unpack_from(data, OTA_SIDECAR_HDR_STRUCT.size + index * OTA_SIDECAR_ENTRY_STRUCT.size) for index in xrange(count)]
+        except (ValueError, KeyError, TypeError, struct.error):
+            continue
+        if (file_size != filestat.st_size) or (mtime != filestat.st_mtime):
+            continue
+        for entry in sub_elements:
+            if (len(entry) != 3) or (entry[1] + entry[2] > file_size):
+                break
+        else:
+            return (hdr_len, sub_elements)
+    return None
+
+def select_sub_element(sub_elements, tag_id=OTA_UPG_TAG_ID_UPG_IMG, index=None):
+    """Picks a sub-element out of a list of (tag ID, value offset, value length), by index if one's given, otherwise
+    by tag ID.
+
+    Returns the sub-element, raises ValueError if there's no such index, or not exactly one with the tag ID."""
+    if index is not None:
+        if not (0 <= index < len(sub_elements)):
+            raise ValueError("no sub-element %u (there are %u)" % (index, len(sub_elements)))
+        return sub_elements[index]
+    found = [sub_element for sub_element in sub_elements if sub_element[0] == tag_id]
+    if len(found) != 1:
+        raise ValueError("expected one sub-element with tag 0x%04x, found %u" % (tag_id, len(found)))
+    return found[0]
+
+def extract_sub_element(filepath, dst, tag_id=OTA_UPG_TAG_ID_UPG_IMG, index=None):
+    """Copies the value of one of an image file's sub-elements to dst (an open file, or e.g. stdout).
+
+    The sub-element is picked as by select_sub_element(), out of an up to date sidecar index if there is one or
+    else by parsing the image, which has to be valid. The value is copied kernel side with copy_file_data() from its
+    offset, it never passes through Python unless the kernel can't copy between the two files. Returns the
+    sub-element, raises ValueError if the image or sub-element won't do (and IOError/OSError as usual)."""
+    sidecar = read_sidecar(filepath)
+    if sidecar is not None:
+        sub_elements = sidecar[1]
+    else:
+        img = parse_image(filepath)
+        if not img.valid:
+            raise ValueError("invalid image (%s)" % ("; ".join(img.errors)))
+        sub_elements = img.sub_elements
+    (sub_tag_id, offset, sub_len) = select_sub_element(sub_elements, tag_id, index)
+    with open(filepath, "rb") as srcf:
+        srcf.seek(offset)
+        copied = copy_file_data(srcf, dst, sub_len)
+    if copied != sub_len:
+        raise IOError("%s: ran out of data at %u (expected %u bytes, got %u)" % (filepath, offset + copied, sub_len, copied))
+    return (sub_tag_id, offset, sub_len)
+
+def common_length(a, a_offset, b, b_offset):
+    """Returns how many bytes a and b have in common from the given offsets, comparing in galloping slices."""
+    limit = min(len(a) - a_offset, len(b) - b_offset)
+    length = 0
+    step = 64
+    while length < limit:
+        chunk = min(step, limit - length)
+        if a[a_offset + length:a_offset + length + chunk] == b[b_offset + length:b_offset + length + chunk]:
+            length = length + chunk
+            step = min(step * 2, OTA_COPY_CHUNK_SIZE)
+        elif chunk == 1:
+            break
+        else:
+            step = chunk // 2
+    return length
+
+def delta_ops(source, target, block_size=OTA_DELTA_BLOCK_SIZE):
+    """Works out how to build target out of source, returns a list of ("copy", offset, length) and ("add", start, end) ops.
+
+    Every block_size aligned block of source is indexed, target is then scanned for them a byte at a time and each
+    hit is grown in both directions into a copy. Whatever isn't copied is added literally from target[start:end]."""
+    index = {}
+    for offset in xrange(0, len(source) - block_size + 1, block_size):
+        index.setdefault(source[offset:offset + block_size], offset)
+    ops = []
+    literal = 0
+    pos = 0
+    last = len(target) - block_size
+    while pos <= last:
+        offset = index.get(target[pos:pos + block_size])
+        if offset is None:
+            pos = pos + 1
+            continue
+        back = 0
+        while (back < pos - literal) and (back < offset) and (source[offset - back - 1] == target[pos - back - 1]):
+            back = back + 1
+        length = back + block_size + common_length(source, offset + block_size, target, pos + block_size)
+        if pos - back > literal:
+            ops.append(("add", literal, pos - back))
+        ops.append(("copy", offset - back, length))
+        pos = pos - back + length
+        literal = pos
+    if literal < len(target):
+        ops.append(("add", literal, len(target)))
+    return ops
+
+def delta_encode(source, target, base_file_ver, block_size=OTA_DELTA_BLOCK_SIZE):
+    """Returns a delta (the value of an OTA_DELTA_TAG_ID sub-element) rebuilding target from source.
+
+    base_file_ver is the File Version of the image source came from, a device only applies a delta to that."""
+    parts = [OTA_DELTA_HDR_STRUCT.pack(OTA_DELTA_MAGIC, OTA_DELTA_VER, base_file_ver, len(source), len(target),
+                                       hashlib.sha256(source).digest(), hashlib.sha256(target).digest())]
+    for op in delta_ops(source, target, block_size):
+        if op[0] == "copy":
+            parts.append(OTA_DELTA_COPY_STRUCT.pack(OTA_DELTA_OP_COPY, op[1], op[2]))
+        else:
+            parts.append(OTA_DELTA_ADD_STRUCT.pack(OTA_DELTA_OP_ADD, op[2] - op[1]))
+            parts.append(target[op[1]:op[2]])
+    return "".join(parts)
+
+def delta_info(delta):
+    """Returns a delta's (base file version, source length, target length), raises ValueError if it isn't one."""
+    if len(delta) < OTA_DELTA_HDR_STRUCT.size:
+        raise ValueError("delta is too short (%u bytes)" % (len(delta)))
+    (magic, version, base_file_ver, source_len, target_len, source_sha256, target_sha256) = OTA_DELTA_HDR_STRUCT.unpack_from(delta)
+    if magic != OTA_DELTA_MAGIC:
+        raise ValueError("not a delta (magic %r)" % (magic))
+    if version != OTA_DELTA_VER:
+        raise ValueError("unsupported delta format version %u" % (version))
+    return (base_file_ver, source_len, target_len)
+
+def delta_decode(source, delta):
+    """Applies a delta to source, returns the target. Raises ValueError if the delta is damaged or source (or the
+    result) doesn't match the digests the delta was made with."""
+    delta_info(delta)
+    (magic, version, base_file_ver, source_len, target_len, source_sha256, target_sha256) = OTA_DELTA_HDR_STRUCT.unpack_from(delta)
+    if (len(source) != source_len) or (hashlib.sha256(source).digest() != source_sha256):
+        raise ValueError("delta was made from a different Upgrade Image")
+    parts = []
+    pos = OTA_DELTA_HDR_STRUCT.size
+    while pos < len(delta):
+        op = ord(delta[pos])
+        if (op == OTA_DELTA_OP_COPY) and (pos + OTA_DELTA_COPY_STRUCT.size <= len(delta)):
+            (op, offset, length) = OTA_DELTA_COPY_STRUCT.unpack_from(delta, pos)
+            if offset + length > source_len:
+                raise ValueError("delta copies past the end of the source (%u bytes at %u)" % (length, offset))
+            parts.append(source[offset:offset + length])
+            pos = pos + OTA_DELTA_COPY_STRUCT.size
+        elif (op == OTA_DELTA_OP_ADD) and (pos + OTA_DELTA_ADD_STRUCT.size <= len(delta)):
+            (op, length) = OTA_DELTA_ADD_STRUCT.unpack_from(delta, pos)
+            pos = pos + OTA_DELTA_ADD_STRUCT.size
+            if pos + length > len(delta):
+                raise ValueError("delta is truncated")
+            parts.append(delta[pos:pos + length])
+            pos = pos + length
+        else:
+            raise ValueError("bad delta op 0x%02x at %u" % (op, pos))
+    target = "".join(parts)
+    if (len(target) != target_len) or (hashlib.sha256(target).digest() != target_sha256):
+        raise ValueError("rebuilt Upgrade Image doesn't match the one the delta was made for")
+    return target
+
+def bulk_header_dtype(stride=OTA_UPG_HDR_MIN_HDR_LEN):
+    """Returns the NumPy structured dtype of a fixed header, padded out to stride bytes."""
+    if numpy is None:
+        raise ImportError("NumPy is needed for bulk header decoding")
+    if stride < OTA_UPG_HDR_STRUCT.size:
+        raise ValueError("stride is too small for a header (minimum %u, got %u)" % (OTA_UPG_HDR_STRUCT.size, stride))
+    names = [name for (name, fmt) in OTA_BULK_HDR_FIELDS]
+    formats = [fmt for (name, fmt) in OTA_BULK_HDR_FIELDS]
+    offsets = []
+    offset = 0
+    for fmt in formats:
+        offsets.append(offset)
+        offset = offset + numpy.dtype(fmt).itemsize
+    return numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": stride})
+
+def bulk_decode_headers(buf, stride=OTA_UPG_HDR_MIN_HDR_LEN):
+    """Decodes the headers laid out every stride bytes in buf (a string, mmap or anything else exposing a buffer).
+
+    Returns a structured array viewing buf, so buf has to outlive it. Trailing bytes short of a whole stride are
+    left out (len(buf) % stride of them)."""
+    dtype = bulk_header_dtype(stride)
+    count = len(buf) // stride
+    if count == 0:
+        return numpy.zeros(0, dtype)
+    return numpy.frombuffer(buf, dtype, count)
+
+def bulk_check_headers(headers, file_sizes=None):
+    """Checks decoded headers all at once, returns an array of OTA_BULK_ERR_* masks (0 for a good header).
+
+    Makes the fixed header checks parse_header() does, other than the optional fields themselves. With an array
+    of file sizes the Total Image Size is checked too, anything shorter than a header is only flagged as that."""
+    field_ctrl = headers["field_ctrl"]
+    expected_len = (OTA_UPG_HDR_MIN_HDR_LEN + (field_ctrl & OTA_UPG_HDR_FIELD_CTRL_SECURITY_CREDENTIAL_VER != 0) * 1 +
+                    (field_ctrl & OTA_UPG_HDR_FIELD_CTRL_DEVICE_SPECIFIC != 0) * 8 + (field_ctrl & OTA_UPG_HDR_FIELD_CTRL_HARDWARE_VER != 0) * 4)
+    errors = ((headers["file_id"] != OTA_UPG_FILE_ID) * OTA_BULK_ERR_FILE_ID |
+              (headers["hdr_ver"] != OTA_UPG_HDR_VER) * OTA_BULK_ERR_HDR_VER |
+              (headers["hdr_len"] != expected_len) * OTA_BULK_ERR_HDR_LEN |
+              ((field_ctrl & (0xffff & ~OTA_UPG_HDR_FIELD_CTRL_MASK)) != 0) * OTA_BULK_ERR_FIELD_CTRL)
+    if file_sizes is not None:
+        errors = errors | (headers["total_img_sz"] != file_sizes) * OTA_BULK_ERR_SIZE
+        errors = numpy.where(file_sizes < OTA_UPG_HDR_MIN_HDR_LEN, OTA_BULK_ERR_SHORT, errors)
+    return errors.astype(numpy.uint8)
+
+def bulk_error_counts(errors):
+    """Returns [(message, count)] of the problems found by bulk_check_headers(), for those that turned up."""
+    counts = []
+    for (bit, message) in OTA_BULK_ERRORS:
+        n = int(numpy.count_nonzero(errors & bit))
+        if n:
+            counts.append((message, n))
+    return counts
+
+def bulk_histograms(mfg_codes, stack_vers, sizes):
+    """Counts headers by manufacturer code, stack version and size bucket, each count being a single bincount.
+
+    Takes the field arrays (e.g. headers["mfg_code"]), returns (manufacturer, stack, size) count arrays. They're
+    a fixed length whatever the input, so the counts from several batches of headers can simply be added up."""
+    (mantissas, exponents) = numpy.frexp(numpy.asarray(sizes, numpy.float64))
+    return (numpy.bincount(numpy.asarray(mfg_codes, numpy.intp), minlength=0x10000),
+            numpy.bincount(numpy.asarray(stack_vers, numpy.intp), minlength=0x10000),
+            numpy.bincount(numpy.minimum(exponents, OTA_BULK_SIZE_BUCKETS - 1), minlength=OTA_BULK_SIZE_BUCKETS))
+
+def bulk_catalog_fields(dbpath):
+    """Loads the manufacturer codes, stack versions and sizes of the valid images in a catalog as arrays.
+
+    Returns (mfg codes, stack versions, sizes, number of invalid images), the catalog doesn't keep raw headers so
+    there's nothing to check again."""
+    if numpy is None:
+        raise ImportError("NumPy is needed for bulk header decoding")
+    db = sqlite3.connect(dbpath)
+    try:
+        rows = db.execute("SELECT mfg_code, stack_ver, size FROM images WHERE valid AND size >= 0").fetchall()
+        (n_invalid, ) = db.execute("SELECT COUNT(*) FROM images WHERE NOT valid").fetchone()
+    finally:
+        db.close()
+    fields = numpy.array(rows, numpy.int64).reshape(-1, 3)
+    return (fields[:, 0], fields[:, 1], fields[:, 2], n_invalid)
+
+def find_signature(img):
+    """Finds the ECDSA Signature and Signing Certificate sub-elements of a parsed image and checks where they are.
+
+    Returns ((certificate offset, length), (signature offset, length)), or None if the image isn't signed or the
+    signature can't be checked (the reason is added to img.errors)."""
+    sig = None
+    cert = None
+    for (index, (tag_id, offset, sub_len)) in enumerate(img.sub_elements):
+        if tag_id == OTA_UPG_TAG_ID_ECDSA_SIG:
+            sig = (index, offset, sub_len)
+        elif tag_id == OTA_UPG_TAG_ID_ECDSA_SIGN_CERT:
+            cert = (offset, sub_len)
+    if sig is None:
+        return None
+    (index, sig_offset, sig_len) = sig
+    img.sig_valid = False
+    if sig_offset + sig_len > img.file_size:
+        return None # Already reported as an insufficient data error
+    if index != len(img.sub_elements) - 1:
+        img.errors.append("ECDSA signature isn't the last sub-element")
+        return None
+    if sig_len != OTA_UPG_ECDSA_SIG_LEN:
+        img.errors.append("ECDSA signature sub-element has the wrong length (expected %u, got %u)" % (OTA_UPG_ECDSA_SIG_LEN, sig_len))
+        return None
+    if cert is None:
+        img.errors.append("no ECDSA signing certificate to check the signature with")
+        return None
+    (cert_offset, cert_len) = cert
+    if cert_len != ECQV_CERT_LEN:
+        img.errors.append("ECDSA signing certificate sub-element has the wrong length (expected %u, got %u)" % (ECQV_CERT_LEN, cert_len))
+        return None
+    return (cert, (sig_offset, sig_len))
+
+def read_signature(myfile, img):
+    """Reads the ECDSA Signature and Signing Certificate sub-elements of a parsed image.
+
+    Returns (certificate, signature sub-element value, length of the signed data), or None if the image isn't
+    signed or the signature can't be checked (the reason is added to img.errors)."""
+    found = find_signature(img)
+    if found is None:
+        return None
+    ((cert_offset, cert_len), (sig_offset, sig_len)) = found
+    myfile.seek(cert_offset)
+    cert_data = myfile.read(cert_len)
+    myfile.seek(sig_offset)
+    sig_data = myfile.read(sig_len)
+    # Everything up to the signature itself is signed, including the signer IEEE address
+    return (cert_data, sig_data, sig_offset + 8)
+
+def check_signature(img, cert, sig_data, digest, ca_public_key):
+    """Checks an image's ECDSA signature over the AES-MMO digest of its signed data, setting img.sig_valid."""
+    # The signer IEEE address is little-endian like the rest of the OTA file, the certificate is big-endian
+    (img.sig_signer, ) = struct.unpack("<Q", sig_data[0:8])
+    (subject, ) = struct.unpack(">Q", cert[ECQV_CERT_SUBJECT_OFFSET:ECQV_CERT_SUBJECT_OFFSET + 8])
+    if img.sig_signer != subject:
+        img.errors.append("signer IEEE address (0x%016x) doesn't match the signing certificate subject (0x%016x)" % (img.sig_signer, subject))
+        return
+    public_key = ota_cert_keys.get((cert, ca_public_key))
+    if public_key is None:
+        try:
+            public_key = ecqv_public_key(cert, ca_public_key)
+        except ValueError, e:
+            img.errors.append("ECDSA signing certificate is invalid (%s)" % (e))
+            return
+        ota_cert_keys[(cert, ca_public_key)] = public_key
+    img.sig_valid = ecdsa_verify(public_key, digest, sig_data[8:])
+    if not img.sig_valid:
+        img.errors.append("ECDSA signature doesn't verify")
+
+def parse_file(myfile, file_size, img, header_only=False, digest=False, ca_public_key=None, profile=None):
+    """Parses a ZigBee OTA Upgrade image from an open file, filling in img. Stops at the first fatal error.
+
+    The header is pulled in with a single read, sub-elements are then walked by seeking over their values (unless
+    header_only is set, in which case nothing past the header is touched). With digest set, or a CA public key
+    (point) to verify signatures with, the file is then read through once to hash it. An OtaProfile, if given,
+    has each phase marked off as it finishes."""
+    img.file_size = file_size
+    header_ok = parse_header(myfile.read(OTA_UPG_HDR_MAX_HDR_LEN), img)
+    if profile is not None:
+        profile.mark("header")
+    if header_ok and not header_only:
+        parse_sub_elements(myfile, img)
+        if profile is not None:
+            profile.mark("sub_elements")
+
+    ranges = []
+    if digest:
+        file_hash = hashlib.sha256()
+        ranges.append((0, file_size, file_hash))
+        upg_img_hash = None
+        for (tag_id, offset, sub_len) in img.sub_elements:
+            if (tag_id == OTA_UPG_TAG_ID_UPG_IMG) and (offset + sub_len <= file_size):
+                upg_img_hash = hashlib.sha256()
+                ranges.append((offset, offset + sub_len, upg_img_hash))
+                break
+    signature = None
+    if (ca_public_key is not None) and not header_only:
+        signature = read_signature(myfile, img)
+        if signature is not None:
+            signed_hash = AesMmoHash()
+            ranges.append((0, signature[2], signed_hash))
+    if (profile is not None) and (ca_public_key is not None):
+        profile.mark("signature")
+    hash_ranges(myfile, ranges)
+    if digest:
+        img.file_sha256 = file_hash.hexdigest()
+        if upg_img_hash is not None:
+            img.upg_img_sha256 = upg_img_hash.hexdigest()
+    if profile is not None and ranges:
+        profile.mark("digest")
+    if signature is not None:
+        check_signature(img, signature[0], signature[1], signed_hash.digest(), ca_public_key)
+        if profile is not None:
+            profile.mark("signature")
+    return img
+
+def parse_stream(stream, file_size, img, header_only=False, digest=False, ca_public_key=None):
+    """Parses a ZigBee OTA Upgrade image from a forward-only stream, filling in img. Stops at the first fatal error.
+
+    Makes the same checks as parse_file() without seeking: sub-element values are read through rather than skipped,
+    feeding any digests as they go past, and the signature sub-elements are kept as they're read. file_size is None
+    if it isn't known up front (e.g. stdin), the Total Image Size is then checked once the stream runs out, which
+    means reading it to the end even with header_only set."""
+    img.file_size = file_size
+    reader = OtaStream(stream)
+    if digest:
+        file_hash = hashlib.sha256()
+        reader.ranges.append([0, None, file_hash])
+        upg_img_hash = None
+    signed_hash = None
+    signed = {}
+    values = {}
+    if (ca_public_key is not None) and not header_only:
+        signed_hash = AesMmoHash()
+        reader.ranges.append([0, None, signed_hash])
+
+    # Read exactly the header (as far as its length field says), so the stream is left at the sub-elements
+    buf = reader.read(OTA_UPG_HDR_PREFIX_STRUCT.size)
+    if len(buf) == OTA_UPG_HDR_PREFIX_STRUCT.size:
+        (file_id, hdr_ver, hdr_len) = OTA_UPG_HDR_PREFIX_STRUCT.unpack(buf)
+        buf = buf + reader.read(min(max(hdr_len, OTA_UPG_HDR_MIN_HDR_LEN), OTA_UPG_HDR_MAX_HDR_LEN) - len(buf))
+    header_ok = parse_header(buf, img)
+
+    if header_ok and not header_only:
+        offset = img.hdr_len
+        while True:
+            buf = reader.read(OTA_UPG_SUB_ELEM_STRUCT.size)
+            if len(buf) != OTA_UPG_SUB_ELEM_STRUCT.size:
+                break # EOF
+            (tag_id, sub_len) = OTA_UPG_SUB_ELEM_STRUCT.unpack(buf)
+            offset = offset + OTA_UPG_SUB_ELEM_STRUCT.size
+            img.sub_elements.append((tag_id, offset, sub_len))
+            if (file_size is not None) and (offset + sub_len > file_size):
+                img.errors.append("insufficient data for sub-element (expected %u, got %u)" % (sub_len, file_size - offset))
+                break
+            if digest and (tag_id == OTA_UPG_TAG_ID_UPG_IMG) and (upg_img_hash is None):
+                upg_img_hash = hashlib.sha256()
+                upg_img_end = offset + sub_len
+                reader.ranges.append([offset, upg_img_end, upg_img_hash])
+            # Only values that could pass the signature checks are kept, the signed data ends after the signer address
+            if (signed_hash is not None) and (tag_id == OTA_UPG_TAG_ID_ECDSA_SIG) and (sub_len == OTA_UPG_ECDSA_SIG_LEN):
+                value = reader.read(8)
+                signed[offset] = signed_hash.copy()
+                value = value + reader.read(sub_len - 8)
+                values[offset] = value
+                n = len(value)
+            elif (signed_hash is not None) and (tag_id == OTA_UPG_TAG_ID_ECDSA_SIGN_CERT) and (sub_len == ECQV_CERT_LEN):
+                value = reader.read(sub_len)
+                values[offset] = value
+                n = len(value)
+            else:
+                n = reader.skip(sub_len)
+            if n < sub_len:
+                img.errors.append("insufficient data for sub-element (expected %u, got %u)" % (sub_len, n))
+                break
+            offset = offset + sub_len
+
+    # The rest is only needed for the whole file digest, or to find out how big the image was
+    if digest or (file_size is None):
+        reader.skip()
+    if file_size is None:
+        img.file_size = reader.pos
+        # Where parse_header() would have checked it, had the size been known
+        if (img.total_img_sz is not None) and not (img.field_ctrl & ~OTA_UPG_HDR_FIELD_CTRL_MASK) and (img.file_size != img.total_img_sz):
+            img.errors.append("file size doesn't match total image size in header (expected %u, got %u)" % (img.file_size, img.total_img_sz))
+    if digest:
+        img.file_sha256 = file_hash.hexdigest()
+        if (upg_img_hash is not None) and (reader.pos >= upg_img_end):
+            img.upg_img_sha256 = upg_img_hash.hexdigest()
+    if header_ok and (signed_hash is not None):
+        found = find_signature(img)
+        if found is not None:
+            ((cert_offset, cert_len), (sig_offset, sig_len)) = found
+            if (cert_offset in values) and (sig_offset in values):
+                check_signature(img, values[cert_offset], values[sig_offset], signed[sig_offset].digest(), ca_public_key)
+    return img
+
+def parse_image(filepath, header_only=False, digest=False, ca_public_key=None, profile=False):
+    """Parses a ZigBee OTA Upgrade image file, returns an OtaImage (check its errors rather than catching).
+
+    With profile set, img.profile is an OtaProfile of the parse."""
+    img = OtaImage(filepath)
+    if profile:
+        return profile_parse_image(img, header_only, digest, ca_public_key)
+    try:
+        # Unbuffered, every read is sized to exactly what's needed and anything else is a seek
+        with open(filepath, "rb", 0) as myfile:
+            parse_file(myfile, os.fstat(myfile.fileno()).st_size, img, header_only, digest, ca_public_key)
+    except (IOError, OSError), e:
+        img.errors.append(str(e))
+    return img
+
+def parse_archive(archivepath, header_only=False, digest=False, ca_public_key=None):
+    """Parses each file in a zip or tar archive as a ZigBee OTA Upgrade image, streaming it out of the archive.
+
+    Yields an OtaImage per member, with a path of <archive path>/<member name>. Tar archives (compressed or not)
+    are read through once, front to back. Trouble with the archive itself is yielded as an image for the archive
+    path with the error, after any members that were read before it."""
+    try:
+        if archivepath.endswith(OTA_ARCHIVE_ZIP_SUFFIXES):
+            with zipfile.ZipFile(archivepath, "r") as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith("/"):
+                        continue
+                    img = OtaImage("%s/%s" % (archivepath, os.path.normpath(info.filename)))
+                    try:
+                        with archive.open(info) as member:
+                            parse_stream(member, info.file_size, img, header_only, digest, ca_public_key)
+                    except OTA_ARCHIVE_ERRORS, e:
+                        img.errors.append(str(e))
+                    yield img
+        else:
+            with tarfile.open(archivepath, "r|*") as archive:
+                for info in archive:
+                    if not info.isfile():
+                        continue
+                    img = OtaImage("%s/%s" % (archivepath, os.path.normpath(info.name)))
+                    try:
+                        parse_stream(archive.extractfile(info), info.size, img, header_only, digest, ca_public_key)
+                    except OTA_ARCHIVE_ERRORS, e:
+                        img.errors.append(str(e))
+                    yield img
+    except OTA_ARCHIVE_ERRORS, e:
+        img = OtaImage(archivepath)
+        img.errors.append("unable to read archive: %s" % (e))
+        yield img
+
+def libc_memmem():
+    """Looks up libc memmem() and PyObject_AsReadBuffer() through ctypes, returns them or None if they can't be had."""
+    if "memmem" in libc_search_functions:
+        return libc_search_functions["memmem"]
+    libc_search_functions["memmem"] = None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        memmem = libc.memmem
+        as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+    except (ImportError, OSError, AttributeError):
+        return None
+    memmem.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_size_t]
+    memmem.restype = ctypes.c_void_p
+    as_read_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)]
+    libc_search_functions["memmem"] = (memmem, as_read_buffer)
+    return libc_search_functions["memmem"]
+
+def magic_finder(mapped):
+    """Returns a find(pos) function, giving the offset of the next OTA_CARVE_MAGIC in mapped from pos (or -1).
+
+    Searches with libc memmem() (vectorised in glibc, several times quicker than mmap.find()) straight over the
+    mapping, or with mapped.find() if that isn't available. mapped has to stay open while find() is in use."""
+    functions = libc_memmem()
+    if functions is not None:
+        import ctypes
+        (memmem, as_read_buffer) = functions
+        addr = ctypes.c_void_p()
+        size = ctypes.c_ssize_t()
+        try:
+            as_read_buffer(mapped, ctypes.byref(addr), ctypes.byref(size))
+        except TypeError:
+            functions = None
+    if functions is None:
+        return lambda pos: mapped.find(OTA_CARVE_MAGIC, pos)
+    (base, length) = (addr.value, size.value)
+    def find(pos):
+        if pos >= length:
+            return -1
+        hit = memmem(base + pos, length - pos, OTA_CARVE_MAGIC, len(OTA_CARVE_MAGIC))
+        if not hit:
+            return -1
+        return hit - base
+    return find
+
+def carve_images(mapped, path=None, header_only=False, digest=False, ca_public_key=None):
+    """Finds ZigBee OTA Upgrade images embedded anywhere in a mapped file (or string), e.g. a flash dump or a bundle.
+
+    Yields (offset, OtaImage) for each candidate, a spot where the upgrade file identifier turns up. The search is
+    done in C (see magic_finder()), never a byte at a time in Python. A candidate has to pass the
+    header checks, and its Total Image Size has to fit in what's left, before it's parsed in place like any other
+    image. The search carries on after a valid image (so nothing inside one is reported), or from the next byte
+    after an invalid candidate. Images are named <path>@<offset in hex>."""
+    find = magic_finder(mapped)
+    pos = find(0)
+    while pos >= 0:
+        img = OtaImage("%s@0x%08x" % (path, pos))
+        if parse_header(mapped[pos:pos + OTA_UPG_HDR_MAX_HDR_LEN], img):
+            if img.total_img_sz < img.hdr_len:
+                img.errors.append("total image size is smaller than the header (%u bytes)" % (img.total_img_sz))
+            elif pos + img.total_img_sz > len(mapped):
+                img.errors.append("total image size runs past the end of the file (expected %u, got %u)" % (img.total_img_sz, len(mapped) - pos))
+            else:
+                size = img.total_img_sz
+                img = OtaImage(img.path)
+                parse_file(OtaRegion(mapped, pos, size), size, img, header_only, digest, ca_public_key)
+        yield (pos, img)
+        if img.valid:
+            pos = find(pos + img.total_img_sz)
+        else:
+            pos = find(pos + 1)
+
+def profile_parse_image(img, header_only=False, digest=False, ca_public_key=None):
+    """parse_image() with an OtaProfile, kept apart so the usual path doesn't pay for it."""
+    img.profile = profile = OtaProfile()
+    profile.images = 1
+    profile.start()
+    try:
+        with open(img.path, "rb", 0) as myfile:
+            file_size = os.fstat(myfile.fileno()).st_size
+            profile.mark("open")
+            parse_file(OtaCountingFile(myfile, profile), file_size, img, header_only, digest, ca_public_key, profile)
+    except (IOError, OSError), e:
+        img.errors.append(str(e))
+    profile.sample_memory()
+    return img
+
+load_mfg_codes(MFG_CODES_FILE)
@@ -0,0 +1,367 @@
+# ZigBee Smart Energy crypto suite 1 primitives, for OTA Upgrade image signatures
+#
+# AES-MMO hashing, ECQV implicit certificates and ECDSA over sect163k1 in plain Python (the AES block cipher is
+# handed off to PyCrypto when it's installed). Just the verifying side: enough to check an ECDSA Signature
+# sub-element against its ECDSA Signing Certificate sub-element and a CA public key. AES-CCM* decryption is here
+# too, for reading NWK secured frames out of captures. Known answer tests are in tests/test_zigbee_ota_crypto.py.
+
+# Imports
+import struct
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+# Useful Defines
+AES_BLOCK_SIZE = 16
+CCM_STAR_L = 2 # Length field size, which leaves 13 bytes for the nonce
+CCM_STAR_NONCE_LEN = AES_BLOCK_SIZE - 1 - CCM_STAR_L
+SECT163K1_M = 163
+SECT163K1_POLY = (1 << 163) | (1 << 7) | (1 << 6) | (1 << 3) | 1
+SECT163K1_MASK = (1 << 163) - 1
+SECT163K1_A = 1
+SECT163K1_B = 1
+SECT163K1_GX = 0x02fe13c0537bbc11acaa07d793de4e6d5e5c94eee8
+SECT163K1_GY = 0x0289070fb05d38ff58321f2e800536d538ccdaa3d9
+SECT163K1_N = 0x04000000000000000000020108a2e0cc0d99f8a5ef
+SECT163K1_G = (SECT163K1_GX, SECT163K1_GY)
+SECT163K1_SCALAR_LEN = 21
+SECT163K1_POINT_LEN = 1 + SECT163K1_SCALAR_LEN # Compressed
+ECQV_CERT_LEN = 48 # Public reconstruction key, subject, issuer, profile attribute data
+ECQV_CERT_SUBJECT_OFFSET = SECT163K1_POINT_LEN
+ECQV_CERT_ISSUER_OFFSET = ECQV_CERT_SUBJECT_OFFSET + 8
+ECDSA_SIG_LEN = 2 * SECT163K1_SCALAR_LEN # r, s
+
+# Block ciphers already set up by aes_block_cipher(), keyed by AES key (only a handful are ever in play)
+aes_block_ciphers = {}
+
+# AES Tables
+def aes_tables():
+    """Builds the AES S-box, the four encryption T-tables and the key schedule round constants."""
+    sbox = [0] * 256
+    p = 1
+    q = 1
+    while True:
+        # p steps through the multiplicative group by multiplying by 3, q tracks its inverse
+        p = (p ^ (p << 1) ^ (0x1b if p & 0x80 else 0)) & 0xff
+        q = (q ^ (q << 1)) & 0xff
+        q = (q ^ (q << 2)) & 0xff
+        q = (q ^ (q << 4)) & 0xff
+        if q & 0x80:
+            q = q ^ 0x09
+        x = q
+        for shift in (1, 2, 3, 4):
+            x = x ^ (((q << shift) | (q >> (8 - shift))) & 0xff)
+        sbox[p] = x ^ 0x63
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    te0 = []
+    for s in sbox:
+        s2 = ((s << 1) ^ (0x1b if s & 0x80 else 0)) & 0xff
+        te0.append((s2 << 24) | (s << 16) | (s << 8) | (s2 ^ s))
+    te1 = [((t >> 8) | (t << 24)) & 0xffffffff for t in te0]
+    te2 = [((t >> 8) | (t << 24)) & 0xffffffff for t in te1]
+    te3 = [((t >> 8) | (t << 24)) & 0xffffffff for t in te2]
+    rcon = [0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36]
+    return (sbox, te0, te1, te2, te3, rcon)
+
+(AES_SBOX, AES_TE0, AES_TE1, AES_TE2, AES_TE3, AES_RCON) = aes_tables()
+
+# AES-128
+def aes_expand_key(k0, k1, k2, k3):
+    """Expands an AES-128 key, given as four big-endian words, into the 44 round key words."""
+    sbox = AES_SBOX
+    w = [k0, k1, k2, k3]
+    for rcon in AES_RCON:
+        t = w[-1]
+        t = ((sbox[(t >> 16) & 0xff] << 24) | (sbox[(t >> 8) & 0xff] << 16) | (sbox[t & 0xff] << 8) | sbox[t >> 24]) ^ (rcon << 24)
+        w.append(w[-4] ^ t)
+        w.append(w[-4] ^ w[-1])
+        w.append(w[-4] ^ w[-1])
+        w.append(w[-4] ^ w[-1])
+    return w
+
+def aes_encrypt_words(w, s0, s1, s2, s3):
+    """Encrypts one block, given as four big-endian words, with expanded key w. Returns four words."""
+    te0 = AES_TE0
+    te1 = AES_TE1
+    te2 = AES_TE2
+    te3 = AES_TE3
+    sbox = AES_SBOX
+    s0 = s0 ^ w[0]
+    s1 = s1 ^ w[1]
+    s2 = s2 ^ w[2]
+    s3 = s3 ^ w[3]
+    for r in xrange(4, 40, 4):
+        t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xff] ^ te2[(s2 >> 8) & 0xff] ^ te3[s3 & 0xff] ^ w[r]
+        t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xff] ^ te2[(s3 >> 8) & 0xff] ^ te3[s0 & 0xff] ^ w[r + 1]
+        t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xff] ^ te2[(s0 >> 8) & 0xff] ^ te3[s1 & 0xff] ^ w[r + 2]
+        t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xff] ^ te2[(s1 >> 8) & 0xff] ^ te3[s2 & 0xff] ^ w[r + 3]
+        (s0, s1, s2, s3) = (t0, t1, t2, t3)
+    return ((sbox[s0 >> 24] << 24 | sbox[(s1 >> 16) & 0xff] << 16 | sbox[(s2 >> 8) & 0xff] << 8 | sbox[s3 & 0xff]) ^ w[40],
+            (sbox[s1 >> 24] << 24 | sbox[(s2 >> 16) & 0xff] << 16 | sbox[(s3 >> 8) & 0xff] << 8 | sbox[s0 & 0xff]) ^ w[41],
+            (sbox[s2 >> 24] << 24 | sbox[(s3 >> 16) & 0xff] << 16 | sbox[(s0 >> 8) & 0xff] << 8 | sbox[s1 & 0xff]) ^ w[42],
+            (sbox[s3 >> 24] << 24 | sbox[(s0 >> 16) & 0xff] << 16 | sbox[(s1 >> 8) & 0xff] << 8 | sbox[s2 & 0xff]) ^ w[43])
+
+def aes_block_cipher(key):
+    """Returns a function encrypting 16 byte blocks with a 16 byte AES-128 key, the key is only expanded once."""
+    cipher = aes_block_ciphers.get(key)
+    if cipher is None:
+        if AES is not None:
+            cipher = AES.new(key, AES.MODE_ECB).encrypt
+        else:
+            w = aes_expand_key(*struct.unpack(">4I", key))
+            cipher = lambda block: struct.pack(">4I", *aes_encrypt_words(w, *struct.unpack(">4I", block)))
+        aes_block_ciphers[key] = cipher
+    return cipher
+
+# AES-CCM* (annex A of the ZigBee specification)
+def xor_bytes(a, b):
+    """XORs two strings together, up to the length of the shorter one."""
+    length = min(len(a), len(b))
+    if not length:
+        return ""
+    return ("%0*x" % (2 * length, int(a[:length].encode("hex"), 16) ^ int(b[:length].encode("hex"), 16))).decode("hex")
+
+def ccm_star_mac(cipher, nonce, auth_data, data, mic_len):
+    """Returns the (unencrypted) CBC-MAC authentication tag over auth_data and data."""
+    flags = (((mic_len - 2) // 2) << 3) | (CCM_STAR_L - 1)
+    if auth_data:
+        flags = flags | 0x40
+    blocks = [chr(flags) + nonce + struct.pack(">H", len(data))]
+    if auth_data:
+        auth_data = struct.pack(">H", len(auth_data)) + auth_data
+        blocks.append(auth_data + "\0" * (-len(auth_data) % AES_BLOCK_SIZE))
+    blocks.append(data + "\0" * (-len(data) % AES_BLOCK_SIZE))
+    blocks = "".join(blocks)
+    x = "\0" * AES_BLOCK_SIZE
+    for offset in xrange(0, len(blocks), AES_BLOCK_SIZE):
+        x = cipher(xor_bytes(x, blocks[offset:offset + AES_BLOCK_SIZE]))
+    return x[:mic_len]
+
+def ccm_star_keystream(cipher, nonce, length):
+    """Returns the counter mode key stream blocks A_0 onwards, enough to cover a tag block and length bytes."""
+    return "".join([cipher(chr(CCM_STAR_L - 1) + nonce + struct.pack(">H", counter)) for counter in xrange(1 + (length + AES_BLOCK_SIZE - 1) // AES_BLOCK_SIZE)])
+
+def ccm_star_decrypt(key, nonce, auth_data, data, mic_len):
+    """Decrypts data (the ciphertext with its tag appended), returns the plaintext or None if the tag doesn't match."""
+    if len(data) < mic_len:
+        return None
+    cipher = aes_block_cipher(key)
+    stream = ccm_star_keystream(cipher, nonce, len(data) - mic_len)
+    plaintext = xor_bytes(data[:len(data) - mic_len], stream[AES_BLOCK_SIZE:])
+    if mic_len and (xor_bytes(data[len(data) - mic_len:], stream) != ccm_star_mac(cipher, nonce, auth_data, plaintext, mic_len)):
+        return None
+    return plaintext
+
+# AES-MMO Hash
+class AesMmoHash(object):
+    """Streaming AES-MMO (Matyas-Meyer-Oseas) hash, as specified in annex B.6 of the ZigBee specification.
+
+    Same interface as the hashlib objects (update(), digest(), hexdigest()). Messages of 2^16 bits or more use the
+    32-bit length padding."""
+
+    def __init__(self, data=""):
+        self.h = (0, 0, 0, 0)
+        self.length = 0
+        self.partial = ""
+        if data:
+            self.update(data)
+
+    def blocks(self, data, end):
+        """Hashes the whole blocks in data[0:end]."""
+        h = self.h
+        if AES is not None:
+            key = struct.pack(">4I", *h)
+            for offset in xrange(0, end, AES_BLOCK_SIZE):
+                m = struct.unpack_from(">4I", data, offset)
+                c = struct.unpack(">4I", AES.new(key, AES.MODE_ECB).encrypt(buffer(data, offset, AES_BLOCK_SIZE)))
+                h = (c[0] ^ m[0], c[1] ^ m[1], c[2] ^ m[2], c[3] ^ m[3])
+                key = struct.pack(">4I", *h)
+        else:
+            for offset in xrange(0, end, AES_BLOCK_SIZE):
+                m = struct.unpack_from(">4I", data, offset)
+                c = aes_encrypt_words(aes_expand_key(*h), *m)
+                h = (c[0] ^ m[0], c[1] ^ m[1], c[2] ^ m[2], c[3] ^ m[3])
+        self.h = h
+
+    def update(self, data):
+        self.length = self.length + len(data)
+        if self.partial:
+            fill = AES_BLOCK_SIZE - len(self.partial)
+            self.partial = self.partial + str(buffer(data, 0, fill))
+            data = buffer(data, fill)
+            if len(self.partial) < AES_BLOCK_SIZE:
+                return
+            self.blocks(self.partial, AES_BLOCK_SIZE)
+            self.partial = ""
+        end = len(data) - (len(data) % AES_BLOCK_SIZE)
+        self.blocks(data, end)
+        self.partial = str(buffer(data, end))
+
+    def digest(self):
+        bits = self.length * 8
+        if bits >= (1 << 32):
+            raise ValueError("AES-MMO can't hash messages of 2^32 bits or more")
+        # A 1 bit, then 0 bits up to the length field, which ends on a block boundary
+        if bits < (1 << 16):
+            pad_to = AES_BLOCK_SIZE - 2
+            length = struct.pack(">H", bits)
+        else:
+            pad_to = AES_BLOCK_SIZE - 6
+            length = struct.pack(">IH", bits, 0)
+        tail = self.partial + "\x80"
+        tail = tail + "\0" * ((pad_to - len(tail)) % AES_BLOCK_SIZE) + length
+        saved = (self.h, self.partial)
+        self.blocks(tail, len(tail))
+        digest = struct.pack(">4I", *self.h)
+        (self.h, self.partial) = saved
+        return digest
+
+    def hexdigest(self):
+        return self.digest().encode("hex")
+
+    def copy(self):
+        other = AesMmoHash()
+        (other.h, other.length, other.partial) = (self.h, self.length, self.partial)
+        return other
+
+def bytes_to_int(data):
+    """Converts a big-endian octet string to an integer."""
+    return int(str(data).encode("hex") or "0", 16)
+
+# GF(2^163) Arithmetic
+def gf_reduce(c):
+    """Reduces a polynomial modulo the sect163k1 field polynomial x^163 + x^7 + x^6 + x^3 + 1."""
+    while c >> SECT163K1_M:
+        hi = c >> SECT163K1_M
+        c = (c & SECT163K1_MASK) ^ hi ^ (hi << 3) ^ (hi << 6) ^ (hi << 7)
+    return c
+
+def gf_mul(a, b):
+    """Multiplies two field elements, four bits of b at a time."""
+    t = [0] * 16
+    for i in xrange(1, 16):
+        t[i] = (t[i >> 1] << 1) ^ (a if i & 1 else 0)
+    r = 0
+    for shift in xrange(SECT163K1_M - (SECT163K1_M % 4), -4, -4):
+        r = (r << 4) ^ t[(b >> shift) & 0xf]
+    return gf_reduce(r)
+
+def gf_inv(a):
+    """Inverts a non-zero field element with the binary extended Euclidean algorithm."""
+    u = a
+    v = SECT163K1_POLY
+    g1 = 1
+    g2 = 0
+    while u != 1:
+        j = u.bit_length() - v.bit_length()
+        if j < 0:
+            (u, v) = (v, u)
+            (g1, g2) = (g2, g1)
+            j = -j
+        u = u ^ (v << j)
+        g1 = g1 ^ (g2 << j)
+    return gf_reduce(g1)
+
+# sect163k1 Curve Arithmetic (y^2 + xy = x^3 + ax^2 + b, affine, None is the point at infinity)
+def point_add(p, q):
+    """Adds two curve points."""
+    if p is None:
+        return q
+    if q is None:
+        return p
+    (x1, y1) = p
+    (x2, y2) = q
+    if x1 == x2:
+        if y1 != y2:
+            return None # q == -p
+        return point_double(p)
+    l = gf_mul(y1 ^ y2, gf_inv(x1 ^ x2))
+    x3 = gf_mul(l, l) ^ l ^ x1 ^ x2 ^ SECT163K1_A
+    y3 = gf_mul(l, x1 ^ x3) ^ x3 ^ y1
+    return (x3, y3)
+
+def point_double(p):
+    """Doubles a curve point."""
+    if (p is None) or (p[0] == 0):
+        return None
+    (x1, y1) = p
+    l = x1 ^ gf_mul(y1, gf_inv(x1))
+    x3 = gf_mul(l, l) ^ l ^ SECT163K1_A
+    y3 = gf_mul(x1, x1) ^ gf_mul(l ^ 1, x3)
+    return (x3, y3)
+
+def point_mul(k, p):
+    """Multiplies a curve point by a scalar."""
+    r = None
+    for bit in xrange(k.bit_length() - 1, -1, -1):
+        r = point_double(r)
+        if (k >> bit) & 1:
+            r = point_add(r, p)
+    return r
+
+def point_mul_add(k1, p1, k2, p2):
+    """Computes k1*p1 + k2*p2 in one pass (Shamir's trick)."""
+    both = point_add(p1, p2)
+    r = None
+    for bit in xrange(max(k1.bit_length(), k2.bit_length()) - 1, -1, -1):
+        r = point_double(r)
+        sel = ((k1 >> bit) & 1) | (((k2 >> bit) & 1) << 1)
+        if sel == 1:
+            r = point_add(r, p1)
+        elif sel == 2:
+            r = point_add(r, p2)
+        elif sel == 3:
+            r = point_add(r, both)
+    return r
+
+def point_decode(data):
+    """Decodes a compressed (SEC 1 2.3.4) point, raises ValueError if it isn't a valid curve point."""
+    data = str(data)
+    if (len(data) != SECT163K1_POINT_LEN) or (data[0] not in "\x02\x03"):
+        raise ValueError("not a compressed sect163k1 point")
+    x = bytes_to_int(data[1:])
+    if x >> SECT163K1_M:
+        raise ValueError("point x-coordinate isn't a field element")
+    if x == 0:
+        # sqrt(b), b is 1
+        return (0, 1)
+    beta = x ^ SECT163K1_A ^ gf_mul(SECT163K1_B, gf_inv(gf_mul(x, x)))
+    # Solve z^2 + z = beta with the half-trace (m is odd)
+    z = beta
+    for i in xrange((SECT163K1_M - 1) / 2):
+        zz = gf_mul(z, z)
+        z = gf_mul(zz, zz) ^ beta
+    if (gf_mul(z, z) ^ z) != beta:
+        raise ValueError("point isn't on the curve")
+    if (z & 1) != (ord(data[0]) & 1):
+        z = z ^ 1
+    return (x, gf_mul(x, z))
+
+# ECQV Implicit Certificates
+def ecqv_cert_hash(cert):
+    """Hashes a certificate to the integer e used in public (and private) key reconstruction."""
+    return bytes_to_int(AesMmoHash(cert).digest()) % SECT163K1_N
+
+def ecqv_public_key(cert, ca_public_key):
+    """Reconstructs the subject's public key from a 48 byte implicit certificate and the CA's public key point."""
+    if len(cert) != ECQV_CERT_LEN:
+        raise ValueError("certificate isn't %u bytes" % (ECQV_CERT_LEN))
+    public_key = point_add(point_mul(ecqv_cert_hash(cert), point_decode(cert[0:SECT163K1_POINT_LEN])), ca_public_key)
+    if public_key is None:
+        raise ValueError("certificate reconstructs the point at infinity")
+    return public_key
+
+# ECDSA
+def ecdsa_verify(public_key, digest, signature):
+    """Verifies a 42 byte (r, s) ECDSA signature of a digest."""
+    r = bytes_to_int(signature[0:SECT163K1_SCALAR_LEN])
+    s = bytes_to_int(signature[SECT163K1_SCALAR_LEN:ECDSA_SIG_LEN])
+    if (len(signature) != ECDSA_SIG_LEN) or not (0 < r < SECT163K1_N) or not (0 < s < SECT163K1_N):
+        return False
+    w = pow(s, SECT163K1_N - 2, SECT163K1_N)
+    p = point_mul_add((bytes_to_int(digest) * w) % SECT163K1_N, SECT163K1_G, (r * w) % SECT163K1_N, public_key)
+    return (p is not None) and (p[0] % SECT163K1_N == r)